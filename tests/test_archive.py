@@ -0,0 +1,135 @@
+"""
+Архивирование старых файлов upk_archive
+"""
+
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from upk_archive import DataArchiver, archive_manifest_filename, find_in_archive
+
+now = datetime(2021, 10, 10, 12, 0).timestamp()
+
+
+def day_time(day, hour=12):
+    return datetime(2021, 10, day, hour, 0).timestamp()
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    data_dir, archive_dir = tmp_path / 'data', tmp_path / 'archive'
+    data_dir.mkdir()
+    return data_dir, archive_dir
+
+
+def add_file(data_dir, name, mtime, content=None):
+    file_name = data_dir / name
+    file_name.write_bytes(content if content is not None else name.encode() * 100)
+    os.utime(file_name, (mtime, mtime))
+    return file_name
+
+
+def make_archiver(data_dir, archive_dir):
+    return DataArchiver(str(data_dir), str(archive_dir), ['*.txt', '*.log'], max_age_sec=2 * 86400,
+                        max_rate_bytes_per_sec=0)
+
+
+def load_manifest(archive_dir):
+    with open(archive_dir / archive_manifest_filename) as f:
+        return json.load(f)
+
+
+def test_aged_days_are_archived_and_removed(dirs):
+    data_dir, archive_dir = dirs
+    add_file(data_dir, 'a.txt', day_time(1, 10))
+    add_file(data_dir, 'b.txt', day_time(1, 11))
+    add_file(data_dir, 'c.log', day_time(2))
+    add_file(data_dir, 'recent.txt', day_time(9))  # день еще не закончился до границы
+    add_file(data_dir, 'other.bin', day_time(1))  # не по шаблону
+
+    files, size = make_archiver(data_dir, archive_dir).run_once(now)
+    assert (files, size) == (3, 3 * 500)
+    assert sorted(os.listdir(data_dir)) == ['other.bin', 'recent.txt']
+
+    manifest = load_manifest(archive_dir)
+    assert sorted(manifest) == ['2021-10/2021-10-01_1.zip', '2021-10/2021-10-02_1.zip']
+    info = manifest['2021-10/2021-10-01_1.zip']
+    assert (info['day'], info['files'], info['bytes']) == ('2021-10-01', 2, 1000)
+    assert (info['first_mtime'], info['last_mtime']) == (day_time(1, 10), day_time(1, 11))
+    assert 'not_removed' not in info
+    with zipfile.ZipFile(archive_dir / '2021-10/2021-10-01_1.zip') as zf:
+        assert zf.read('b.txt') == b'b.txt' * 100
+    assert find_in_archive(str(archive_dir), '*.log') == [('2021-10/2021-10-02_1.zip', 'c.log')]
+    assert not [name for name in os.listdir(archive_dir / '2021-10') if name.endswith('.tmp')]
+
+
+def test_late_file_goes_to_the_next_part(dirs):
+    data_dir, archive_dir = dirs
+    add_file(data_dir, 'a.txt', day_time(1))
+    archiver = make_archiver(data_dir, archive_dir)
+    archiver.run_once(now)
+    add_file(data_dir, 'late.txt', day_time(1, 20))
+    assert archiver.run_once(now)[0] == 1
+    assert sorted(load_manifest(archive_dir)) == ['2021-10/2021-10-01_1.zip', '2021-10/2021-10-01_2.zip']
+
+
+@pytest.fixture
+def locked(monkeypatch):
+    """
+    Имена файлов, удаление которых не удается (как открытого лога на Windows)
+    """
+    names = set()
+    remove = os.remove
+
+    def locked_remove(path):
+        if os.path.basename(path) in names:
+            raise PermissionError(13, 'file is used by another process', path)
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', locked_remove)
+    return names
+
+
+def test_not_removed_file_is_not_archived_again_after_restart(dirs, locked):
+    data_dir, archive_dir = dirs
+    add_file(data_dir, 'a.txt', day_time(1))
+    add_file(data_dir, 'server.log', day_time(1, 13))
+    locked.add('server.log')
+
+    assert make_archiver(data_dir, archive_dir).run_once(now)[0] == 2
+    assert os.listdir(data_dir) == ['server.log']
+    part = load_manifest(archive_dir)['2021-10/2021-10-01_1.zip']
+    assert part['not_removed'] == {'server.log': day_time(1, 13)}
+
+    # перезапуск программы: файл все еще открыт, затем освобожден
+    archiver = make_archiver(data_dir, archive_dir)
+    assert archiver.run_once(now) == (0, 0)
+    locked.clear()
+    assert archiver.run_once(now) == (0, 0)
+    assert os.listdir(data_dir) == []
+    manifest = load_manifest(archive_dir)
+    assert list(manifest) == ['2021-10/2021-10-01_1.zip']
+    assert 'not_removed' not in manifest['2021-10/2021-10-01_1.zip']
+
+
+def test_not_removed_file_changed_after_archiving_is_archived_again(dirs, locked):
+    data_dir, archive_dir = dirs
+    add_file(data_dir, 'server.log', day_time(1))
+    locked.add('server.log')
+    make_archiver(data_dir, archive_dir).run_once(now)
+
+    add_file(data_dir, 'server.log', day_time(2), b'new content')
+    locked.clear()
+    archiver = make_archiver(data_dir, archive_dir)
+    assert archiver.run_once(now) == (1, len(b'new content'))
+    manifest = load_manifest(archive_dir)
+    assert sorted(manifest) == ['2021-10/2021-10-01_1.zip', '2021-10/2021-10-02_1.zip']
+    assert not any('not_removed' in info for info in manifest.values())
+
+
+def test_archive_folder_should_not_be_the_data_folder(tmp_path):
+    with pytest.raises(ValueError):
+        DataArchiver(str(tmp_path), str(tmp_path), ['*.txt'], 86400)
@@ -0,0 +1,155 @@
+"""
+DirSizeTracker и наблюдатели за папкой с данными
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+from upk_bench import get_dir_size_bytes
+from upk_dir_monitor import DirSizeTracker, InotifyDirWatcher, PollingDirWatcher, create_stream_key
+
+inotify_only = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+
+
+def write(dir_path, name, size):
+    with open(os.path.join(dir_path, name), 'ab') as f:
+        f.write(b'0' * size)
+
+
+def test_bytes_written_do_not_decrease_on_delete(tmp_path):
+    write(tmp_path, 'a.txt', 100)
+    tracker = DirSizeTracker(str(tmp_path), '*.txt')
+    tracker.scan()
+    write(tmp_path, 'a.txt', 50)
+    write(tmp_path, 'b.txt', 10)
+    tracker.scan()
+    assert (tracker.total_size, tracker.bytes_written) == (160, 160)
+    os.remove(tmp_path / 'a.txt')
+    tracker.scan()
+    assert (tracker.total_size, tracker.bytes_written) == (10, 160)
+
+
+def test_tracker_matches_full_glob_walk(tmp_path):
+    for i in range(20):
+        write(tmp_path, f'{i}.txt', i * 10)
+    write(tmp_path, 'other.log', 1000)
+    tracker = DirSizeTracker(str(tmp_path), '*.txt')
+    assert tracker.scan() == get_dir_size_bytes(str(tmp_path / '*.txt')) == 1900
+
+
+def test_written_bytes_are_attributed_to_streams(tmp_path):
+    tracker = DirSizeTracker(str(tmp_path), '*.txt', create_stream_key([('ch1', 'ch1_*.txt'), ('ch2', 'ch2_*.txt')]))
+    write(tmp_path, 'ch1_1.txt', 100)
+    write(tmp_path, 'ch2_1.txt', 30)
+    write(tmp_path, 'other.txt', 7)
+    tracker.scan()
+    assert tracker.stream_bytes_written == {'ch1': 100, 'ch2': 30}
+
+    # дозапись по событию, ротация (файл перезаписан короче) - при проверке папки
+    write(tmp_path, 'ch1_1.txt', 50)
+    assert tracker.update_file('ch1_1.txt')
+    (tmp_path / 'ch2_1.txt').write_bytes(b'0' * 10)
+    write(tmp_path, 'other.txt', 7)
+    tracker.scan()
+    assert tracker.stream_bytes_written == {'ch1': 150, 'ch2': 40}
+
+    # удаленный файл больше не относится к потоку, новый файл того же потока - учитывается
+    os.remove(tmp_path / 'ch1_1.txt')
+    write(tmp_path, 'ch1_2.txt', 20)
+    tracker.scan()
+    assert tracker.stream_bytes_written == {'ch1': 170, 'ch2': 40}
+    assert tracker.bytes_written == 100 + 30 + 7 + 50 + 10 + 7 + 20
+    assert 'ch1_1.txt' not in tracker.file_streams and tracker.file_streams['other.txt'] is None
+
+
+def test_stream_key_by_file_name_pattern():
+    stream_key = create_stream_key(key_pattern=r'^(ch[0-9]+)_')
+    assert stream_key('ch12_20210831.txt') == 'ch12'
+    assert stream_key('20210831.txt') is None
+    assert create_stream_key(key_pattern=r'ch[0-9]+')('data_ch3.txt') == 'ch3'
+    assert create_stream_key() is None
+    with pytest.raises(ValueError):
+        create_stream_key([('ch1', 'ch1_*.txt')], r'^(ch[0-9]+)_')
+
+
+@inotify_only
+def test_inotify_watch_is_restored_after_folder_is_recreated(tmp_path):
+    dir_path = tmp_path / 'data'
+    dir_path.mkdir()
+    watcher = InotifyDirWatcher(DirSizeTracker(str(dir_path), '*.txt'))
+    try:
+        write(dir_path, 'a.txt', 100)
+        assert watcher.get_dir_size() == 100
+
+        shutil.rmtree(dir_path)
+        # папки нет - опрос
+        assert watcher.get_dir_size() == 0
+        assert watcher.wd < 0
+        assert watcher.get_dir_size() == 0
+
+        dir_path.mkdir()
+        write(dir_path, 'b.txt', 30)
+        assert watcher.get_dir_size() == 30
+        assert watcher.wd >= 0
+        # новые данные снова приходят событиями, без полного перечитывания папки
+        watcher.last_rescan_time = float('inf')
+        write(dir_path, 'b.txt', 20)
+        assert watcher.get_dir_size() == 50
+        assert watcher.tracker.bytes_written == 150
+    finally:
+        watcher.close()
+
+
+@inotify_only
+def test_inotify_watch_follows_the_path_after_folder_is_moved(tmp_path):
+    dir_path = tmp_path / 'data'
+    dir_path.mkdir()
+    watcher = InotifyDirWatcher(DirSizeTracker(str(dir_path), '*.txt'))
+    try:
+        write(dir_path, 'a.txt', 100)
+        assert watcher.get_dir_size() == 100
+
+        dir_path.rename(tmp_path / 'old_data')
+        dir_path.mkdir()
+        # в перемещенной папке изменения больше не учитываются
+        write(tmp_path / 'old_data', 'a.txt', 1000)
+        assert watcher.get_dir_size() == 0
+        watcher.last_rescan_time = float('inf')
+        write(dir_path, 'c.txt', 7)
+        assert watcher.get_dir_size() == 7
+    finally:
+        watcher.close()
+
+
+def test_polling_watcher_survives_missing_folder(tmp_path):
+    watcher = PollingDirWatcher(DirSizeTracker(str(tmp_path / 'data'), '*.txt'))
+    assert watcher.get_dir_size() == 0
+    (tmp_path / 'data').mkdir()
+    write(tmp_path / 'data', 'a.txt', 5)
+    assert watcher.get_dir_size() == 5
+
+
+@inotify_only
+def test_inotify_watcher_tells_when_the_folder_is_reread(tmp_path):
+    watcher = InotifyDirWatcher(DirSizeTracker(str(tmp_path), '*.txt'))
+    try:
+        # первая проверка - полное перечитывание
+        assert watcher.needs_scan()
+        write(tmp_path, 'a.txt', 10)
+        assert watcher.get_dir_size() == 10
+        assert not watcher.needs_scan()
+
+        # до срока полной проверки - только события
+        write(tmp_path, 'a.txt', 5)
+        watcher.process_events()
+        assert not watcher.needs_scan()
+        assert watcher.get_dir_size() == 15
+
+        watcher.last_rescan_time -= watcher.full_rescan_interval_sec
+        assert watcher.needs_scan()
+    finally:
+        watcher.close()
+    assert PollingDirWatcher(DirSizeTracker(str(tmp_path), '*.txt')).needs_scan()
@@ -0,0 +1,106 @@
+"""
+Кольца истории скорости upk_history
+"""
+
+import math
+
+import pytest
+
+from upk_history import HistoryStore, flag_hold_off, flag_recovery
+
+t0 = 1633046400.0  # 2021-10-01 00:00 UTC, начало часа и суток
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.bin'), raw_capacity=10)
+    yield store
+    store.close()
+
+
+def test_raw_ring_keeps_the_last_records_in_order(store):
+    for i in range(25):
+        store.append(t0 + i, 100 * i, rate_mb_per_h=float(i))
+    name, points = store.query(tier='raw')
+    assert name == 'raw'
+    assert [p.time - t0 for p in points] == list(range(15, 25))
+    assert [p.size for p in points] == [100 * i for i in range(15, 25)]
+
+    # двоичный поиск по кольцу с перезаписью
+    _, points = store.query(t0 + 17.5, t0 + 21, tier='raw')
+    assert [p.time - t0 for p in points] == [18, 19, 20]
+
+
+def test_hour_bucket_aggregates_checks(store):
+    store.append(t0 + 10, 1000, rate_mb_per_h=None, triggers=0)
+    store.append(t0 + 20, 2000, rate_mb_per_h=4.0, triggers=1, flags=flag_recovery)
+    store.append(t0 + 30, 3000, rate_mb_per_h=1.0, triggers=2)
+    store.append(t0 + 40, 3500, rate_mb_per_h=7.0, triggers=0, flags=flag_hold_off)
+    store.append(t0 + 3600, 4000, rate_mb_per_h=2.0)
+
+    _, (hour, next_hour) = store.query(tier='hour')
+    assert (hour.time, hour.min, hour.max, hour.mean, hour.count) == (t0, 1.0, 7.0, 4.0, 3)
+    assert (hour.size, hour.triggers, hour.flags) == (3500, 2, flag_recovery | flag_hold_off)
+    assert (next_hour.time, next_hour.mean, next_hour.count) == (t0 + 3600, 2.0, 1)
+
+    _, (day,) = store.query(tier='day')
+    assert (day.min, day.max, day.mean, day.count, day.size) == (1.0, 7.0, 3.5, 4, 4000)
+
+    _, raw = store.query(tier='raw')
+    assert math.isnan(raw[0].mean) and raw[0].count == 0
+
+
+def test_clock_going_back_is_ignored(store):
+    store.append(t0 + 100, 1, rate_mb_per_h=1.0)
+    store.append(t0 + 50, 2, rate_mb_per_h=1.0)
+    _, points = store.query(tier='raw')
+    assert [p.size for p in points] == [1]
+
+
+def test_reopen_continues_the_current_bucket(tmp_path):
+    file_name = str(tmp_path / 'history.bin')
+    store = HistoryStore(file_name, raw_capacity=10)
+    store.append(t0 + 1, 10, rate_mb_per_h=2.0)
+    store.close()
+
+    store = HistoryStore(file_name, raw_capacity=10)
+    store.append(t0 + 2, 20, rate_mb_per_h=4.0)
+    store.close()
+
+    reader = HistoryStore(file_name, readonly=True)
+    try:
+        _, (hour,) = reader.query(tier='hour')
+        assert (hour.mean, hour.count, hour.size) == (3.0, 2, 20)
+        assert len(reader.query(tier='raw')[1]) == 2
+    finally:
+        reader.close()
+
+    # другая емкость - история начинается заново
+    store = HistoryStore(file_name, raw_capacity=20)
+    assert store.query(tier='raw')[1] == []
+    store.close()
+
+
+def test_auto_tier_choice(store):
+    for i in range(10):
+        store.append(t0 + 600 * i, i, rate_mb_per_h=1.0)
+    assert store.query(max_points=100)[0] == 'raw'
+    assert store.query(max_points=5)[0] == 'hour'
+    assert store.query(max_points=1)[0] == 'day'
+
+    # raw перезаписан - начало диапазона раньше его первой записи
+    for i in range(10, 15):
+        store.append(t0 + 600 * i, i, rate_mb_per_h=1.0)
+    assert store.query(t0, max_points=100)[0] == 'hour'
+    assert store.query(t0 + 600 * 8, max_points=100)[0] == 'raw'
+
+
+def test_readonly_needs_a_history_file(tmp_path):
+    (tmp_path / 'other.bin').write_bytes(b'x' * 100)
+    with pytest.raises(ValueError):
+        HistoryStore(str(tmp_path / 'other.bin'), readonly=True)
+
+
+def test_unknown_tier(store):
+    with pytest.raises(ValueError):
+        store.query(tier='week')
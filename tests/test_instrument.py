@@ -0,0 +1,307 @@
+"""
+InstrumentSupervisor на имитированных службе и ИТО
+"""
+
+import asyncio
+import configparser
+import time
+
+import pytest
+
+import upk_instrument
+from upk_history import history_filename
+from upk_instrument import InstrumentSettings, InstrumentSupervisor, run_step, state_filename
+from upk_log_reader import upk_log_index_filename
+from upk_scheduler import DeadlineScheduler
+from upk_sim import SyntheticDataWriter
+from upk_state import StateFile, SupervisorState
+
+
+def make_settings(tmp_path, **options):
+    """
+    Настройки пары 'a'; options - параметры секции [instrument:a]
+    """
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'main': {'instrument_description_filename': 'instrument_description.json', 'ITO_rebooting_duration_sec': '1',
+                 'win_service_restart_pause': '0', 'history_samples': '0', 'state_dir_path': str(tmp_path / 'state')},
+        'trigger1': {'data_dir_path': str(tmp_path / 'data'), 'files_template': '*.txt',
+                     'dir_size_speed_threshold_mb_per_h': '1', 'service_name': 'UPK_server',
+                     'dir_check_interval_sec': '1', 'num_of_triggers_before_action': '1',
+                     'num_of_service_restarts_before_ito_reboot': '1', 'max_unsuccessful_reboots': '1',
+                     'dir_watch_mode': 'poll'},
+        'instrument:a': options,
+    })
+    (tmp_path / 'data').mkdir(exist_ok=True)
+    return InstrumentSettings(config, 'instrument:a')
+
+
+class FakeServiceController:
+    confirms_state = True
+
+    def __init__(self):
+        self.calls = []
+
+    async def stop(self, service_name):
+        self.calls.append('stop')
+        return 0
+
+    async def start(self, service_name):
+        self.calls.append('start')
+        return 0
+
+
+class SlowItoSession:
+    """
+    Подключение к ИТО, команды которого отвечают через delay_sec
+    """
+
+    def __init__(self, delay_sec):
+        self.delay_sec = delay_sec
+
+    def check_connection(self, max_age_sec=None):
+        time.sleep(self.delay_sec)
+        return True
+
+    def reboot(self):
+        time.sleep(self.delay_sec)
+
+    def invalidate(self):
+        pass
+
+
+def test_missing_ito_library_is_reported_once_and_retried_with_back_off(tmp_path, monkeypatch, caplog):
+    pauses = []
+
+    async def sleep(sec):
+        pauses.append(sec)
+
+    def ito_session_factory(address):
+        if len(pauses) < 4:
+            raise ImportError('No module named hyperion')
+        return address
+
+    monkeypatch.setattr(upk_instrument, 'ito_library_retry_max_pause_sec', 3)
+    monkeypatch.setattr(upk_instrument.asyncio, 'sleep', sleep)
+    settings = make_settings(tmp_path, ito_ip='10.0.0.1')
+    supervisor = InstrumentSupervisor(settings, FakeServiceController(), ito_session_factory)
+    asyncio.run(supervisor.load_instrument_description())
+
+    assert supervisor.ito_session == '10.0.0.1'
+    assert pauses == [1, 2, 3, 3]
+    assert len([r for r in caplog.records if 'ITO library is not available' in r.getMessage()]) == 1
+
+
+def test_state_is_kept_outside_the_data_folder(tmp_path):
+    settings = make_settings(tmp_path)
+    assert settings.state_dir_path == str(tmp_path / 'state' / 'a')
+
+    # файл состояния прежней версии в папке с данными переносится
+    state = SupervisorState()
+    state.cur_num_of_triggers = 2
+    old_state_file = StateFile(str(tmp_path / 'data' / state_filename))
+    old_state_file.save(state)
+    old_state_file.close()
+    supervisor = InstrumentSupervisor(settings, FakeServiceController())
+    assert supervisor.cur_num_of_triggers == 2
+    supervisor.save_state()
+    assert not (tmp_path / 'data' / state_filename).exists()
+    assert (tmp_path / 'state' / 'a' / state_filename).is_file()
+    assert supervisor.upk_log_index.index_file_name == str(tmp_path / 'state' / 'a' / upk_log_index_filename)
+
+    (tmp_path / 'data' / history_filename).write_bytes(b'')
+    settings = make_settings(tmp_path, history_samples='10')
+    supervisor = InstrumentSupervisor(settings, FakeServiceController())
+    assert supervisor.history.file_name == str(tmp_path / 'state' / 'a' / history_filename)
+    assert not (tmp_path / 'data' / history_filename).exists()
+    supervisor.history.close()
+
+
+def test_failed_or_late_step_does_not_stop_the_action():
+    async def broken():
+        raise OSError('no route to host')
+
+    async def main():
+        errors = []
+        started = time.monotonic()
+        assert await run_step('slow', asyncio.sleep(1, 'late'), 0.05, on_error=lambda: errors.append('slow')) is None
+        assert time.monotonic() - started < 0.5
+        assert await run_step('broken', broken(), 1, on_error=lambda: errors.append('broken')) is None
+        assert await run_step('fast', asyncio.sleep(0, 'ok'), 1) == 'ok'
+        assert errors == ['slow', 'broken']
+
+    asyncio.run(main())
+
+
+def test_cancelled_action_cancels_its_running_step():
+    async def main():
+        started, cancelled = asyncio.Event(), []
+
+        async def service_stop():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        task = asyncio.ensure_future(run_step('service stop', service_stop(), 60))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert cancelled == [True]
+
+    asyncio.run(main())
+
+
+def test_hung_ito_command_is_abandoned_after_the_step_timeout(tmp_path):
+    sessions = []
+
+    def ito_session_factory(address):
+        # зависает только первое подключение
+        sessions.append(SlowItoSession(2 if not sessions else 0))
+        return sessions[-1]
+
+    settings = make_settings(tmp_path, ito_ip='10.0.0.1', action_step_timeout_sec='0.2')
+    supervisor = InstrumentSupervisor(settings, FakeServiceController(), ito_session_factory)
+
+    async def main():
+        await supervisor.load_instrument_description()
+        started = time.monotonic()
+        assert await supervisor.run_step('ITO check', supervisor.ito_call(supervisor.ito_check_connection)) is None
+        assert time.monotonic() - started < 0.5
+        # следующая команда - по новому подключению в новом потоке, не за зависшей
+        started = time.monotonic()
+        assert await supervisor.run_step('ITO check', supervisor.ito_call(supervisor.ito_check_connection)) is True
+        assert time.monotonic() - started < 0.5
+
+    asyncio.run(main())
+    assert len(sessions) == 2
+
+
+def test_folder_checks_keep_their_step_while_the_instrument_hangs(tmp_path):
+    interval_sec = 0.1
+    settings = make_settings(tmp_path, ito_ip='10.0.0.1', action_step_timeout_sec='0.3',
+                             dir_check_interval_sec=str(interval_sec), dir_size_speed_threshold_mb_per_h='0')
+    supervisor = InstrumentSupervisor(settings, FakeServiceController(), lambda address: SlowItoSession(1))
+    check_times = []
+    check_data_dir = supervisor.check_data_dir
+
+    async def recorded_check():
+        check_times.append(time.monotonic())
+        await check_data_dir()
+
+    supervisor.check_data_dir = recorded_check
+
+    async def main():
+        scheduler = DeadlineScheduler()
+        scheduler_task = asyncio.ensure_future(scheduler.run())
+        await supervisor.run(scheduler)
+        action_started = time.monotonic()
+        supervisor.start_recovery('reboot')
+        await asyncio.sleep(1.2)
+        # обе проверки связи с ИТО ждали таймаута шага
+        assert supervisor.recovery_task.done()
+        assert supervisor.cur_unsuccessful_reboots == 1
+        action_checks = [t for t in check_times if t >= action_started]
+        supervisor.unschedule_triggers()
+        scheduler_task.cancel()
+        return action_checks
+
+    action_checks = asyncio.run(main())
+    assert len(action_checks) >= 10
+    steps = [b - a for a, b in zip(action_checks, action_checks[1:])]
+    assert max(abs(step - interval_sec) for step in steps) < 0.05
+
+
+def readiness_supervisor(tmp_path, **options):
+    options = {'readiness_timeout_sec': '0.3', 'readiness_window_sec': '0.2', 'readiness_poll_interval_sec': '0.03',
+               **options}
+    return InstrumentSupervisor(make_settings(tmp_path, **options), FakeServiceController())
+
+
+def probe_count(supervisor, result):
+    return upk_instrument.metric_readiness_probes.labels(supervisor.name, result).value
+
+
+def test_readiness_probe_without_new_data(tmp_path):
+    supervisor = readiness_supervisor(tmp_path)
+    started = time.monotonic()
+    assert asyncio.run(supervisor.readiness_probe()) == 'no_data'
+    assert 0.3 <= time.monotonic() - started < 0.6
+
+
+def test_readiness_probe_measures_time_to_first_data(tmp_path):
+    supervisor = readiness_supervisor(tmp_path, readiness_speed_threshold_mb_per_h='1')
+    first_data = supervisor.metric_time_to_first_data
+    count = first_data.count
+
+    async def main():
+        probe = asyncio.ensure_future(supervisor.readiness_probe())
+        await asyncio.sleep(0.1)
+        with SyntheticDataWriter(str(tmp_path / 'data'), 1024 * 1024, interval_sec=0.01):
+            return await probe
+
+    assert asyncio.run(main()) == 'ok'
+    assert first_data.count == count + 1
+    assert 0.1 <= first_data.sum < 1
+
+
+def test_readiness_probe_with_low_rate(tmp_path):
+    supervisor = readiness_supervisor(tmp_path, readiness_speed_threshold_mb_per_h='1000')
+
+    async def main():
+        probe = asyncio.ensure_future(supervisor.readiness_probe())
+        await asyncio.sleep(0.05)
+        # одна запись после запуска службы и больше ничего
+        (tmp_path / 'data' / 'a.txt').write_bytes(b'1' * 100)
+        return await probe
+
+    assert asyncio.run(main()) == 'low_rate'
+
+
+def test_failed_readiness_escalates_without_waiting_for_triggers(tmp_path):
+    supervisor = readiness_supervisor(tmp_path, recovery_levels='service, reboot')
+    no_data = probe_count(supervisor, 'no_data')
+    # как при срабатывании trigger1: уровень выбирает политика восстановления
+    level = supervisor.recovery_policy.next_action(time.monotonic())
+    asyncio.run(supervisor.action_with_readiness_probe(level))
+    # ИТО еще не найден - на каждом уровне перезапускается только служба, после последнего - пауза действий
+    assert supervisor.service_controller.calls == ['stop', 'start', 'stop', 'start', 'start']
+    assert probe_count(supervisor, 'no_data') == no_data + 2
+    assert supervisor.recovery_policy.hold_until > time.monotonic()
+
+
+def test_low_speed_stream_is_found_by_its_own_rate(tmp_path):
+    supervisor = InstrumentSupervisor(make_settings(tmp_path, streams='fast: fast_*.txt, slow: slow_*.txt',
+                                                    stream_speed_threshold_mb_per_h='1', speed_estimator='last'),
+                                      FakeServiceController())
+    data_dir = tmp_path / 'data'
+    for second in range(3):
+        with open(data_dir / 'fast_1.txt', 'ab') as f:
+            f.write(b'0' * 1024 * 1024)
+        with open(data_dir / 'slow_1.txt', 'ab') as f:
+            f.write(b'0' * 10)
+        supervisor.dir_size_tracker.scan()
+        supervisor.check_streams(100.0 + second)
+    # общая скорость папки выше порога, но поток slow отстает
+    assert supervisor.low_streams == ['slow']
+    assert upk_instrument.metric_stream_rate.labels('a', 'fast').value == pytest.approx(3600)
+    assert upk_instrument.metric_stream_rate.labels('a', 'slow').value == pytest.approx(3600 * 10 / 1024 / 1024)
+
+
+def test_streams_by_file_name_pattern_appear_with_their_files(tmp_path):
+    supervisor = InstrumentSupervisor(make_settings(tmp_path, stream_key_pattern=r'^(ch[0-9]+)_',
+                                                    stream_speed_threshold_mb_per_h='ch2: 1', speed_estimator='last'),
+                                      FakeServiceController())
+    data_dir = tmp_path / 'data'
+    for second in range(2):
+        for name in ('ch1_1.txt', 'ch2_1.txt'):
+            with open(data_dir / name, 'ab') as f:
+                f.write(b'0' * 10)
+        supervisor.dir_size_tracker.scan()
+        supervisor.check_streams(100.0 + second)
+    assert sorted(supervisor.stream_rate_estimators) == ['ch1', 'ch2']
+    # порог задан только для ch2
+    assert supervisor.low_streams == ['ch2']
@@ -0,0 +1,108 @@
+"""
+ItoSession с имитатором порта команд ИТО (upk_sim.FakeHyperionServer)
+"""
+
+import time
+
+import pytest
+
+from upk_ito import ItoSession
+from upk_sim import FakeHyperionClient, FakeHyperionServer
+
+
+class CountingFactory:
+    """
+    Создание FakeHyperionClient с подсчетом подключений
+    """
+
+    def __init__(self, server, timeout_sec=2.0):
+        self.server = server
+        self.timeout_sec = timeout_sec
+        self.created = 0
+
+    def __call__(self, address):
+        self.created += 1
+        return FakeHyperionClient(address, self.server.port, self.timeout_sec)
+
+
+@pytest.fixture
+def server():
+    with FakeHyperionServer() as server:
+        yield server
+
+
+def make_session(server, health_ttl_sec=5.0, timeout_sec=2.0):
+    factory = CountingFactory(server, timeout_sec)
+    session = ItoSession(server.address, port=server.port, connect_timeout_sec=0.5, health_ttl_sec=health_ttl_sec,
+                         instrument_factory=factory)
+    return session, factory
+
+
+def test_connection_is_reused_by_checks_and_batches(server):
+    session, factory = make_session(server)
+    assert session.check_connection(0) is True
+    connections = server.connections
+    for _ in range(3):
+        assert session.check_connection(0) is True
+        temperature, spectra = session.batch(ItoSession.board_temperature_command, ItoSession.spectra_command)
+        assert temperature == server.board_temperature
+        assert len(spectra.data) == server.spectrum_channels
+    assert session.get_board_temperature() == server.board_temperature
+    assert factory.created == 1
+    assert server.connections == connections
+
+
+def test_health_is_cached_until_ttl(server):
+    session, _ = make_session(server, health_ttl_sec=0.2)
+    assert session.check_connection() is True
+    commands = len(server.commands)
+    assert session.check_connection() is True
+    assert len(server.commands) == commands
+
+    time.sleep(0.25)
+    assert session.check_connection() is True
+    assert len(server.commands) == commands + 1
+
+
+def test_failed_command_in_batch_does_not_stop_the_rest(server):
+    session, factory = make_session(server)
+    server.fail_commands.add('#GetBoardTemperature')
+    temperature, setting = session.batch(ItoSession.board_temperature_command,
+                                         lambda h: h.get_channel_detection_setting(1))
+    assert isinstance(temperature, RuntimeError) and setting == 0
+    assert factory.created == 1
+
+
+def test_lazy_reconnect_after_the_instrument_drops(server):
+    session, factory = make_session(server)
+    assert session.check_connection(0) is True
+
+    # прибор перезагружается: после ответа на #Reboot соединение разрывается, подключения не обслуживаются
+    server.reboot_duration_sec = 0.3
+    session.call(lambda h: h.reboot())
+    reason, _ = session.check_connection(0)
+    assert reason == 3
+    with pytest.raises(Exception):
+        session.get_board_temperature()
+
+    time.sleep(0.35)
+    assert session.check_connection(0) is True
+    assert session.get_board_temperature() == server.board_temperature
+    assert factory.created >= 2
+
+
+def test_hung_instrument_and_closed_port_are_bounded_in_time(server):
+    session, _ = make_session(server, timeout_sec=0.3)
+    assert session.check_connection(0) is True
+    server.response_delay_sec = 1
+    started = time.monotonic()
+    reason, _ = session.check_connection(0)
+    assert reason == 3
+    assert time.monotonic() - started < 0.9
+
+    server.response_delay_sec = 0
+    server.stop()
+    started = time.monotonic()
+    reason, _ = session.check_connection(0)
+    assert reason == 1
+    assert time.monotonic() - started < 1.0
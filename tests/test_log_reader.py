@@ -0,0 +1,112 @@
+"""
+Чтение лога UPK_server с конца и индекс Ping-строк upk_log_reader
+"""
+
+import io
+import random
+
+import pytest
+
+from upk_log_reader import PingIndex, get_upk_osm_time_from_log, iter_lines_backward, parse_ping_line
+
+
+def ping_line(second):
+    return (f"protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:{second:02d},887]  server < Frame(fin=True, "
+            f"opcode=9, data=b'31.08.2021 14:55:{second:02d}', rsv1=False, rsv2=False, rsv3=False)")
+
+
+def other_line(i):
+    return f"protocol.py[LINE:1196]# DEBUG    [2021-08-31 14:51:27,888]  server > Frame(opcode=1, data=b'{'x' * i}')"
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 65536])
+def test_backward_lines_match_forward_split(block_size):
+    rng = random.Random(block_size)
+    lines = [b'a' * rng.randint(0, 100) for _ in range(200)]
+    data = b'\n'.join(lines) + b'\n'
+    offsets = [0]
+    for line in lines[:-1]:
+        offsets.append(offsets[-1] + len(line) + 1)
+    got = list(iter_lines_backward(io.BytesIO(data), block_size=block_size))
+    assert got == list(reversed(list(zip(offsets, lines))))
+
+    # от смещения start - только строки, начинающиеся не раньше него
+    start = offsets[150]
+    got = list(iter_lines_backward(io.BytesIO(data), start=start, block_size=block_size))
+    assert got == list(reversed(list(zip(offsets[150:], lines[150:]))))
+
+
+@pytest.mark.parametrize('block_size', [16, 4096])
+def test_backward_lines_with_marker(block_size):
+    lines = [other_line(i % 50).encode() for i in range(300)]
+    lines[10] = ping_line(10).encode()
+    lines[250] = ping_line(20).encode()
+    data = b'\r\n'.join(lines)
+    got = [line for _, line in iter_lines_backward(io.BytesIO(data), block_size=block_size, marker=b'opcode=9')]
+    assert got == [lines[250], lines[10]]
+
+
+def test_fast_parser_matches_the_old_one():
+    line = ping_line(27)
+    upk_time, osm_time = parse_ping_line(line)
+    assert (upk_time.replace(microsecond=0), osm_time) == get_upk_osm_time_from_log(line)
+    assert upk_time.microsecond == 887000
+    with pytest.raises(ValueError):
+        parse_ping_line(other_line(3))
+
+
+def test_index_reads_only_appended_bytes(tmp_path):
+    log_file_name = tmp_path / 'UPK_server_20210831.log'
+    log_file_name.write_text('\n'.join([other_line(1), ping_line(1), other_line(2)]) + '\n')
+    index = PingIndex(str(tmp_path / 'index.json'))
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+
+    entry = index.files[str(log_file_name)]
+    assert entry['scanned'] == log_file_name.stat().st_size
+    # без изменений файла - из индекса
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+
+    with open(log_file_name, 'a') as f:
+        f.write(other_line(3) + '\n')
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+    with open(log_file_name, 'a') as f:
+        f.write(ping_line(2) + '\n' + other_line(4) + '\n')
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(2)
+
+    index.save()
+    assert PingIndex(str(tmp_path / 'index.json')).files == index.files
+
+
+def test_index_rereads_a_rewritten_file(tmp_path):
+    log_file_name = tmp_path / 'UPK_server_20210831.log'
+    log_file_name.write_text(ping_line(1) + '\n' + other_line(40) + '\n')
+    index = PingIndex()
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+
+    # файл перезаписан тем же или большим размером - запомненной строки на ее месте нет
+    log_file_name.write_text(other_line(40) + '\n' + ping_line(5) + '\n' + other_line(1) + '\n')
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(5)
+
+    # файл стал короче - читается заново
+    log_file_name.write_text(other_line(1) + '\n')
+    assert index.find_last_line(str(log_file_name), parse_ping_line) is None
+
+    index.forget_missing([])
+    assert index.files == {}
+
+
+def test_ping_line_written_in_two_parts(tmp_path):
+    log_file_name = tmp_path / 'UPK_server_20210831.log'
+    log_file_name.write_text(ping_line(1) + '\n' + other_line(2) + '\n')
+    index = PingIndex()
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+
+    # UPK_server дописывает строку частями, проверка - между ними
+    line = ping_line(2)
+    with open(log_file_name, 'a') as f:
+        f.write(line[:60])
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(1)
+    with open(log_file_name, 'a') as f:
+        f.write(line[60:] + '\n')
+    assert index.find_last_line(str(log_file_name), parse_ping_line) == ping_line(2)
+    assert index.files[str(log_file_name)]['scanned'] == log_file_name.stat().st_size
@@ -0,0 +1,108 @@
+"""
+Лог upk_logging: ротация по размеру и возрасту, сжатие gzip, ограничение общего объема, запись через очередь
+"""
+
+import gzip
+import logging
+import os
+
+import pytest
+
+from upk_logging import RotatingCompressedFileHandler, setup_logging
+
+
+def record(message):
+    return logging.makeLogRecord({'msg': message, 'levelno': logging.INFO, 'levelname': 'INFO'})
+
+
+@pytest.fixture
+def make_handler(tmp_path):
+    handlers = []
+
+    def make(**options):
+        options.setdefault('max_age_sec', 0)
+        options.setdefault('max_total_bytes', 0)
+        handler = RotatingCompressedFileHandler(str(tmp_path / 'UPK_supervisor.log'), **options)
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        handler.close()
+
+
+def read_all(handler):
+    """
+    :return: строки всех файлов лога от старых к новым
+    """
+    lines = []
+    for file_name in handler.rotated_files():
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(file_name, 'rt') as f:
+            lines += f.read().splitlines()
+    handler.flush()
+    with open(handler.baseFilename) as f:
+        lines += f.read().splitlines()
+    return lines
+
+
+def test_rotation_by_size_compresses_and_keeps_every_line(make_handler):
+    handler = make_handler(max_bytes=300)
+    messages = [f'message {i:03d} ' + 'x' * 40 for i in range(30)]
+    for message in messages:
+        handler.emit(record(message))
+
+    rotated = handler.rotated_files()
+    assert len(rotated) >= 4
+    assert all(name.endswith('.log.gz') for name in rotated)
+    assert read_all(handler) == messages
+    assert os.path.getsize(handler.baseFilename) < 300 + 60
+
+
+def test_rotation_by_age_and_on_start(make_handler):
+    handler = make_handler(max_bytes=0, max_age_sec=3600, compress=False)
+    handler.emit(record('old'))
+    handler.emit(record('still the same file'))
+    assert handler.rotated_files() == []
+    handler.opened_at -= 3600
+    handler.emit(record('new file'))
+    assert [name.endswith('.log') for name in handler.rotated_files()] == [True]
+    handler.close()
+
+    # лог прошлого запуска переносится в отдельный файл при старте
+    handler = make_handler(compress=False)
+    assert len(handler.rotated_files()) == 2
+    handler.flush()
+    assert os.path.getsize(handler.baseFilename) == 0
+    assert read_all(handler) == ['old', 'still the same file', 'new file']
+
+
+def test_oldest_files_are_removed_over_the_total_size(make_handler):
+    handler = make_handler(max_bytes=200, max_total_bytes=1000, compress=False)
+    for i in range(100):
+        handler.emit(record(f'message {i:03d} ' + 'x' * 30))
+    files = handler.rotated_files() + [handler.baseFilename]
+    assert sum(os.path.getsize(name) for name in files) <= 1000 + 200
+    # остались самые новые сообщения, без пропусков
+    lines = read_all(handler)
+    assert lines[-1].startswith('message 099')
+    assert lines == [f'message {i:03d} ' + 'x' * 30 for i in range(100 - len(lines), 100)]
+
+
+def test_messages_go_through_the_queue_to_the_file(tmp_path):
+    root = logging.getLogger()
+    old_handlers, old_level = list(root.handlers), root.level
+    listener = setup_logging(str(tmp_path / 'logs'), level=logging.INFO, max_age_sec=0)
+    try:
+        logging.debug('not written')
+        logging.info('written by the listener thread')
+    finally:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        root.handlers[:] = old_handlers
+        root.setLevel(old_level)
+    with open(tmp_path / 'logs' / 'UPK_supervisor.log') as f:
+        text = f.read()
+    assert 'written by the listener thread' in text and 'not written' not in text
+    assert 'INFO' in text and 'test_logging.py' in text
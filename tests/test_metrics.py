@@ -0,0 +1,95 @@
+"""
+Метрики upk_metrics: текстовый формат Prometheus, границы гистограмм, HTTP и JSON
+"""
+
+import json
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from upk_metrics import MetricsHttpServer, MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_counter_and_gauge_text_format(registry):
+    counter = registry.counter('upk_triggers_total', 'Released triggers', ['instrument', 'trigger'])
+    counter.labels('upk1', 'trigger1').inc()
+    counter.labels('upk1', 'trigger1').inc(2)
+    registry.gauge('upk_dir_files', 'Number of data files').labels().set(7)
+    assert registry.render_prometheus() == (
+        '# HELP upk_triggers_total Released triggers\n'
+        '# TYPE upk_triggers_total counter\n'
+        'upk_triggers_total{instrument="upk1",trigger="trigger1"} 3.0\n'
+        '# HELP upk_dir_files Number of data files\n'
+        '# TYPE upk_dir_files gauge\n'
+        'upk_dir_files 7.0\n')
+
+
+def test_label_values_are_escaped(registry):
+    registry.gauge('upk_test', 'Test', ['path']).labels('c:\\data\n"new"').set(1)
+    assert 'upk_test{path="c:\\\\data\\n\\"new\\""} 1.0' in registry.render_prometheus().splitlines()
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive(registry):
+    histogram = registry.histogram('upk_action_seconds', 'Action duration', ['instrument'], buckets=(1, 0.1, 10))
+    value = histogram.labels('upk1')
+    for v in (0.05, 0.1, 0.5, 1, 30):
+        value.observe(v)
+    assert value.cumulative()[:3] == [(0.1, 2), (1, 4), (10, 4)]
+
+    lines = registry.render_prometheus().splitlines()
+    assert lines[2:] == [
+        'upk_action_seconds_bucket{instrument="upk1",le="0.1"} 2',
+        'upk_action_seconds_bucket{instrument="upk1",le="1.0"} 4',
+        'upk_action_seconds_bucket{instrument="upk1",le="10.0"} 4',
+        'upk_action_seconds_bucket{instrument="upk1",le="+Inf"} 5',
+        'upk_action_seconds_sum{instrument="upk1"} 31.65',
+        'upk_action_seconds_count{instrument="upk1"} 5',
+    ]
+
+
+def test_histogram_timer(registry):
+    value = registry.histogram('upk_dir_scan_seconds', 'Scan').labels()
+    with value.time():
+        pass
+    assert value.count == 1 and 0 <= value.sum < 0.1
+    assert value.cumulative()[0] == (0.001, 1)
+
+
+def test_registration_and_labels_are_checked(registry):
+    counter = registry.counter('upk_c', 'C', ['instrument'])
+    assert registry.counter('upk_c', 'C', ['instrument']) is counter
+    with pytest.raises(ValueError):
+        registry.gauge('upk_c', 'C', ['instrument'])
+    with pytest.raises(ValueError):
+        counter.labels('upk1', 'extra')
+    assert counter.labels(1) is counter.labels('1')
+
+
+def test_http_endpoint_and_snapshot(registry, tmp_path):
+    registry.histogram('upk_h', 'H', buckets=(1,)).labels().observe(2)
+    registry.counter('upk_c', 'C').labels().inc()
+    server = MetricsHttpServer(registry, '127.0.0.1', 0).start()
+    try:
+        base = f'http://{server.address}:{server.port}'
+        with urlopen(base + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert response.read().decode() == registry.render_prometheus()
+        with urlopen(base + '/metrics.json') as response:
+            assert json.load(response) == registry.snapshot()
+        with pytest.raises(HTTPError):
+            urlopen(base + '/other')
+    finally:
+        server.stop()
+
+    file_name = str(tmp_path / 'metrics.json')
+    registry.write_snapshot(file_name)
+    with open(file_name) as f:
+        metrics = json.load(f)['metrics']
+    assert metrics['upk_h']['samples'][0]['buckets'] == {'1.0': 0, '+Inf': 1}
+    assert metrics['upk_c']['samples'] == [{'labels': {}, 'value': 1.0}]
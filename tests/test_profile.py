@@ -0,0 +1,55 @@
+"""
+Режим профилирования upk_profile: выключенный trace и ротация дампов
+"""
+
+import os
+import time
+import tracemalloc
+
+import pytest
+
+import upk_profile
+from upk_profile import Profiler, profile_summary_filename, trace
+from upk_scheduler import DeadlineScheduler
+
+
+@pytest.fixture
+def scheduler():
+    return DeadlineScheduler()
+
+
+def test_trace_without_profiling_is_a_shared_noop():
+    assert upk_profile.active is None
+    assert trace('a') is trace('b')
+    with trace('a'):
+        pass
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.parametrize('mode, extension', [('sample', '.folded'), ('cprofile', '.prof')])
+def test_old_dumps_are_removed(tmp_path, scheduler, mode, extension):
+    profile_dir = tmp_path / 'profile'
+    profiler = Profiler(str(profile_dir), mode, sample_interval_sec=0.001, max_dumps=2)
+    profiler.start(scheduler)
+    try:
+        assert upk_profile.active is profiler and tracemalloc.is_tracing()
+        for _ in range(4):
+            with trace('dir scan'):
+                data = [bytearray(1024) for _ in range(100)]
+                time.sleep(0.01)
+            del data
+            profiler.dump()
+        dumps = sorted(name for name in os.listdir(profile_dir) if name != profile_summary_filename)
+        # остаются последние max_dumps
+        assert [name[-len('0003' + extension):] for name in dumps] == ['0003' + extension, '0004' + extension]
+    finally:
+        profiler.stop(scheduler)
+
+    assert upk_profile.active is None and not tracemalloc.is_tracing()
+    assert trace('dir scan') is trace('other')
+    stats = profiler.spans['dir scan']
+    assert stats.count == 4 and stats.max_sec >= 0.01 and stats.max_peak_bytes >= 100 * 1024
+    summary = (profile_dir / profile_summary_filename).read_text()
+    assert 'dir scan\t4\t' in summary
+    # дамп при остановке - тоже с ротацией
+    assert len(os.listdir(profile_dir)) == 2 + 1
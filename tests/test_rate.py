@@ -0,0 +1,81 @@
+"""
+Оценки скорости upk_rate
+"""
+
+import pytest
+
+from upk_rate import EwmaRateEstimator, RateEstimator, SampleRing, SlopeRateEstimator, WindowMeanRateEstimator, \
+    create_rate_estimator
+
+
+def feed(estimator, samples):
+    rate = None
+    for t, total in samples:
+        rate = estimator.update(t, total)
+    return rate
+
+
+def test_sample_ring_drops_the_oldest_sample():
+    ring = SampleRing(3)
+    assert [ring.append(t, 10 * t) for t in range(5)] == [None, None, None, (0, 0), (1, 10)]
+    assert (len(ring), ring.first(), ring.last()) == (3, (2, 20), (4, 40))
+    with pytest.raises(ValueError):
+        SampleRing(1)
+
+
+@pytest.mark.parametrize('name', ['last', 'mean', 'ewma', 'slope'])
+def test_constant_rate_is_exact(name):
+    estimator = create_rate_estimator(name, window=4)
+    assert estimator.update(100.0, 0) is None
+    assert feed(estimator, [(100.0 + 10 * i, 5000 * i) for i in range(1, 20)]) == pytest.approx(500)
+
+
+@pytest.mark.parametrize('name', ['last', 'mean', 'ewma', 'slope'])
+def test_time_not_going_forward_is_ignored(name):
+    estimator = create_rate_estimator(name, window=4)
+    rate = feed(estimator, [(0, 0), (10, 100), (20, 200)])
+    assert estimator.update(20, 10 ** 6) == rate
+    assert estimator.update(15, 10 ** 6) == rate
+
+
+def test_window_estimators_on_a_stall():
+    # 3 отсчета по 100 байт/с, затем запись остановилась
+    samples = [(0, 0), (1, 100), (2, 200), (3, 300), (4, 300), (5, 300)]
+    assert feed(RateEstimator(), samples) == 0
+    assert feed(WindowMeanRateEstimator(4), samples) == pytest.approx(100 / 3)
+    assert feed(SlopeRateEstimator(4), samples) == pytest.approx(30)
+    assert feed(EwmaRateEstimator(alpha=0.5), samples) == pytest.approx(25)
+
+
+def test_reset_starts_anew():
+    for name in ('last', 'mean', 'ewma', 'slope'):
+        estimator = create_rate_estimator(name, window=3)
+        feed(estimator, [(0, 0), (1, 1000), (2, 2000)])
+        estimator.reset()
+        assert estimator.update(3, 2000) is None
+        assert estimator.update(4, 2010) == pytest.approx(10)
+
+
+def test_unknown_estimator_and_bad_alpha():
+    with pytest.raises(ValueError):
+        create_rate_estimator('median')
+    with pytest.raises(ValueError):
+        create_rate_estimator('ewma', ewma_alpha=0)
+
+
+@pytest.mark.parametrize('window', [2, 5, 30])
+def test_slope_matches_polyfit_on_long_run_with_large_timestamps(window):
+    np = pytest.importorskip('numpy')
+    rng = np.random.default_rng(window)
+    n = 100000
+    # время - секунды эпохи Unix, значение - накопленный счетчик записанных байт
+    times = 1.6e9 + np.cumsum(rng.uniform(5, 15, n))
+    values = 1e12 + np.cumsum(rng.uniform(0, 2e6, n))
+    estimator = SlopeRateEstimator(window)
+    for i in range(n):
+        rate = estimator.update(times[i], values[i])
+        if i >= window and i % 1000 == 0:
+            t, v = times[i - window + 1:i + 1], values[i - window + 1:i + 1]
+            # точная опорная прямая - по отсчетам окна относительно первого из них
+            expected = np.polyfit(t - t[0], v - v[0], 1)[0]
+            assert rate == pytest.approx(expected, rel=1e-9)
@@ -0,0 +1,115 @@
+"""
+Лестница действий RecoveryPolicy на имитированных сбоях, время передается явно
+"""
+
+import pytest
+
+from upk_recovery import RecoveryPolicy
+
+
+def make_policy(restarts=2, **kwargs):
+    return RecoveryPolicy(attempts={'service': restarts},
+                          prior_ttr_sec={'service': 10, 'reboot': 60, 'netping': 80},
+                          backoff_sec=600, backoff_max_sec=6 * 3600, **kwargs)
+
+
+@pytest.mark.parametrize('restarts', [1, 2, 3])
+def test_ladder_service_reboot_netping_hold_off(restarts):
+    policy = make_policy(restarts)
+    actions = [policy.next_action(t) for t in range(restarts + 3)]
+    assert actions == ['service'] * restarts + ['reboot', 'netping', None]
+    assert policy.hold_until == restarts + 2 + 600
+
+
+def test_hold_off_then_retry_of_the_most_expensive_level():
+    policy = make_policy()
+    for t in range(5):
+        policy.next_action(t)
+    hold_until = policy.hold_until
+    assert policy.next_action(hold_until - 1) is None
+    assert policy.next_action(hold_until) == 'netping'
+    assert policy.next_action(hold_until + 1) is None
+
+
+def test_backoff_doubles_up_to_the_cap():
+    policy = make_policy()
+    t = 0
+    while policy.next_action(t) is not None:
+        t += 1
+    holds = []
+    for _ in range(10):
+        holds.append(policy.hold_until - t)
+        t = policy.hold_until
+        assert policy.next_action(t) == 'netping'
+        assert policy.next_action(t) is None
+    assert holds == [600, 1200, 2400, 4800, 9600, 19200, 21600, 21600, 21600, 21600]
+
+
+def test_recovery_resets_ladder_and_backoff():
+    policy = make_policy()
+    t = 0
+    while policy.next_action(t) is not None:
+        t += 1
+    t = policy.hold_until
+    assert policy.next_action(t) == 'netping'
+    level, ttr_sec = policy.on_recovered(t + 30)
+    assert (level, ttr_sec) == ('netping', 30)
+    assert policy.level is None
+    assert policy.hold_until == 0.0
+    assert policy.backoff_sec == 600
+
+    # новый сбой - с начала лестницы и с первоначальной паузой
+    actions = [policy.next_action(t + 100 + i) for i in range(5)]
+    assert actions[-1] is None
+    assert policy.hold_until == t + 104 + 600
+
+
+def test_on_recovered_without_failure():
+    assert make_policy().on_recovered(0) is None
+
+
+def test_escalate_skips_remaining_attempts():
+    policy = make_policy(restarts=3)
+    assert policy.next_action(0) == 'service'
+    assert policy.on_failed(escalate=True) == 'service'
+    assert policy.next_action(1) == 'reboot'
+
+
+def test_unsuccessful_reboots_hold_off_reboot_levels():
+    policy = make_policy(max_unsuccessful_reboots=3)
+    assert policy.next_action(0, unsuccessful_reboots=3) == 'service'
+    assert policy.next_action(1, unsuccessful_reboots=3) == 'service'
+    assert policy.next_action(2, unsuccessful_reboots=3) is None
+
+
+def test_restore_continues_the_ladder():
+    policy = make_policy()
+    policy.restore('service', 1)
+    assert [policy.next_action(t) for t in range(3)] == ['service', 'reboot', 'netping']
+
+    policy = make_policy()
+    policy.restore('reboot', 0)
+    assert [policy.next_action(t) for t in range(3)] == ['reboot', 'netping', None]
+
+
+def test_restore_of_unknown_level_is_ignored():
+    policy = RecoveryPolicy(levels=('service',))
+    policy.restore('netping', 1)
+    assert policy.level is None
+
+
+def test_order_follows_measured_time_to_recovery():
+    policy = make_policy(restarts=1)
+    # перезапуск службы не помог, перезагрузка восстановила данные за 2 секунды
+    assert policy.next_action(0) == 'service'
+    assert policy.next_action(1) == 'reboot'
+    assert policy.on_recovered(3) == ('reboot', 2)
+    assert policy.order()[0] == 'reboot'
+    assert policy.next_action(100) == 'reboot'
+
+
+def test_wrong_levels():
+    with pytest.raises(ValueError):
+        RecoveryPolicy(levels=('service', 'restart'))
+    with pytest.raises(ValueError):
+        RecoveryPolicy(levels=())
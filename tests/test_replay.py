@@ -0,0 +1,58 @@
+"""
+upk_replay.replay в сравнении с пошаговой проверкой trigger1 и RecoveryPolicy, как в InstrumentSupervisor
+"""
+
+import numpy as np
+import pytest
+
+from upk_recovery import RecoveryPolicy, default_prior_ttr_sec
+from upk_replay import replay
+
+
+def step_by_step(times, speeds, threshold, num_of_triggers, restarts_before_reboot):
+    levels = ('service', 'reboot', 'netping') if restarts_before_reboot > 0 else ('service',)
+    policy = RecoveryPolicy(levels, attempts={'service': restarts_before_reboot},
+                            prior_ttr_sec=default_prior_ttr_sec(70, 40))
+    triggers = restarts = reboots = 0
+    for t, speed in zip(times, speeds):
+        if 0.0 <= speed < threshold:
+            if triggers >= num_of_triggers:
+                triggers = 0
+                level = policy.next_action(t)
+                if level is not None:
+                    restarts += 1
+                    reboots += level != 'service'
+            else:
+                triggers += 1
+        else:
+            policy.on_recovered(t)
+    return restarts, reboots
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('restarts_before_reboot', [0, 1, 2, 3])
+def test_replay_matches_step_by_step(seed, restarts_before_reboot):
+    rng = np.random.default_rng(seed)
+    n = 20000
+    times = np.arange(n) * 60.0
+    # длинные сбои, короткие всплески скорости и отрицательная скорость при удалении файлов
+    speeds = np.where(rng.random(n) < 0.02, -5.0, 10.0)
+    for start in rng.integers(0, n, 30):
+        speeds[start:start + rng.integers(10, 600)] = 0.0
+    result = replay(times, speeds, 2.0, 3, restarts_before_reboot)
+    assert (result['restarts'], result['ito_reboots']) == step_by_step(times, speeds, 2.0, 3, restarts_before_reboot)
+
+
+def test_negative_speed_is_not_low():
+    times = np.arange(100) * 60.0
+    result = replay(times, np.full(100, -1.0), 2.0, 1, 2)
+    assert result['restarts'] == 0
+
+
+def test_ladder_in_one_long_stall():
+    # срабатывание на каждом отсчете (раз в минуту): service, service, reboot, netping в 0..180 с,
+    # далее пауза 600, 1200, 2400 с с повтором netping в 840, 2100 и 4560 с
+    times = np.arange(100) * 60.0
+    result = replay(times, np.zeros(100), 2.0, 0, 2)
+    assert result['restarts'] == 7
+    assert result['ito_reboots'] == 5
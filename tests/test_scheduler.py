@@ -0,0 +1,150 @@
+"""
+DeadlineScheduler на имитированных часах
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from upk_scheduler import DeadlineScheduler
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    return DeadlineScheduler(clock)
+
+
+def test_jobs_run_in_deadline_order(scheduler, clock):
+    ran = []
+    for delay, name in ((3, 'c'), (1, 'a'), (2, 'b'), (1, 'a2')):
+        scheduler.call_later(delay, lambda name=name: ran.append(name), name=name)
+    clock.now += 0.5
+    assert scheduler.run_pending() == 0
+    clock.now += 2
+    assert scheduler.run_pending() == 3
+    assert ran == ['a', 'a2', 'b']
+    assert scheduler.next_deadline() == 1003
+    clock.now += 10
+    scheduler.run_pending()
+    assert ran == ['a', 'a2', 'b', 'c']
+    assert scheduler.next_deadline() is None
+
+
+def test_reschedule_to_the_same_deadline_runs_once(scheduler, clock):
+    ran = []
+    job = scheduler.call_later(5, lambda: ran.append(1))
+    scheduler.reschedule(job, clock.now + 2)
+    scheduler.reschedule(job, clock.now + 2)
+    clock.now += 3
+    assert scheduler.run_pending() == 1
+    clock.now += 10
+    assert scheduler.run_pending() == 0
+    assert ran == [1]
+
+
+def test_cancel_and_reschedule(scheduler, clock):
+    ran = []
+    job = scheduler.call_later(2, lambda: ran.append('job'))
+    scheduler.cancel(job)
+    clock.now += 3
+    assert scheduler.run_pending() == 0
+
+    # снова на тот же срок, что и у отмененной записи в очереди
+    scheduler.reschedule(job, clock.now - 1)
+    scheduler.cancel(job)
+    scheduler.reschedule(job, clock.now - 1)
+    assert scheduler.run_pending() == 1
+    assert ran == ['job']
+
+
+def test_periodic_job_keeps_its_step_and_shifts_when_late(scheduler, clock):
+    ran = []
+    scheduler.call_every(10, lambda: ran.append(clock.now), first_delay_sec=0)
+    for _ in range(3):
+        scheduler.run_pending()
+        clock.now += 10.5
+    # шаг считается от срока, а не от момента выполнения
+    assert ran == [1000, 1010.5, 1021]
+    assert scheduler.next_deadline() == 1030
+
+    # опоздание больше периода - следующий срок от текущего момента, пропущенные не наверстываются
+    clock.now = 1075
+    assert scheduler.run_pending() == 1
+    assert scheduler.next_deadline() == 1085
+
+
+def test_wall_clock_jump_does_not_move_deadlines(scheduler, clock, monkeypatch):
+    assert DeadlineScheduler().clock is time.monotonic
+    scheduler.call_every(60, lambda: None)
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    assert scheduler.next_deadline() == 1060
+    assert scheduler.run_pending() == 0
+
+
+def test_interval_should_be_positive(scheduler):
+    with pytest.raises(ValueError):
+        scheduler.call_every(0, lambda: None)
+
+
+def test_running_coroutine_job_is_skipped_and_errors_are_isolated(clock):
+    async def main():
+        scheduler = DeadlineScheduler(clock)
+        started, ran = [], []
+        release = asyncio.Event()
+
+        async def slow():
+            started.append(clock.now)
+            await release.wait()
+
+        def broken():
+            raise RuntimeError('broken job')
+
+        scheduler.call_every(1, slow, first_delay_sec=0)
+        scheduler.call_every(1, broken, first_delay_sec=0)
+        scheduler.call_every(1, lambda: ran.append(clock.now), first_delay_sec=0)
+        scheduler.run_pending()
+        await asyncio.sleep(0)
+        clock.now += 1
+        scheduler.run_pending()
+        assert started == [1000] and ran == [1000, 1001]
+
+        release.set()
+        await asyncio.sleep(0)
+        clock.now += 1
+        scheduler.run_pending()
+        await asyncio.sleep(0)
+        assert started == [1000, 1002]
+
+    asyncio.run(main())
+
+
+def test_loop_wakes_up_for_an_earlier_deadline():
+    async def main():
+        scheduler = DeadlineScheduler()
+        ran = asyncio.Event()
+        scheduler.call_later(60, lambda: None)
+        task = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        scheduler.call_later(0.02, ran.set)
+        await asyncio.wait_for(ran.wait(), 1)
+        assert time.monotonic() - started < 0.5
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Выбор способа управления службой и остановка/запуск с ожиданием состояния на имитированной службе
+"""
+
+import asyncio
+import sys
+import time
+
+import pytest
+
+import upk_service
+from upk_metrics import Metric
+from upk_service import ERROR_SERVICE_REQUEST_TIMEOUT, ScServiceController, ServiceController, \
+    SystemdServiceController, create_service_controller
+from upk_sim import LocalServiceController
+
+
+@pytest.fixture
+def platform(monkeypatch):
+    def set_platform(os_name, systemctl):
+        monkeypatch.setattr(upk_service.os, 'name', os_name)
+        monkeypatch.setattr(upk_service.shutil, 'which', lambda name: '/bin/systemctl' if systemctl else None)
+    return set_platform
+
+
+def test_auto_mode_uses_systemd_where_it_is(platform):
+    platform('posix', True)
+    assert isinstance(create_service_controller('auto'), SystemdServiceController)
+    assert isinstance(create_service_controller('sc'), ScServiceController)
+
+
+def test_auto_mode_without_service_manager_is_a_config_error(platform):
+    platform('posix', False)
+    with pytest.raises(ValueError, match='service_control'):
+        create_service_controller('auto')
+    # явно заданный способ - без проверки
+    assert isinstance(create_service_controller('systemd'), SystemdServiceController)
+    with pytest.raises(ValueError):
+        create_service_controller('launchd')
+
+
+def test_auto_mode_on_windows_without_pywin32_uses_sc(platform, monkeypatch):
+    platform('nt', False)
+    monkeypatch.setitem(sys.modules, 'win32service', None)
+    assert isinstance(create_service_controller('auto'), ScServiceController)
+    with pytest.raises(ImportError):
+        create_service_controller('scm')
+
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        ServiceController()
+    with pytest.raises(TypeError):
+        Metric('upk_test', 'test')
+
+
+def make_controller(**kwargs):
+    controller = LocalServiceController(stop_timeout_sec=0.2, start_timeout_sec=0.5, kill_timeout_sec=0.2, **kwargs)
+    controller.poll_max_sec = 0.02
+    return controller
+
+
+def test_hung_service_is_killed_then_started():
+    async def main():
+        controller = make_controller(stop_delay_sec=10, start_delay_sec=0.05)
+        controller.hang_on_stop = True
+        started = time.monotonic()
+        assert await controller.stop('UPK') == 0
+        assert 0.2 <= time.monotonic() - started < 1
+        assert await controller.start('UPK') == 0
+        assert controller.current_state('UPK') == 'running'
+        assert [command for _, command, _ in controller.history] == ['stop', 'kill', 'start']
+
+    asyncio.run(main())
+
+
+def test_stop_waits_for_the_service_and_start_detects_a_crash():
+    async def main():
+        controller = make_controller(stop_delay_sec=0.05, start_delay_sec=0.05)
+        assert await controller.stop('UPK') == 0
+        assert await controller.stop('UPK') == 0  # уже остановлена - без команды
+        controller.fail_on_start = True
+        assert await controller.start('UPK') == ERROR_SERVICE_REQUEST_TIMEOUT
+        assert [command for _, command, _ in controller.history] == ['stop', 'start']
+
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Имитаторы оборудования upk_sim: розетка NetPing, запись данных службой, пара УПК/ИТО целиком
+"""
+
+import asyncio
+import glob
+import os
+import time
+
+import pytest
+
+from upk_bench import bench_dir
+from upk_dir_monitor import DirSizeTracker
+from upk_sim import FakeNetpingServer, NetpingHttpClient, SimulatedInstrument, SyntheticDataWriter
+
+
+def test_netping_socket_is_powered_off_for_the_given_time():
+    events = []
+    with FakeNetpingServer() as server:
+        server.on_power_off = lambda num: events.append(('off', num))
+        server.on_power_on = lambda num: events.append(('on', num))
+        relay = NetpingHttpClient(f'{server.address}:{server.port}')
+        assert relay.check_connection() is True
+
+        relay.reset_socket(2, 0.1)
+        assert not server.socket_is_on(2) and server.socket_is_on(1)
+        time.sleep(0.3)
+        assert server.socket_is_on(2)
+
+        relay.socket_off(1)
+        relay.socket_on(1)
+        assert events == [('off', 2), ('on', 2), ('off', 1), ('on', 1)]
+        with pytest.raises(RuntimeError):
+            relay.socket_on(5)
+    assert relay.check_connection() is not True
+
+
+def test_writer_rotates_files_and_matches_the_tracker(tmp_path):
+    writer = SyntheticDataWriter(str(tmp_path), 0, file_size_bytes=100, max_files=3)
+    tracker = DirSizeTracker(str(tmp_path), '*.txt')
+    # проверки - до удаления дописанного файла ротацией, иначе его хвост не виден
+    for size in (250, 50, 100, 100, 100):
+        writer.write(size)
+        tracker.scan()
+    assert sorted(os.path.basename(name) for name in glob.glob(str(tmp_path / '*.txt'))) == \
+        ['data_000003.txt', 'data_000004.txt', 'data_000005.txt']
+    assert writer.bytes_written == tracker.bytes_written == 600
+    assert tracker.total_size == 300
+
+
+def test_writer_keeps_its_rate_and_stops_on_pause(tmp_path):
+    with SyntheticDataWriter(str(tmp_path), 100000, interval_sec=0.02) as writer:
+        time.sleep(0.3)
+        written = writer.bytes_written
+        assert 20000 <= written <= 45000
+        writer.pause()
+        time.sleep(0.1)
+        paused = writer.bytes_written
+        time.sleep(0.2)
+        assert writer.bytes_written == paused
+        writer.resume()
+        time.sleep(0.2)
+    assert writer.bytes_written > paused
+
+
+def test_simulated_pair_recovers_by_netping(tmp_path):
+    data_dir_path = str(tmp_path / 'data')
+    with SimulatedInstrument(data_dir_path, rate_bytes_per_sec=50000) as sim:
+        sim.service_controller.poll_max_sec = 0.05
+
+        async def action():
+            await sim.supervisor.load_instrument_description()
+            return await sim.supervisor.action_when_any_trigger_released(ito_reboot=True, reboot_by_netping=True)
+
+        result = asyncio.run(action())
+        assert result is not False
+        assert [command for _, command, _ in sim.service_controller.history] == ['stop', 'start']
+        assert any(request.startswith('/relay.cgi?r1=f,') for request in sim.netping_server.requests)
+        assert sim.supervisor.cur_unsuccessful_reboots == 0
+        assert glob.glob(os.path.join(data_dir_path, '*_spectrum.*'))
+
+        # служба запущена - данные снова пишутся
+        written = sim.writer.bytes_written
+        time.sleep(0.3)
+        assert sim.writer.bytes_written > written
+    assert os.path.isdir(sim.settings.state_dir_path)
+
+
+def test_dir_benchmark_runs_on_a_small_folder(tmp_path):
+    results = bench_dir(str(tmp_path), (20,))
+    cases = [case for group, case, value, unit in results]
+    assert '20 files, glob+getsize' in cases and '20 files, poll check after append' in cases
+    assert all(value >= 0 and unit == 'ms' for _, _, value, unit in results)
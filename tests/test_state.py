@@ -0,0 +1,112 @@
+"""
+Файл состояния из двух слотов upk_state
+"""
+
+import os
+import zlib
+
+from upk_state import StateFile, SupervisorState, state_crc, state_magic, state_record, state_slot_size
+
+
+def make_state(**kwargs):
+    state = SupervisorState()
+    for key, value in kwargs.items():
+        setattr(state, key, value)
+    return state
+
+
+def record_bytes(version, recovery_level, seq=1):
+    record = state_record.pack(state_magic, version, 0, seq, 2, 3, 1, recovery_level, 100, 200, 1.5, 2.5, 3.5)
+    return record + state_crc.pack(zlib.crc32(record))
+
+
+def test_pack_unpack_round_trip():
+    state = make_state(seq=7, cur_num_of_triggers=2, num_of_service_restarts=1, cur_unsuccessful_reboots=1,
+                       recovery_level='reboot', total_size=10, bytes_written=20, sample_time=1.0,
+                       last_data_time=2.0, trigger2_time=3.0)
+    assert repr(SupervisorState.unpack(state.pack())) == repr(state)
+
+
+def test_version_1_record_is_read_without_recovery_level():
+    # в версии 1 на месте recovery_level было выравнивание
+    state = SupervisorState.unpack(record_bytes(1, 0))
+    assert (state.cur_num_of_triggers, state.num_of_service_restarts, state.recovery_level) == (2, 3, '')
+    assert SupervisorState.unpack(record_bytes(1, 2)).recovery_level == ''
+
+
+def test_unknown_version_or_recovery_level_is_rejected():
+    assert SupervisorState.unpack(record_bytes(3, 0)) is None
+    assert SupervisorState.unpack(record_bytes(2, 100)) is None
+    assert SupervisorState.unpack(record_bytes(2, 2)).recovery_level == 'reboot'
+
+
+def saved_file(tmp_path, count):
+    state_file = StateFile(str(tmp_path / 'state.bin'))
+    for i in range(1, count + 1):
+        state_file.save(make_state(cur_num_of_triggers=i, bytes_written=1000 * i))
+    state_file.close()
+    return state_file.file_name
+
+
+def test_last_record_is_loaded_and_seq_continues(tmp_path):
+    file_name = saved_file(tmp_path, 5)
+    state_file = StateFile(file_name)
+    state = state_file.load()
+    assert (state.seq, state.cur_num_of_triggers, state.bytes_written) == (5, 5, 5000)
+    state_file.save(make_state(cur_num_of_triggers=6))
+    state_file.close()
+    assert StateFile(file_name).load().seq == 6
+
+
+def test_torn_write_falls_back_to_the_other_slot(tmp_path):
+    file_name = saved_file(tmp_path, 5)
+    # запись 5 - в слоте 1; оборвана на середине
+    with open(file_name, 'r+b') as f:
+        f.seek(state_slot_size + state_slot_size // 2)
+        f.write(bytes(state_slot_size // 2))
+    state = StateFile(file_name).load()
+    assert (state.seq, state.cur_num_of_triggers) == (4, 4)
+
+
+def test_corrupt_slot_is_ignored(tmp_path):
+    file_name = saved_file(tmp_path, 4)
+    # запись 4 - в слоте 0; один бит испорчен
+    with open(file_name, 'r+b') as f:
+        f.seek(20)
+        byte = f.read(1)
+        f.seek(20)
+        f.write(bytes([byte[0] ^ 1]))
+    assert StateFile(file_name).load().seq == 3
+
+
+def test_both_slots_damaged_or_short_file(tmp_path):
+    file_name = saved_file(tmp_path, 2)
+    with open(file_name, 'r+b') as f:
+        f.write(b'x' * (2 * state_slot_size))
+    assert StateFile(file_name).load() is None
+
+    with open(file_name, 'wb') as f:
+        f.write(make_state(seq=1).pack()[:-1])
+    assert StateFile(file_name).load() is None
+    assert StateFile(str(tmp_path / 'missing.bin')).load() is None
+
+
+def test_first_save_after_a_single_record(tmp_path):
+    file_name = saved_file(tmp_path, 1)
+    assert len(open(file_name, 'rb').read()) == 2 * state_slot_size
+    state_file = StateFile(file_name)
+    assert state_file.load().seq == 1
+    state_file.save(make_state(cur_num_of_triggers=9))
+    state_file.close()
+    assert StateFile(file_name).load().cur_num_of_triggers == 9
+
+
+def test_every_record_is_flushed_to_disk(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: (synced.append(fd), real_fsync(fd)))
+    state_file = StateFile(str(tmp_path / 'state.bin'))
+    for i in range(3):
+        state_file.save(make_state(cur_num_of_triggers=i))
+    assert len(synced) == 3
+    state_file.close()
@@ -0,0 +1,70 @@
+"""
+Запуск пар УПК/ИТО в UPK_supervisor: ошибка одной пары не мешает остальным
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import UPK_supervisor
+from UPK_supervisor import create_supervisors, run_supervisor
+
+
+class RecordingLog:
+    def __init__(self):
+        self.records = []
+
+    def error(self, msg):
+        self.records.append(('error', msg))
+
+    def info(self, msg):
+        self.records.append(('info', msg))
+
+
+class FailingSupervisor:
+    """
+    Пара, запуск которой failures раз заканчивается ошибкой
+    """
+
+    def __init__(self, failures, error=ImportError):
+        self.failures = failures
+        self.error = error
+        self.runs = 0
+        self.unscheduled = 0
+        self.log = RecordingLog()
+
+    async def run(self, scheduler):
+        self.runs += 1
+        if self.runs <= self.failures:
+            raise self.error('No module named hyperion')
+
+    def unschedule_triggers(self):
+        self.unscheduled += 1
+
+
+def test_broken_pair_is_skipped():
+    def supervisor_class(settings):
+        if settings.name == 'b':
+            raise OSError('data folder is not available')
+        return SimpleNamespace(settings=settings)
+
+    settings = [SimpleNamespace(name=name, service_name='UPK_server') for name in 'abc']
+    supervisors = create_supervisors(settings, supervisor_class)
+    assert [s.settings.name for s in supervisors] == ['a', 'c']
+
+
+def test_repeated_error_is_logged_once_and_backs_off(monkeypatch):
+    pauses = []
+
+    async def sleep(sec):
+        pauses.append(sec)
+
+    monkeypatch.setattr(UPK_supervisor, 'supervisor_restart_pause_sec', 60)
+    monkeypatch.setattr(UPK_supervisor, 'supervisor_restart_max_pause_sec', 300)
+    monkeypatch.setattr(UPK_supervisor.asyncio, 'sleep', sleep)
+    supervisor = FailingSupervisor(5)
+    asyncio.run(run_supervisor(supervisor, None))
+
+    assert supervisor.runs == 6
+    assert supervisor.unscheduled == 5
+    assert pauses == [60, 120, 240, 300, 300]
+    assert [level for level, _ in supervisor.log.records] == ['error'] + ['info'] * 4
@@ -0,0 +1,288 @@
+"""
+Архивирование старых файлов из папки с данными
+
+Файлы данных, спектры и логи UPK_server копятся в папке с данными, и каждый обход папки и поиск
+по логам со временем замедляются. DataArchiver переносит файлы старше max_age_sec в сжатые zip-архивы
+вне папки с данными, по дням изменения файлов:
+
+    <папка архива>/2021-10/2021-10-01_1.zip, 2021-10-01_2.zip, ...
+
+День архивируется целиком, когда его последний момент старше max_age_sec, поэтому на день обычно
+приходится один архив; файлы, изменившиеся позже (опоздавшие), попадают в следующую часть.
+Архив пишется во временный файл и переименовывается после закрытия, затем обновляется
+manifest.json (части архива: день, количество файлов, размер, время изменения первого и последнего
+файла) и только после этого удаляются исходные файлы - сбой в любой момент не теряет данные.
+Файлы, которые не удалось удалить (например, открытый лог UPK_server), остаются в записи части
+(not_removed: имя -> время изменения) до удаления, поэтому и после перезапуска программы они не
+попадают в архив повторно.
+Чтение ограничено max_rate_bytes_per_sec, чтобы архивирование не мешало записи данных.
+
+Удаление файлов не уменьшает скорость trigger1: она считается по записанным байтам (DirSizeTracker).
+
+    python upk_archive.py <папка архива> [--find шаблон имени файла]
+"""
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+archive_manifest_filename = 'manifest.json'
+archive_chunk_size = 1024 * 1024
+
+
+class DataArchiver:
+    """
+    Перенос старых файлов из папки с данными в архивы по дням
+    """
+
+    def __init__(self, data_dir_path, archive_dir_path, templates, max_age_sec, max_rate_bytes_per_sec=5 * 1024 * 1024,
+                 max_run_sec=600, log=logging):
+        """
+        :param templates: шаблоны имен архивируемых файлов
+        :param max_age_sec: файлы старше - архивируются
+        :param max_rate_bytes_per_sec: ограничение скорости чтения файлов, 0 - без ограничения
+        :param max_run_sec: продолжительность одного запуска, остаток - в следующем
+        """
+        if os.path.abspath(archive_dir_path) == os.path.abspath(data_dir_path):
+            raise ValueError('archive folder should not be the data folder')
+        self.data_dir_path = data_dir_path
+        self.archive_dir_path = archive_dir_path
+        self.templates = templates
+        self.max_age_sec = max_age_sec
+        self.max_rate_bytes_per_sec = max_rate_bytes_per_sec
+        self.max_run_sec = max_run_sec
+        self.log = log
+        self.stop_event = threading.Event()
+        self.not_removed = None  # файлы в архиве, которые не удалось удалить: имя -> mtime; читается из manifest.json
+        self.not_removed_changed = False
+        self.manifest_file_name = os.path.join(archive_dir_path, archive_manifest_filename)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def aged_files(self, now=None):
+        """
+        Файлы для архивирования - из дней, закончившихся раньше now - max_age_sec
+        :return: {день: [(имя, размер, mtime), ...]} по возрастанию времени изменения
+        """
+        now = time.time() if now is None else now
+        # полночь дня, в который попадает граница - файлы раньше нее принадлежат закончившимся дням
+        border = datetime.fromtimestamp(now - self.max_age_sec)
+        border = border.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        days = {}
+        try:
+            it = os.scandir(self.data_dir_path)
+        except FileNotFoundError:
+            return days
+        seen = set()
+        with it:
+            for entry in it:
+                if not any(fnmatch.fnmatch(entry.name, template) for template in self.templates):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if not entry.is_file():
+                    continue
+                archived_mtime = self.not_removed.get(entry.name)
+                if archived_mtime is not None:
+                    if archived_mtime == st.st_mtime:
+                        # уже в архиве - только удаление
+                        seen.add(entry.name)
+                        self.remove_archived(entry.name)
+                        continue
+                    # файл изменен после архивирования - новая версия архивируется как обычный файл
+                if st.st_mtime >= border:
+                    continue
+                day = datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m-%d')
+                days.setdefault(day, []).append((entry.name, st.st_size, st.st_mtime))
+        for name in [name for name in self.not_removed if name not in seen]:
+            # удален или изменен не программой
+            del self.not_removed[name]
+            self.not_removed_changed = True
+        for files in days.values():
+            files.sort(key=lambda f: f[2])
+        return dict(sorted(days.items()))
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file_name, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            self.log.error(f'Archive manifest {self.manifest_file_name} is damaged, it starts anew: {e}')
+            return {}
+
+    def save_manifest(self, manifest):
+        tmp_file_name = self.manifest_file_name + '.tmp'
+        with open(tmp_file_name, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_file_name, self.manifest_file_name)
+
+    def run_once(self, now=None):
+        """
+        Архивирование старых файлов, по одной части архива на день
+        :return: (количество файлов, байт) перенесено в архив
+        """
+        started = time.monotonic()
+        manifest = None
+        if self.not_removed is None:
+            manifest = self.load_manifest()
+            self.not_removed = {name: mtime for info in manifest.values()
+                                for name, mtime in info.get('not_removed', {}).items()}
+        days = self.aged_files(now)
+        total_files = total_bytes = 0
+        if days and manifest is None:
+            manifest = self.load_manifest()
+        for day, files in days.items():
+            if self.stop_event.is_set() or time.monotonic() - started > self.max_run_sec:
+                break
+            part_name, info, archived = self.archive_day(day, files, manifest, started)
+            if part_name is None:
+                continue
+            info['not_removed'] = dict(archived)
+            manifest[part_name] = info
+            self.save_manifest(manifest)
+            # исходные файлы удаляются только после записи архива и manifest.json
+            for name, mtime in archived:
+                self.not_removed[name] = mtime
+                self.remove_archived(name)
+            total_files += info['files']
+            total_bytes += info['bytes']
+
+        if self.not_removed_changed:
+            # в manifest.json остаются только еще не удаленные файлы
+            if manifest is None:
+                manifest = self.load_manifest()
+            for info in manifest.values():
+                not_removed = {name: mtime for name, mtime in info.pop('not_removed', {}).items()
+                               if self.not_removed.get(name) == mtime}
+                if not_removed:
+                    info['not_removed'] = not_removed
+            self.save_manifest(manifest)
+            self.not_removed_changed = False
+        return total_files, total_bytes
+
+    def archive_day(self, day, files, manifest, started):
+        """
+        Новая часть архива дня
+        :return: (имя части относительно папки архива, запись manifest.json, [(имя, mtime) файлов в ней])
+                 или (None, None, None), если ничего не записано
+        """
+        month_dir = day[:7]
+        os.makedirs(os.path.join(self.archive_dir_path, month_dir), exist_ok=True)
+        part = 1
+        while True:
+            part_name = f'{month_dir}/{day}_{part}.zip'
+            if part_name not in manifest and not os.path.exists(os.path.join(self.archive_dir_path, part_name)):
+                break
+            part += 1
+        part_file_name = os.path.join(self.archive_dir_path, part_name)
+        tmp_file_name = part_file_name + '.tmp'
+
+        archived = []
+        size = 0
+        try:
+            with zipfile.ZipFile(tmp_file_name, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name, _, mtime in files:
+                    if self.stop_event.is_set() or time.monotonic() - started > self.max_run_sec:
+                        break
+                    try:
+                        size += self.add_file(zf, name)
+                    except FileNotFoundError:
+                        # файл удален после просмотра папки
+                        continue
+                    archived.append((name, mtime))
+        except Exception:
+            self.remove_tmp(tmp_file_name)
+            raise
+        if not archived:
+            self.remove_tmp(tmp_file_name)
+            return None, None, None
+        os.replace(tmp_file_name, part_file_name)
+        return part_name, {'day': day, 'files': len(archived), 'bytes': size,
+                           'archive_bytes': os.path.getsize(part_file_name), 'first_mtime': archived[0][1],
+                           'last_mtime': archived[-1][1], 'archived': time.time()}, archived
+
+    def remove_archived(self, name):
+        try:
+            os.remove(os.path.join(self.data_dir_path, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # файл открыт (например, лог UPK_server) - удаление при следующем запуске
+            self.log.debug(f'{name} is archived but not removed: {e.__doc__}')
+            return
+        if self.not_removed.pop(name, None) is not None:
+            self.not_removed_changed = True
+
+    @staticmethod
+    def remove_tmp(tmp_file_name):
+        try:
+            os.remove(tmp_file_name)
+        except OSError:
+            pass
+
+    def add_file(self, zf, name):
+        """
+        Файл в архив частями с ограничением скорости чтения
+        :return: размер файла, байт
+        """
+        file_name = os.path.join(self.data_dir_path, name)
+        info = zipfile.ZipInfo.from_file(file_name, name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        size = 0
+        with open(file_name, 'rb') as f_in, zf.open(info, 'w') as f_out:
+            while True:
+                chunk = f_in.read(archive_chunk_size)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+                size += len(chunk)
+                self.throttle(len(chunk))
+        return size
+
+    def throttle(self, size):
+        if self.max_rate_bytes_per_sec > 0:
+            self.stop_event.wait(size / self.max_rate_bytes_per_sec)
+
+
+def find_in_archive(archive_dir_path, template):
+    """
+    Поиск файлов в архиве по шаблону имени
+    :return: [(часть архива, имя файла), ...]
+    """
+    with open(os.path.join(archive_dir_path, archive_manifest_filename), 'r') as f:
+        manifest = json.load(f)
+    found = []
+    for part_name in sorted(manifest):
+        with zipfile.ZipFile(os.path.join(archive_dir_path, part_name)) as zf:
+            found += [(part_name, name) for name in zf.namelist() if fnmatch.fnmatch(name, template)]
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='UPK_supervisor data archive')
+    parser.add_argument('path', help='archive folder')
+    parser.add_argument('--find', help='file name template, e.g. "*_spectrum.npy"')
+    args = parser.parse_args()
+
+    if args.find:
+        for part_name, name in find_in_archive(args.path, args.find):
+            print(f'{part_name}\t{name}')
+    else:
+        with open(os.path.join(args.path, archive_manifest_filename), 'r') as f:
+            manifest = json.load(f)
+        print('part\tday\tfiles\tsize, [bytes]\tarchive, [bytes]\tlast file time')
+        for part_name, info in sorted(manifest.items()):
+            last = datetime.fromtimestamp(info['last_mtime'])
+            print(f'{part_name}\t{info["day"]}\t{info["files"]}\t{info["bytes"]}\t{info["archive_bytes"]}\t'
+                  f'{last.strftime("%Y-%m-%d %H:%M:%S")}')
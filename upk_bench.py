@@ -0,0 +1,323 @@
+"""
+Замеры производительности UPK_supervisor на имитаторах (upk_sim), без УПК, ИТО и Windows
+
+    python upk_bench.py [--quick] [--only startup,dir,log,spectrum,restart] [--json result.json] [--compare old.json]
+
+Замеры:
+    startup  - запуск UPK_supervisor.py отдельным процессом: время импорта модулей и время от запуска
+               до первой оценки скорости поступления данных (за вычетом интервала проверки)
+    dir      - проверка папки с данными: полный обход glob (как раньше), первый и повторный обход
+               DirSizeTracker, опрос и inotify после дозаписи - в зависимости от количества файлов;
+               вне Windows обход DirSizeTracker делает stat на каждый файл, это отмечается в выводе
+    log      - поиск Ping-строки ОСМ в логе UPK_server: без индекса, с индексом, после дозаписи лога
+    spectrum - сохранение спектра ИТО в форматах txt/npy/npz (нужен numpy)
+    restart  - полное действие при срабатывании триггера: перезапуск службы, перезагрузка ИТО
+               командой #reboot и розеткой NetPing; отдельно - время от остановки до запуска службы
+
+Результат - таблица и, при --json, файл для сравнения следующих запусков (--compare).
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from upk_dir_monitor import STAT_FROM_LISTING, DirSizeTracker, create_dir_watcher
+from upk_history import history_filename
+from upk_instrument import state_filename
+from upk_log_reader import PingIndex, get_upk_osm_time_from_logs, upk_log_index_filename
+from upk_sim import SimulatedInstrument, SyntheticDataWriter, sim_config
+
+program_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(fn, repeat=5):
+    """
+    :return: медиана времени выполнения fn, мс
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return 1000 * statistics.median(times)
+
+
+def get_dir_size_bytes(template):
+    """
+    Полный обход папки, как в UPK_supervisor.py до DirSizeTracker - база для сравнения
+    """
+    total_size = 0
+    for file_name in glob.glob(template):
+        file_size = os.path.getsize(file_name)
+        total_size += file_size
+    return total_size
+
+
+def bench_startup(work_dir, repeat, dir_check_interval_sec=0.5, timeout_sec=60):
+    """
+    Запуск программы с ini-файлом на имитаторах; конец замера - первая строка 'Speed' в логе
+    """
+    env = dict(os.environ, PYTHONPATH=program_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = []
+
+    import_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import upk_instrument, upk_logging, upk_metrics, upk_scheduler'],
+                       env=env, check=True)
+        import_times.append(time.perf_counter() - started)
+    results.append(('startup', 'interpreter + supervisor imports', 1000 * statistics.median(import_times), 'ms'))
+
+    # копия программы рядом со своим ini-файлом: имя ini-файла берется из имени программы
+    script = os.path.join(work_dir, 'UPK_supervisor.py')
+    shutil.copy(os.path.join(program_dir, 'UPK_supervisor.py'), script)
+    data_dir_path = os.path.join(work_dir, 'startup_data')
+    log_dir = os.path.join(work_dir, 'startup_logs')
+    SyntheticDataWriter(data_dir_path, 0).prefill(100, 1024)
+    config = sim_config(data_dir_path, dir_check_interval_sec=dir_check_interval_sec, log_dir=log_dir,
+                        log_level='INFO', metrics_snapshot_file='')
+    with open(os.path.join(work_dir, 'UPK_supervisor.ini'), 'w') as f:
+        config.write(f)
+    state_dir_path = config['main']['state_dir_path']
+
+    first_sample_times = []
+    for _ in range(repeat):
+        shutil.rmtree(log_dir, ignore_errors=True)
+        # каждый запуск - первый: восстановленные состояние и история дали бы оценку скорости раньше интервала
+        for dir_path, file_name in ((state_dir_path, state_filename), (state_dir_path, history_filename),
+                                    (state_dir_path, upk_log_index_filename)):
+            try:
+                os.remove(os.path.join(dir_path, file_name))
+            except FileNotFoundError:
+                pass
+        log_file_name = os.path.join(log_dir, 'UPK_supervisor.log')
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, script], env=env, stdout=subprocess.DEVNULL, cwd=work_dir)
+        try:
+            while time.perf_counter() - started < timeout_sec:
+                if os.path.exists(log_file_name):
+                    with open(log_file_name) as f:
+                        if 'Speed, [Mb/h]' in f.read():
+                            first_sample_times.append(time.perf_counter() - started - dir_check_interval_sec)
+                            break
+                if proc.poll() is not None:
+                    raise RuntimeError(f'UPK_supervisor.py exited with code {proc.returncode}')
+                time.sleep(0.005)
+            else:
+                raise TimeoutError('no data rate sample in the log')
+        finally:
+            proc.kill()
+            proc.wait()
+    results.append(('startup', 'launch to first data rate sample', 1000 * statistics.median(first_sample_times), 'ms'))
+    return results
+
+
+def bench_dir(work_dir, file_counts):
+    results = []
+    for num_of_files in file_counts:
+        dir_path = os.path.join(work_dir, f'dir_{num_of_files}')
+        writer = SyntheticDataWriter(dir_path, 0).prefill(num_of_files, 1024)
+        template = os.path.join(dir_path, '*.txt')
+        case = f'{num_of_files} files'
+
+        results.append(('dir', f'{case}, glob+getsize', measure(lambda: get_dir_size_bytes(template)), 'ms'))
+
+        tracker = DirSizeTracker(dir_path, '*.txt')
+        results.append(('dir', f'{case}, tracker first scan', measure(lambda: (tracker.reset(), tracker.scan()), 3), 'ms'))
+
+        for mode in ('poll', 'inotify'):
+            try:
+                watcher = create_dir_watcher(DirSizeTracker(dir_path, '*.txt'), mode)
+            except Exception as e:
+                logging.info(f'Watch mode {mode} is not available: {e.__doc__}')
+                continue
+            watcher.get_dir_size()
+
+            def check():
+                writer.write(100)
+                watcher.get_dir_size()
+
+            results.append(('dir', f'{case}, {watcher.name} check after append', measure(check), 'ms'))
+            watcher.close()
+        shutil.rmtree(dir_path)
+    return results
+
+
+def write_upk_log(file_name, size_bytes):
+    """
+    Лог UPK_server размером size_bytes, единственная Ping-строка ОСМ - в начале файла (худший случай)
+    """
+    ping_line = ("protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:27,887]  server < Frame(fin=True, opcode=9, "
+                 "data=b'31.08.2021 14:55:54', rsv1=False, rsv2=False, rsv3=False)\n")
+    filler = "protocol.py[LINE:1196]# DEBUG    [2021-08-31 14:51:27,888]  server > Frame(fin=True, opcode=1, " \
+             "data=b'{\"ch\": 1, \"values\": [1549.123, 1551.456, 1553.789]}', rsv1=False)\n"
+    block = filler * (65536 // len(filler))
+    with open(file_name, 'w') as f:
+        f.write(ping_line)
+        written = len(ping_line)
+        while written < size_bytes:
+            f.write(block)
+            written += len(block)
+
+
+def bench_log(work_dir, sizes_mb):
+    results = []
+    for size_mb in sizes_mb:
+        log_dir = os.path.join(work_dir, f'log_{size_mb}')
+        os.makedirs(log_dir)
+        log_file_name = os.path.join(log_dir, 'UPK_server_20210831.log')
+        write_upk_log(log_file_name, size_mb * 1024 * 1024)
+        index_file_name = os.path.join(log_dir, 'index.json')
+        case = f'{size_mb} MB log'
+
+        def cold():
+            if os.path.exists(index_file_name):
+                os.remove(index_file_name)
+            get_upk_osm_time_from_logs(log_dir, PingIndex(index_file_name))
+
+        results.append(('log', f'{case}, no index', measure(cold, 3), 'ms'))
+
+        index = PingIndex(index_file_name)
+        get_upk_osm_time_from_logs(log_dir, index)
+        results.append(('log', f'{case}, indexed', measure(lambda: get_upk_osm_time_from_logs(log_dir, index)), 'ms'))
+
+        def appended():
+            with open(log_file_name, 'a') as f:
+                f.write('x' * 100000 + '\n')
+            get_upk_osm_time_from_logs(log_dir, index)
+
+        results.append(('log', f'{case}, indexed after 100 kB append', measure(appended), 'ms'))
+        shutil.rmtree(log_dir)
+    return results
+
+
+def synthetic_spectrum(wavelengths, seed, num_of_peaks=8):
+    """
+    Спектр канала ИТО, дБм: шумовой уровень около -45 с шумом и пики датчиков (ВБР) высотой 20-35 дБ
+    Значения - полные float, как у прибора: короткие десятичные числа делали бы txt меньше, чем на самом деле
+    """
+    rng = random.Random(seed)
+    peaks = [(rng.uniform(wavelengths[0], wavelengths[-1]), rng.uniform(20, 35), rng.uniform(0.05, 0.2))
+             for _ in range(num_of_peaks)]
+    return [-45.0 + rng.gauss(0, 0.5) + sum(height * math.exp(-((w - center) / width) ** 2)
+                                             for center, height, width in peaks)
+            for w in wavelengths]
+
+
+def bench_spectrum(work_dir, points, channels):
+    try:
+        from upk_spectrum import save_spectrum, spectrum_file_formats
+    except ImportError as e:
+        logging.info(f'Spectrum benchmark skipped: {e}')
+        return []
+
+    wavelengths = [1500.0 + 100.0 * i / points for i in range(points)]
+    data = [synthetic_spectrum(wavelengths, seed) for seed in range(channels)]
+    results = []
+    for file_format in spectrum_file_formats:
+        file_name = os.path.join(work_dir, 'spectrum')
+        case = f'{points}x{channels}, {file_format}'
+        results.append(('spectrum', f'{case} save', measure(
+            lambda: save_spectrum(file_name, wavelengths, data, file_format), 3), 'ms'))
+        results.append(('spectrum', f'{case} file size', os.path.getsize(f'{file_name}.{file_format}') / 1024, 'kB'))
+    return results
+
+
+def bench_restart(work_dir, repeat):
+    scenarios = [
+        ('service restart', {'ito_reboot': False}, True),
+        ('ITO reboot by #reboot', {'ito_reboot': True, 'reboot_by_netping': False}, False),
+        ('ITO reboot by NetPing', {'ito_reboot': True, 'reboot_by_netping': True}, True),
+    ]
+    results = []
+    for case, kwargs, netping in scenarios:
+        data_dir_path = os.path.join(work_dir, 'restart')
+        with SimulatedInstrument(data_dir_path, netping=netping, service_delay_sec=0.05) as sim:
+            supervisor = sim.supervisor
+
+            async def restart():
+                await supervisor.load_instrument_description()
+                durations, outages = [], []
+                for _ in range(repeat):
+                    history = sim.service_controller.history
+                    history.clear()
+                    started = time.perf_counter()
+                    await supervisor.action_when_any_trigger_released(**kwargs)
+                    durations.append(time.perf_counter() - started)
+                    # служба не работает от команды остановки до команды запуска
+                    commands = {command: t for t, command, _ in history}
+                    if 'stop' in commands and 'start' in commands:
+                        outages.append(commands['start'] - commands['stop'])
+                return durations, outages
+
+            durations, outages = asyncio.run(restart())
+            if sim.service_controller.current_state(sim.settings.service_name) != 'running':
+                logging.warning(f'{case}: service was not started')
+        results.append(('restart', case, 1000 * statistics.median(durations), 'ms'))
+        if outages:
+            results.append(('restart', f'{case}, service down', 1000 * statistics.median(outages), 'ms'))
+        shutil.rmtree(data_dir_path)
+    return results
+
+
+def print_results(results, baseline=None):
+    baseline = {(group, case): value for group, case, value, unit in baseline or []}
+    for group, case, value, unit in results:
+        line = f'{group:<9} {case:<48} {value:>12.3f} {unit}'
+        old_value = baseline.get((group, case))
+        if old_value:
+            line += f'  ({100 * (value - old_value) / old_value:+.1f}%)'
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='UPK_supervisor benchmarks on simulated equipment')
+    parser.add_argument('--quick', action='store_true', help='smaller folders and logs')
+    parser.add_argument('--only', default='startup,dir,log,spectrum,restart', help='comma separated benchmark groups')
+    parser.add_argument('--json', help='save results to the file')
+    parser.add_argument('--compare', help='results file of a previous run')
+    parser.add_argument('--work-dir', help='folder for temporary files, default system temp')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    groups = args.only.split(',')
+    work_dir = tempfile.mkdtemp(prefix='upk_bench_', dir=args.work_dir)
+    results = []
+    try:
+        if 'startup' in groups:
+            results += bench_startup(work_dir, 3 if args.quick else 5)
+        if 'dir' in groups:
+            results += bench_dir(work_dir, (100, 1000) if args.quick else (100, 1000, 10000))
+        if 'log' in groups:
+            results += bench_log(work_dir, (1, 10) if args.quick else (1, 10, 100))
+        if 'spectrum' in groups:
+            results += bench_spectrum(work_dir, 20000, 4)
+        if 'restart' in groups:
+            results += bench_restart(work_dir, 2 if args.quick else 5)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    if 'dir' in groups and not STAT_FROM_LISTING:
+        print(f'dir: on {sys.platform} every tracker scan and poll check calls stat() once per file, '
+              f'only inotify checks avoid it')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0],
+                       'platform': sys.platform, 'results': results}, f, indent=1)
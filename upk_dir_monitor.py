@@ -0,0 +1,456 @@
+"""
+Отслеживание размера папки с данными УПК
+
+Вместо полного обхода glob.glob + os.path.getsize на каждой проверке хранится кэш
+(имя -> размер, время изменения) и общий размер. На каждой проверке папка читается
+через os.scandir, заново учитываются только новые, изменившиеся и удаленные файлы.
+На Windows размер и время изменения приходят вместе со списком файлов (FindNextFile),
+поэтому отдельный системный вызов на каждый файл не нужен. На Linux и других системах в записи
+каталога (getdents) размера нет, и проверка - это один stat на каждый файл по шаблону: пропускать
+его по неизменным имени и inode нельзя, т.к. дозапись файла inode не меняет. Поэтому там опрос
+по времени близок к полному обходу glob (см. upk_bench.py --only dir), а нагрузку снимает
+наблюдатель inotify: полное перечитывание - только раз в full_rescan_interval_sec.
+
+Файлы можно разделить на потоки (например, каналы регистрации) - функцией, которая по имени файла
+возвращает ключ потока (create_stream_key). Поток файла определяется один раз, при его появлении,
+и записанные байты учитываются для потока в том же проходе по папке.
+
+Наблюдатели за папкой (create_dir_watcher) дают дескриптор событий для цикла asyncio (loop.add_reader):
+на Linux используется inotify, в остальных случаях - опрос через DirSizeTracker.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import logging
+import os
+import re
+import struct
+import sys
+import time
+
+# размер и время изменения файла приходят в записи листинга папки (os.DirEntry.stat без системного вызова)
+STAT_FROM_LISTING = sys.platform == 'win32'
+
+
+class DirSizeTracker:
+    """
+    Инкрементальный подсчет суммарного размера файлов по шаблону
+    Результат совпадает с upk_bench.get_dir_size_bytes(os.path.join(dir_path, template))
+    scan() без STAT_FROM_LISTING делает stat для каждого файла по шаблону
+    """
+
+    def __init__(self, dir_path, template, stream_key=None):
+        """
+        :param stream_key: функция имя файла -> ключ потока или None (файл не относится к потокам)
+        """
+        # шаблон может содержать подпапку, например 'sub\\*.txt'
+        full_template = os.path.join(dir_path, template)
+        self.dir_path, self.pattern = os.path.split(full_template)
+        self.full_template = full_template
+
+        # если в пути к папке есть маски, то scandir не подходит - будет обычный glob
+        self.use_glob = glob.has_magic(self.dir_path)
+
+        # скрытые файлы glob не возвращает, если шаблон не начинается с точки
+        self.include_hidden = self.pattern.startswith('.')
+
+        self.files = {}  # имя файла -> (размер, mtime_ns)
+        self.total_size = 0
+
+        # сколько байт записано в файлы за все время наблюдения: в отличие от total_size
+        # не уменьшается при удалении и ротации файлов
+        self.bytes_written = 0
+
+        # записанные байты по потокам
+        self.stream_key = stream_key
+        self.file_streams = {}  # имя файла -> ключ потока
+        self.stream_bytes_written = {}  # ключ потока -> байт
+
+        # статистика последней проверки
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+
+    def _match(self, name):
+        if not self.include_hidden and name.startswith('.'):
+            return False
+        return fnmatch.fnmatch(name, self.pattern)
+
+    def _iter_entries(self):
+        """
+        Перечисление файлов, подходящих под шаблон
+        :return: генератор пар (имя, os.stat_result)
+        """
+        if self.use_glob:
+            for file_name in glob.glob(self.full_template):
+                try:
+                    yield file_name, os.stat(file_name)
+                except OSError:
+                    # файл удален между листингом и stat
+                    pass
+            return
+
+        try:
+            it = os.scandir(self.dir_path or '.')
+        except FileNotFoundError:
+            return
+
+        with it:
+            for entry in it:
+                if not self._match(entry.name):
+                    continue
+                try:
+                    # на Windows stat() берется из данных листинга без обращения к диску,
+                    # на остальных системах - отдельный системный вызов (см. STAT_FROM_LISTING)
+                    yield entry.name, entry.stat()
+                except OSError:
+                    pass
+
+    def scan(self):
+        """
+        Проверка папки, обновление кэша
+        :return: суммарный размер файлов, байт
+        """
+        added = changed = 0
+        seen = set()
+        files = self.files
+
+        for name, st in self._iter_entries():
+            seen.add(name)
+            new_info = (st.st_size, st.st_mtime_ns)
+            old_info = files.get(name)
+
+            if old_info is None:
+                added += 1
+                self.total_size += new_info[0]
+                self.bytes_written += new_info[0]
+                files[name] = new_info
+                if self.stream_key:
+                    self._add_stream_bytes(name, new_info[0])
+            elif old_info != new_info:
+                # файл дописан, перезаписан или заменен (ротация) - учитываем новый размер
+                changed += 1
+                self.total_size += new_info[0] - old_info[0]
+                written = self._written(old_info[0], new_info[0])
+                self.bytes_written += written
+                files[name] = new_info
+                if self.stream_key:
+                    self._add_stream_bytes(name, written)
+
+        # удаленные файлы - все увиденные файлы уже есть в кэше, поэтому при равенстве количеств удалений нет
+        removed_names = []
+        if len(seen) != len(files):
+            removed_names = [name for name in files if name not in seen]
+        for name in removed_names:
+            self.total_size -= files.pop(name)[0]
+            self.file_streams.pop(name, None)
+
+        self.added = added
+        self.changed = changed
+        self.removed = len(removed_names)
+
+        return self.total_size
+
+    def update_file(self, name):
+        """
+        Учет изменения одного файла (по событию от наблюдателя за папкой)
+        :param name: имя файла в папке
+        :return: True if file size or mtime changed
+        """
+        if not self._match(name):
+            return False
+
+        try:
+            st = os.stat(os.path.join(self.dir_path, name))
+        except OSError:
+            # файла уже нет
+            return self.remove_file(name)
+
+        new_info = (st.st_size, st.st_mtime_ns)
+        old_info = self.files.get(name)
+        if old_info == new_info:
+            return False
+
+        old_size = old_info[0] if old_info else 0
+        written = self._written(old_size, new_info[0])
+        self.total_size += new_info[0] - old_size
+        self.bytes_written += written
+        self.files[name] = new_info
+        if self.stream_key:
+            self._add_stream_bytes(name, written)
+        return True
+
+    def _add_stream_bytes(self, name, written):
+        key = self.file_streams.get(name)
+        if key is None:
+            if name in self.file_streams:
+                return
+            key = self.file_streams[name] = self.stream_key(name)
+            if key is None:
+                return
+        self.stream_bytes_written[key] = self.stream_bytes_written.get(key, 0) + written
+
+    @staticmethod
+    def _written(old_size, new_size):
+        # файл вырос - дописан хвост, уменьшился - перезаписан заново (ротация)
+        return new_size - old_size if new_size >= old_size else new_size
+
+    def remove_file(self, name):
+        old_info = self.files.pop(name, None)
+        if old_info is None:
+            return False
+        self.total_size -= old_info[0]
+        self.file_streams.pop(name, None)
+        return True
+
+    def reset(self):
+        self.files.clear()
+        self.file_streams.clear()
+        self.stream_bytes_written.clear()
+        self.total_size = 0
+        self.bytes_written = 0
+
+
+class PollingDirWatcher:
+    """
+    Наблюдение за папкой опросом - папка перечитывается только при запросе размера
+    Используется там, где нет уведомлений файловой системы
+    """
+
+    name = 'poll'
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.last_data_time = time.monotonic()
+
+    def get_dir_size(self):
+        """
+        :return: текущий суммарный размер файлов по шаблону, байт
+        """
+        tracker = self.tracker
+        size = tracker.scan()
+        if tracker.added or tracker.changed:
+            self.last_data_time = time.monotonic()
+        return size
+
+    def fileno(self):
+        """
+        :return: дескриптор для ожидания событий в цикле asyncio (loop.add_reader) или None, если событий нет
+        """
+        return None
+
+    def needs_scan(self):
+        """
+        :return: True, если get_dir_size будет перечитывать папку - такой вызов лучше делать вне цикла asyncio
+        """
+        return True
+
+    def process_events(self):
+        pass
+
+    def seconds_since_data(self):
+        """
+        :return: сколько секунд в папке не появлялось новых данных
+        """
+        return time.monotonic() - self.last_data_time
+
+    def mark_activity(self, seconds_ago=0.0):
+        # отсчет простоя заново, например после перезапуска службы
+        self.last_data_time = time.monotonic() - seconds_ago
+
+    def close(self):
+        pass
+
+
+class InotifyDirWatcher(PollingDirWatcher):
+    """
+    Наблюдение за папкой через inotify (Linux)
+    События создания, дописывания и удаления файлов сразу обновляют кэш DirSizeTracker,
+    поэтому размер папки известен без ее перечитывания, а простой виден через секунды.
+    Полное перечитывание папки делается редко - для страховки от потерянных событий.
+    """
+
+    name = 'inotify'
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+        IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, tracker, full_rescan_interval_sec=600):
+        super().__init__(tracker)
+        if tracker.use_glob:
+            raise OSError('inotify watch needs plain folder path without wildcards')
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_init1: {os.strerror(errno)}')
+
+        self.wd = -1
+        try:
+            self._add_watch()
+        except OSError:
+            os.close(self.fd)
+            raise
+
+        self.full_rescan_interval_sec = full_rescan_interval_sec
+        self.need_rescan = True
+        self.last_rescan_time = 0
+
+    def _add_watch(self):
+        """
+        Наблюдение за папкой tracker.dir_path
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.tracker.dir_path or '.'), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_add_watch {self.tracker.dir_path}: {os.strerror(errno)}')
+        self.wd = wd
+
+    def _drop_watch(self):
+        """
+        Папка удалена или перемещена - наблюдение снимается и ставится заново на следующей проверке
+        """
+        if self.wd >= 0:
+            # после удаления папки ядро снимает наблюдение само, ошибка здесь не важна
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+            self.wd = -1
+            logging.warning(f'Data folder {self.tracker.dir_path} is deleted or moved, inotify watch is lost')
+
+    def _read_events(self):
+        """
+        Чтение накопившихся событий и обновление кэша размеров
+        """
+        names = set()
+        header_size = self.EVENT_HEADER.size
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset + header_size <= len(buf):
+                wd, mask, cookie, name_len = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += header_size
+                name = buf[offset:offset + name_len].split(b'\0', 1)[0]
+                offset += name_len
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # события потеряны - нужно перечитать папку целиком
+                    self.need_rescan = True
+                elif mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    # IN_IGNORED снятого раньше наблюдения приходит с его старым wd
+                    if wd == self.wd:
+                        self._drop_watch()
+                        self.need_rescan = True
+                elif name:
+                    names.add(os.fsdecode(name))
+
+        data_came = False
+        for name in names:
+            if self.tracker.update_file(name) and name in self.tracker.files:
+                data_came = True
+        if data_came:
+            self.last_data_time = time.monotonic()
+
+    def fileno(self):
+        return self.fd
+
+    def needs_scan(self):
+        return self.wd < 0 or self.need_rescan or \
+            time.monotonic() - self.last_rescan_time >= self.full_rescan_interval_sec
+
+    def process_events(self):
+        self._read_events()
+
+    def get_dir_size(self):
+        self._read_events()
+        if self.wd < 0:
+            try:
+                self._add_watch()
+                logging.info(f'inotify watch of data folder {self.tracker.dir_path} is restored')
+            except OSError:
+                # папки пока нет - опрос, как в PollingDirWatcher, до восстановления наблюдения
+                return super().get_dir_size()
+            # изменения до восстановления наблюдения не видны по событиям
+            self.need_rescan = True
+        if self.need_rescan or time.monotonic() - self.last_rescan_time >= self.full_rescan_interval_sec:
+            self.need_rescan = False
+            self.last_rescan_time = time.monotonic()
+            self.tracker.scan()
+            if self.tracker.added or self.tracker.changed:
+                self.last_data_time = time.monotonic()
+        return self.tracker.total_size
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.wd = -1
+
+
+def create_stream_key(templates=None, key_pattern=None):
+    """
+    Функция определения потока файла по имени
+    :param templates: [(имя потока, шаблон имени файла), ...] - поток по первому подходящему шаблону
+    :param key_pattern: регулярное выражение, поток - первая группа (или все совпадение), например r'^(ch[0-9]+)_'
+    :return: функция имя файла -> ключ потока или None; None, если потоки не заданы
+    """
+    if templates and key_pattern:
+        raise ValueError('streams and stream_key_pattern can not be used together')
+    if templates:
+        def stream_key(name):
+            for key, template in templates:
+                if fnmatch.fnmatch(name, template):
+                    return key
+            return None
+        return stream_key
+    if key_pattern:
+        regex = re.compile(key_pattern)
+
+        def stream_key(name):
+            m = regex.search(name)
+            if m is None:
+                return None
+            return m.group(1) if regex.groups else m.group(0)
+        return stream_key
+    return None
+
+
+def create_dir_watcher(tracker, mode='auto'):
+    """
+    Выбор способа наблюдения за папкой с данными
+    :param tracker: DirSizeTracker
+    :param mode: 'auto' - inotify если доступен, иначе опрос; 'inotify'; 'poll'
+    :return: PollingDirWatcher or InotifyDirWatcher
+    """
+    mode = (mode or 'auto').strip().lower()
+    if mode not in ('auto', 'inotify', 'poll'):
+        raise ValueError(f'Unknown dir watch mode "{mode}", expected auto, inotify or poll')
+
+    if mode in ('auto', 'inotify') and sys.platform.startswith('linux'):
+        try:
+            return InotifyDirWatcher(tracker)
+        except Exception as e:
+            if mode == 'inotify':
+                raise
+            logging.info(f'inotify is not available, polling is used: {e}')
+
+    return PollingDirWatcher(tracker)
@@ -0,0 +1,299 @@
+"""
+История скорости поступления данных
+
+Каждая проверка папки (время, размер файлов данных, скорость, состояние триггеров) записывается
+в файл фиксированного размера, отображенный в память (mmap). В файле три кольца записей:
+    raw  - все проверки, history_samples последних
+    hour - по часу: минимальная, максимальная и средняя скорость, последний размер папки
+    day  - то же по суткам
+Запись проверки - несколько struct.pack_into в отображенную память: файл не растет, память постоянна,
+на диск изменения сбрасывает система. Текущий интервал hour/day обновляется на месте, поэтому после
+перезапуска программы усреднение продолжается.
+
+Запрос диапазона читает только нужные записи (двоичный поиск по времени) и выбирает самое подробное
+кольцо, в котором диапазон помещается в max_points точек:
+
+    python upk_history.py <папка состояния или файл> [--from "2021-10-01 00:00"] [--to ...] [--tier auto|raw|hour|day]
+"""
+
+import argparse
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+history_filename = 'UPK_supervisor_history.bin'  # история скорости, в папке состояния
+
+history_magic = b'UPKH'
+history_version = 1
+
+# флаги записи
+flag_recovery = 1  # выполняется действие при срабатывании триггера
+flag_hold_off = 2  # действия приостановлены (upk_recovery)
+
+# magic, version, число колец; далее для каждого кольца: длина интервала (0 - raw), емкость, сколько записей было
+header_record = struct.Struct('<4sHH')
+tier_record = struct.Struct('<IIQ')
+# время, размер файлов данных, скорость Mb/h (nan - еще не оценена), счетчик триггеров, флаги
+raw_record = struct.Struct('<dQfHH')
+# начало интервала, скорость min/max/mean, число оценок скорости, наибольший счетчик триггеров,
+# флаги (объединение), последний размер файлов
+bucket_record = struct.Struct('<dfffIHHQ')
+
+tier_names = ('raw', 'hour', 'day')
+tier_intervals_sec = (0, 3600, 86400)
+bucket_capacities = (2 * 366 * 24, 10 * 366)  # hour - два года, day - десять лет
+
+HistoryPoint = namedtuple('HistoryPoint', 'time min max mean size triggers flags count')
+
+
+class _Tier:
+    __slots__ = ('name', 'interval_sec', 'capacity', 'record', 'offset', 'header_offset', 'head')
+
+    def __init__(self, name, interval_sec, capacity, record, offset, header_offset):
+        self.name = name
+        self.interval_sec = interval_sec
+        self.capacity = capacity
+        self.record = record
+        self.offset = offset  # начало записей кольца в файле
+        self.header_offset = header_offset  # описание кольца в заголовке
+        self.head = 0  # сколько записей было добавлено, последняя - head - 1
+
+    def count(self):
+        return min(self.head, self.capacity)
+
+    def position(self, i):
+        """
+        Смещение i-й по времени записи из имеющихся
+        """
+        return self.offset + ((self.head - self.count() + i) % self.capacity) * self.record.size
+
+
+class HistoryStore:
+    """
+    Кольца истории в файле, отображенном в память
+    """
+
+    def __init__(self, file_name, raw_capacity=100000, readonly=False, log=logging):
+        """
+        :param file_name: файл истории; создается, если его нет или он другого формата
+        :param raw_capacity: сколько последних проверок хранить без усреднения
+        :param readonly: только чтение (для запросов из другого процесса), емкость берется из файла
+        """
+        self.file_name = file_name
+        self.log = log
+        self.readonly = readonly
+        self._f = None
+        self._mm = None
+
+        if readonly:
+            with open(file_name, 'rb') as f:
+                raw_capacity = self._read_capacities(f.read(header_record.size + tier_record.size))
+            if raw_capacity is None:
+                raise ValueError(f'{file_name} is not a data rate history file')
+
+        capacities = (raw_capacity,) + bucket_capacities
+        records = (raw_record,) + (bucket_record,) * len(bucket_capacities)
+        offset = header_record.size + tier_record.size * len(tier_names)
+        self.tiers = []
+        for i, (name, interval_sec, capacity, record) in enumerate(zip(tier_names, tier_intervals_sec, capacities,
+                                                                        records)):
+            self.tiers.append(_Tier(name, interval_sec, capacity, record, offset,
+                                    header_record.size + i * tier_record.size))
+            offset += capacity * record.size
+        self.size = offset
+        self._open()
+
+    @staticmethod
+    def _read_capacities(data):
+        if len(data) < header_record.size + tier_record.size:
+            return None
+        magic, version, num_of_tiers = header_record.unpack_from(data)
+        if magic != history_magic or version != history_version or num_of_tiers != len(tier_names):
+            return None
+        return tier_record.unpack_from(data, header_record.size)[1]
+
+    def _header_matches(self):
+        mm = self._mm
+        if header_record.unpack_from(mm) != (history_magic, history_version, len(self.tiers)):
+            return False
+        for tier in self.tiers:
+            interval_sec, capacity, _ = tier_record.unpack_from(mm, tier.header_offset)
+            if (interval_sec, capacity) != (tier.interval_sec, tier.capacity):
+                return False
+        return True
+
+    def _open(self):
+        if self.readonly:
+            self._f = open(self.file_name, 'rb')
+            self._mm = mmap.mmap(self._f.fileno(), self.size, access=mmap.ACCESS_READ)
+        else:
+            existed = os.path.isfile(self.file_name)
+            same_size = existed and os.path.getsize(self.file_name) == self.size
+            self._f = open(self.file_name, 'r+b' if existed else 'w+b')
+            self._f.truncate(self.size)
+            self._mm = mmap.mmap(self._f.fileno(), self.size)
+            if not same_size or not self._header_matches():
+                if existed:
+                    self.log.info(f'History file {self.file_name} has another format or size, history starts anew')
+                self._mm[:self.size] = bytes(self.size)
+                header_record.pack_into(self._mm, 0, history_magic, history_version, len(self.tiers))
+                for tier in self.tiers:
+                    tier_record.pack_into(self._mm, tier.header_offset, tier.interval_sec, tier.capacity, 0)
+        for tier in self.tiers:
+            tier.head = tier_record.unpack_from(self._mm, tier.header_offset)[2]
+
+    def _set_head(self, tier, head):
+        tier.head = head
+        struct.pack_into('<Q', self._mm, tier.header_offset + 8, head)
+
+    def append(self, t, size, rate_mb_per_h=None, triggers=0, flags=0):
+        """
+        Запись проверки папки
+        :param t: время, time.time()
+        :param size: размер файлов данных, байт
+        :param rate_mb_per_h: скорость или None, если ее еще нельзя оценить
+        :param triggers: счетчик срабатываний trigger1
+        :param flags: flag_recovery, flag_hold_off
+        """
+        raw = self.tiers[0]
+        if raw.head and t < raw.record.unpack_from(self._mm, raw.position(raw.count() - 1))[0]:
+            # часы переведены назад - записи должны идти по времени
+            return
+        rate = math.nan if rate_mb_per_h is None else rate_mb_per_h
+        triggers = min(triggers, 0xffff)
+        raw.record.pack_into(self._mm, raw.offset + (raw.head % raw.capacity) * raw.record.size,
+                             t, size, rate, triggers, flags)
+        self._set_head(raw, raw.head + 1)
+
+        for tier in self.tiers[1:]:
+            start = t - t % tier.interval_sec
+            last = None
+            if tier.head:
+                last = tier.record.unpack_from(self._mm, tier.position(tier.count() - 1))
+            if last is not None and last[0] == start:
+                _, lo, hi, mean, count, max_triggers, old_flags, _ = last
+                position = tier.position(tier.count() - 1)
+            else:
+                lo = hi = mean = math.nan
+                count = max_triggers = old_flags = 0
+                position = tier.offset + (tier.head % tier.capacity) * tier.record.size
+                self._set_head(tier, tier.head + 1)
+            if not math.isnan(rate):
+                count += 1
+                if count == 1:
+                    lo = hi = mean = rate
+                else:
+                    lo, hi = min(lo, rate), max(hi, rate)
+                    mean += (rate - mean) / count
+            tier.record.pack_into(self._mm, position, start, lo, hi, mean, count, max(max_triggers, triggers),
+                                  old_flags | flags, size)
+
+    def _point(self, tier, i):
+        values = tier.record.unpack_from(self._mm, tier.position(i))
+        if tier is self.tiers[0]:
+            t, size, rate, triggers, flags = values
+            return HistoryPoint(t, rate, rate, rate, size, triggers, flags, 0 if math.isnan(rate) else 1)
+        start, lo, hi, mean, count, triggers, flags, size = values
+        return HistoryPoint(start, lo, hi, mean, size, triggers, flags, count)
+
+    def _bisect(self, tier, t):
+        """
+        :return: номер первой записи кольца со временем не меньше t
+        """
+        lo, hi = 0, tier.count()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tier.record.unpack_from(self._mm, tier.position(mid))[0] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def tier(self, name):
+        for tier in self.tiers:
+            if tier.name == name:
+                return tier
+        raise ValueError(f'tier should be one of {", ".join(tier_names)}')
+
+    def query(self, start=None, end=None, tier='auto', max_points=1000):
+        """
+        Записи за время [start, end)
+        :param start: начало, time.time(), None - с самой старой записи
+        :param end: конец, None - по последнюю запись
+        :param tier: raw, hour, day или auto - самое подробное кольцо, которое покрывает начало
+                     диапазона и дает не больше max_points точек
+        :return: (имя кольца, список HistoryPoint)
+        """
+        start = -math.inf if start is None else start
+        end = math.inf if end is None else end
+        if tier == 'auto':
+            chosen = self.tiers[-1]
+            for t in self.tiers:
+                if not t.count():
+                    continue
+                # кольцо без перезаписи хранит всю историю
+                covers = t.head <= t.capacity or self._point(t, 0).time <= start
+                if covers and self._bisect(t, end) - self._bisect(t, start) <= max_points:
+                    chosen = t
+                    break
+        else:
+            chosen = self.tier(tier)
+
+        if chosen.interval_sec and not math.isinf(start):
+            # интервал, в который попадает start
+            start -= start % chosen.interval_sec
+        first, last = self._bisect(chosen, start), self._bisect(chosen, end)
+        return chosen.name, [self._point(chosen, i) for i in range(first, last)]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def parse_time(value):
+    """
+    Время из командной строки: '2021-10-01', '2021-10-01 12:00' или '2021-10-01 12:00:00'
+    """
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f'wrong time {value}')
+
+
+def format_flags(flags):
+    return ','.join(name for bit, name in ((flag_recovery, 'recovery'), (flag_hold_off, 'hold_off')) if flags & bit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='UPK_supervisor data rate history')
+    parser.add_argument('path', help=f'state folder or {history_filename}')
+    parser.add_argument('--from', dest='start', type=parse_time, help='start time, YYYY-MM-DD[ HH:MM[:SS]]')
+    parser.add_argument('--to', dest='end', type=parse_time, help='end time')
+    parser.add_argument('--tier', default='auto', choices=('auto',) + tier_names)
+    parser.add_argument('--max-points', type=int, default=1000, help='points limit for --tier auto')
+    args = parser.parse_args()
+
+    file_name = os.path.join(args.path, history_filename) if os.path.isdir(args.path) else args.path
+    started = time.perf_counter()
+    store = HistoryStore(file_name, readonly=True)
+    tier_name, points = store.query(args.start, args.end, args.tier, args.max_points)
+    query_ms = 1000 * (time.perf_counter() - started)
+
+    print('time\tmin, [Mb/h]\tmax, [Mb/h]\tmean, [Mb/h]\tsize, [bytes]\ttriggers\tflags')
+    for p in points:
+        print(f'{datetime.fromtimestamp(p.time).strftime("%Y-%m-%d %H:%M:%S")}\t{p.min:.3f}\t{p.max:.3f}\t'
+              f'{p.mean:.3f}\t{p.size}\t{p.triggers}\t{format_flags(p.flags)}')
+    store.close()
+    print(f'{len(points)} points from {tier_name} in {query_ms:.1f} ms', file=sys.stderr)
@@ -0,0 +1,1099 @@
+"""
+Контроль одной пары УПК/ИТО
+
+Один процесс UPK_supervisor может следить за несколькими парами УПК/ИТО - по одной на секцию
+[instrument:<имя>] ini-файла. Для каждой пары создается InstrumentSupervisor со своими настройками,
+состоянием триггеров и подключением к ИТО. Все пары работают в одном цикле asyncio и используют
+общий пул потоков для работы с диском; команды каждого ИТО идут в своем потоке, поэтому
+медленный или зависший прибор не задерживает проверки остальных.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from upk_archive import DataArchiver
+from upk_dir_monitor import DirSizeTracker, create_dir_watcher, create_stream_key
+from upk_history import HistoryStore, flag_hold_off, flag_recovery, history_filename
+from upk_ito import ItoSession
+from upk_log_reader import PingIndex, OsmClockTracker, get_upk_osm_time_from_logs, upk_server_log_files_template, \
+    upk_log_index_filename
+from upk_metrics import registry
+from upk_profile import trace
+from upk_rate import create_rate_estimator
+from upk_recovery import RecoveryPolicy, default_prior_ttr_sec
+from upk_service import create_service_controller
+from upk_state import StateFile, SupervisorState
+from upk_spectrum import save_spectrum, spectrum_file_formats
+
+instrument_section_prefix = 'instrument:'
+state_filename = 'UPK_supervisor_state.bin'  # состояние триггеров между запусками, в папке состояния
+state_dir_name = 'state'  # папка состояния рядом с ini-файлом, если state_dir_path не задан
+ito_library_retry_max_pause_sec = 3600  # наибольшая пауза между попытками загрузить библиотеку ИТО
+
+_required = object()
+
+# метрики, метка instrument - имя пары УПК/ИТО
+metric_data_rate = registry.gauge('upk_data_rate_mb_per_h', 'Data folder growth rate, Mb/h', ['instrument'])
+metric_stream_rate = registry.gauge('upk_stream_data_rate_mb_per_h', 'Data rate of the data stream, Mb/h',
+                                    ['instrument', 'stream'])
+metric_stream_triggers = registry.counter('upk_stream_triggers_total', 'Trigger1 releases by low rate of the data stream',
+                                          ['instrument', 'stream'])
+metric_dir_size = registry.gauge('upk_dir_size_bytes', 'Size of data files in the data folder', ['instrument'])
+metric_dir_files = registry.gauge('upk_dir_files', 'Number of data files in the data folder', ['instrument'])
+metric_dir_scan = registry.histogram('upk_dir_scan_seconds', 'Data folder check duration', ['instrument'])
+metric_triggers = registry.counter('upk_triggers_total', 'Released triggers', ['instrument', 'trigger'])
+metric_unsuccessful_reboots = registry.gauge('upk_unsuccessful_reboots', 'Unsuccessful ITO reboots in a row',
+                                             ['instrument'])
+metric_action = registry.histogram('upk_action_seconds', 'Duration of the action on trigger release', ['instrument'])
+metric_action_phase = registry.histogram('upk_action_phase_seconds', 'Duration of action steps',
+                                         ['instrument', 'phase'])
+metric_action_phase_errors = registry.counter('upk_action_phase_errors_total', 'Action steps failed or timed out',
+                                              ['instrument', 'phase'])
+metric_time_to_first_data = registry.histogram('upk_time_to_first_data_seconds',
+                                               'Time from the service start to the first new data', ['instrument'])
+metric_readiness_probes = registry.counter('upk_readiness_probes_total', 'Readiness probes after the action by result',
+                                           ['instrument', 'result'])
+metric_recovery_actions = registry.counter('upk_recovery_actions_total', 'Recovery actions by level and result',
+                                           ['instrument', 'action', 'result'])
+metric_archived_files = registry.counter('upk_archived_files_total', 'Files moved from the data folder to the archive',
+                                         ['instrument'])
+metric_archived_bytes = registry.counter('upk_archived_bytes_total', 'Bytes moved from the data folder to the archive',
+                                         ['instrument'])
+metric_time_to_recovery = registry.histogram('upk_time_to_recovery_seconds',
+                                             'Time from the recovery action start to the data flow recovery',
+                                             ['instrument', 'action'])
+
+
+def parse_named_values(value, conv=str):
+    """
+    Список 'имя: значение, имя: значение' из ini-файла; значение без имени - с именем '*'
+    :return: [(имя, значение), ...]
+    """
+    ret = []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, sep, item_value = item.partition(':')
+        if not sep:
+            name, item_value = '*', name
+        ret.append((name.strip(), conv(item_value.strip())))
+    return ret
+
+
+class InstrumentSettings:
+    """
+    Настройки одной пары УПК/ИТО
+    Параметр ищется в секции [instrument:<имя>], а если его там нет - в общей секции
+    ([main], [netping], [trigger1], [trigger2]), поэтому старый ini-файл без секций [instrument:*]
+    описывает одну пару
+    """
+
+    def __init__(self, config, section=None, default_state_dir_path=''):
+        """
+        :param config: configparser.ConfigParser
+        :param section: имя секции [instrument:<имя>] или None для старого формата ini-файла
+        :param default_state_dir_path: папка состояния, если state_dir_path не задан, по умолчанию state в текущей папке
+        """
+        self.config = config
+        self.section = section
+        self.name = section[len(instrument_section_prefix):].strip() if section else ''
+
+        # Main settings
+        self.instrument_description_filename = self.get('instrument_description_filename', 'main')
+        self.ITO_rebooting_duration_sec = self.get('ITO_rebooting_duration_sec', 'main', conv=float)
+        self.win_service_restart_pause = self.get('win_service_restart_pause', 'main', conv=float)
+        self.spectrum_file_format = self.get('spectrum_file_format', 'main', 'txt').strip().lower()
+        if self.spectrum_file_format not in spectrum_file_formats:
+            raise ValueError(f'spectrum_file_format should be one of {", ".join(spectrum_file_formats)}')
+        self.action_step_timeout_sec = self.get('action_step_timeout_sec', 'main', 60, float)
+        self.history_samples = self.get('history_samples', 'main', 100000, int)  # проверок в истории скорости без усреднения, 0 - без истории
+        # файлы состояния между запусками - вне папки с данными, у каждой пары [instrument:<имя>] своя подпапка
+        state_dir_path = self.get('state_dir_path', 'main', '') or default_state_dir_path or \
+            os.path.join(os.getcwd(), state_dir_name)
+        self.state_dir_path = os.path.join(state_dir_path, self.name) if self.name else state_dir_path
+
+        # ITO IP-address can be set in the section, otherwise it is read from instrument description file
+        self.ito_ip = self.get('ito_ip', None, '')
+
+        # NetPing settings
+        self.netping_relay_address = self.get('netping_relay_address', 'netping', '')  # адрес управляемой розетки
+        self.netping_relay_ito_socket_num = self.get('netping_relay_ito_socket_num', 'netping', 0, int)  # номер розетки, в которую воткнут ИТО
+        self.reboot_by_netping = bool(self.netping_relay_address)
+
+        # Trigger1 settings
+        self.data_dir_path = self.get('data_dir_path', 'trigger1')
+        self.instrument_description_filename = os.path.join(self.data_dir_path, self.instrument_description_filename)
+        self.files_template = self.get('files_template', 'trigger1')
+        self.dir_size_speed_threshold_mb_per_h = self.get('dir_size_speed_threshold_mb_per_h', 'trigger1', conv=float)  # минимальная скорость прироста размера папки, при которой не будет перезапускаться служба
+        self.service_name = self.get('service_name', 'trigger1')  # имя службы для перезапуска
+        self.service_control = self.get('service_control', 'trigger1', 'auto').strip().lower()  # способ управления службой: auto, scm, systemd, sc
+        self.service_stop_timeout_sec = self.get('service_stop_timeout_sec', 'trigger1', 60, float)  # ожидание остановки службы до принудительного завершения
+        self.service_start_timeout_sec = self.get('service_start_timeout_sec', 'trigger1', 60, float)  # ожидание запуска службы
+        self.service_kill_timeout_sec = self.get('service_kill_timeout_sec', 'trigger1', 10, float)  # ожидание остановки после принудительного завершения
+        # ограничения времени шагов остановки и запуска службы - не меньше ожидания ее состояния
+        self.service_stop_step_timeout_sec = max(self.action_step_timeout_sec, self.service_stop_timeout_sec +
+                                                 self.service_kill_timeout_sec + 1) + self.win_service_restart_pause
+        self.service_start_step_timeout_sec = max(self.action_step_timeout_sec, self.service_start_timeout_sec + 1)
+        self.dir_check_interval_sec = self.get('dir_check_interval_sec', 'trigger1', conv=float)  # интервал проверки
+        self.num_of_triggers_before_action = self.get('num_of_triggers_before_action', 'trigger1', conv=int)  # количество срабатываний триггера до перезапуска службы
+        self.num_of_service_restarts_before_ito_reboot = self.get('num_of_service_restarts_before_ito_reboot', 'trigger1', conv=int)  # количество перезапусков службы до перезагрузки прибора
+        self.max_unsuccessful_reboots = self.get('max_unsuccessful_reboots', 'trigger1', conv=int)  # максимальное число перезапусков ИТО (неудачных подряд)
+        # уровни действий при сбое: без розетки нет netping, при num_of_service_restarts_before_ito_reboot = 0 - без перезагрузки ИТО
+        self.recovery_levels = [level.strip().lower() for level in
+                                self.get('recovery_levels', 'trigger1', 'service, reboot, netping').split(',') if level.strip()]
+        if not self.netping_relay_address:
+            self.recovery_levels = [level for level in self.recovery_levels if level != 'netping']
+        if self.num_of_service_restarts_before_ito_reboot <= 0:
+            self.recovery_levels = [level for level in self.recovery_levels if level == 'service']
+        self.recovery_backoff_sec = self.get('recovery_backoff_sec', 'trigger1', 600, float)  # пауза действий, когда не помог ни один уровень
+        self.recovery_backoff_max_sec = self.get('recovery_backoff_max_sec', 'trigger1', 6 * 3600, float)  # наибольшая пауза, пауза удваивается до нее
+        self.dir_watch_mode = self.get('dir_watch_mode', 'trigger1', 'auto')  # способ наблюдения за папкой: auto, inotify, poll
+        self.data_stall_timeout_sec = self.get('data_stall_timeout_sec', 'trigger1', 0, float)  # простой без новых данных, после которого триггер срабатывает сразу
+        self.speed_estimator = self.get('speed_estimator', 'trigger1', 'mean')  # способ оценки скорости: last, mean, ewma, slope
+        self.speed_window = self.get('speed_window', 'trigger1', 5, int)  # количество проверок папки в окне оценки скорости
+        self.speed_ewma_alpha = self.get('speed_ewma_alpha', 'trigger1', 0.3, float)  # коэффициент сглаживания для ewma
+        self.readiness_timeout_sec = self.get('readiness_timeout_sec', 'trigger1', 0, float)  # ожидание первых данных после запуска службы, 0 - без проверки
+        self.readiness_window_sec = self.get('readiness_window_sec', 'trigger1', 30, float)  # окно проверки скорости после первых данных
+        self.readiness_poll_interval_sec = self.get('readiness_poll_interval_sec', 'trigger1', 1, float)  # интервал проверки папки во время проверки готовности
+        self.readiness_speed_threshold_mb_per_h = self.get('readiness_speed_threshold_mb_per_h', 'trigger1',
+                                                           self.dir_size_speed_threshold_mb_per_h, float)  # минимальная скорость в окне проверки готовности
+        # потоки данных (например, каналы): у каждого своя скорость и свой порог
+        self.streams = parse_named_values(self.get('streams', 'trigger1', ''))  # [(имя потока, шаблон имени файла)]
+        self.stream_key_pattern = self.get('stream_key_pattern', 'trigger1', '').strip()  # поток - группа регулярного выражения по имени файла
+        self.stream_speed_thresholds_mb_per_h = dict(parse_named_values(
+            self.get('stream_speed_threshold_mb_per_h', 'trigger1', ''), float))  # минимальная скорость потока, 0 - не проверяется
+
+        # архивирование старых файлов из папки с данными
+        self.archive_max_age_days = self.get('archive_max_age_days', 'main', 0, float)  # возраст файлов для архивирования, 0 - без архивирования
+        self.archive_dir_path = self.get('archive_dir_path', 'main', '') or self.data_dir_path.rstrip('\\/') + '_archive'
+        archive_templates = self.get('archive_templates', 'main', '')
+        self.archive_templates = [t.strip() for t in archive_templates.split(',') if t.strip()] if archive_templates else \
+            [self.files_template, '*_spectrum.*', upk_server_log_files_template]  # шаблоны имен архивируемых файлов
+        self.archive_check_interval_sec = self.get('archive_check_interval_sec', 'main', 3600, float)
+        self.archive_max_rate_mb_per_sec = self.get('archive_max_rate_mb_per_sec', 'main', 5, float)  # ограничение скорости чтения файлов при архивировании
+
+        # Trigger2 settings
+        self.win_service_restart_interval_sec = self.get('win_service_restart_interval_sec', 'trigger2', 0, float)
+        self.ito_datetime_source = self.get('ito_datetime_source', 'trigger2', 0, int)
+        self.trigger2_enable = self.win_service_restart_interval_sec > 0
+
+    def get(self, key, common_section, default=_required, conv=str):
+        """
+        Значение параметра: из секции прибора, иначе из общей секции, иначе default
+        """
+        for section_name in (self.section, common_section):
+            if section_name and self.config.has_option(section_name, key):
+                return conv(self.config.get(section_name, key))
+        if default is _required:
+            raise KeyError(f'{key} in [{self.section or common_section}]')
+        return default
+
+    def stream_speed_threshold_mb_per_h(self, stream):
+        return self.stream_speed_thresholds_mb_per_h.get(stream, self.stream_speed_thresholds_mb_per_h.get('*', 0.0))
+
+    @staticmethod
+    def read_all(config, default_state_dir_path=''):
+        """
+        Настройки всех пар УПК/ИТО из ini-файла
+        :return: список InstrumentSettings
+        """
+        sections = [s for s in config.sections() if s.startswith(instrument_section_prefix)]
+        if not sections:
+            return [InstrumentSettings(config, None, default_state_dir_path)]
+        return [InstrumentSettings(config, s, default_state_dir_path) for s in sections]
+
+
+class InstrumentLogAdapter(logging.LoggerAdapter):
+    """
+    Сообщения в лог с именем пары УПК/ИТО, если пар несколько
+    """
+
+    def process(self, msg, kwargs):
+        if self.extra['name']:
+            return f'[{self.extra["name"]}] {msg}', kwargs
+        return msg, kwargs
+
+
+async def run_step(name, coro, timeout_sec, log=logging, on_error=None):
+    """
+    Выполнение шага действия с ограничением времени
+    Ошибка или таймаут шага пишутся в лог и не прерывают остальные шаги
+    :param name: название шага для лога
+    :param coro: корутина шага
+    :param timeout_sec: ограничение времени
+    :param on_error: функция без аргументов, вызывается при ошибке или таймауте
+    :return: результат шага или None при ошибке
+    """
+    try:
+        return await asyncio.wait_for(coro, timeout_sec)
+    except asyncio.TimeoutError:
+        log.error(f'Timeout {timeout_sec}sec during {name}')
+    except Exception as e:
+        log.error(f'Some error during {name} - exception: {e.__doc__}')
+    if on_error:
+        on_error()
+    return None
+
+
+def phase_label(step_name):
+    """
+    Метка шага действия для метрик: 'ITO date/time setting' -> 'ito_date_time_setting'
+    """
+    return step_name.lower().replace('/', '_').replace(' ', '_')
+
+
+def netping_relay_factory(address):
+    """
+    Розетка NetPing по умолчанию; библиотека импортируется только при использовании
+    """
+    from netpingrelay import NetpingRelay
+    return NetpingRelay(address)
+
+
+class InstrumentSupervisor:
+    """
+    Триггеры и действия для одной пары УПК/ИТО
+    """
+
+    def __init__(self, settings, service_controller=None, ito_session_factory=None, relay_factory=None):
+        """
+        :param settings: InstrumentSettings
+        :param service_controller: управление службой УПК, по умолчанию по параметру service_control
+        :param ito_session_factory: функция создания подключения к ИТО по адресу, по умолчанию ItoSession (hyperion)
+        :param relay_factory: функция создания розетки по адресу, по умолчанию NetpingRelay
+        """
+        self.settings = settings
+        self.log = InstrumentLogAdapter(logging.getLogger(), {'name': settings.name})
+        self.service_controller = service_controller or create_service_controller(
+            settings.service_control, settings.service_stop_timeout_sec, settings.service_start_timeout_sec,
+            settings.service_kill_timeout_sec, self.log)
+        self.ito_session_factory = ito_session_factory or ItoSession
+        self.relay_factory = relay_factory or netping_relay_factory
+        self.name = settings.name
+
+        # состояние триггеров
+        self.cur_num_of_triggers = 0
+        self.cur_unsuccessful_reboots = 0
+        self.recovery_policy = RecoveryPolicy(
+            settings.recovery_levels,
+            attempts={'service': settings.num_of_service_restarts_before_ito_reboot},
+            prior_ttr_sec=default_prior_ttr_sec(settings.win_service_restart_pause + settings.dir_check_interval_sec,
+                                                settings.ITO_rebooting_duration_sec),
+            max_unsuccessful_reboots=settings.max_unsuccessful_reboots,
+            backoff_sec=settings.recovery_backoff_sec, backoff_max_sec=settings.recovery_backoff_max_sec, log=self.log)
+        self.recovery_task = None  # выполняемое действие при срабатывании триггера
+        self.diagnostics_task = None  # спектры и температура ИТО после запуска службы
+        self.scan_lock = asyncio.Lock()  # папку перечитывают и проверки trigger1, и проверка готовности
+        self.scheduler = None  # DeadlineScheduler, задается в schedule_triggers
+        self.trigger1_job = None
+        self.stall_job = None
+        self.jobs = []  # все задания пары в планировщике
+        self.reader_fd = None  # дескриптор наблюдателя за папкой в цикле asyncio
+
+        self.ito_ip = settings.ito_ip
+        self.ito_session = None  # подключение к ИТО, одно на все проверки и команды
+        self.ito_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'ito_{settings.name}')  # поток для команд ИТО
+
+        # состояние прошлого запуска: счетчики восстанавливаются сразу, размер папки и время последних
+        # данных - после первой проверки папки
+        os.makedirs(settings.state_dir_path, exist_ok=True)
+        self.state_file = StateFile(self.state_file_path(state_filename), self.log)
+        self.upk_log_index = PingIndex(self.state_file_path(upk_log_index_filename))
+        self.restored_state = self.state_file.load()
+        self.trigger2_time = time.time()  # время последнего срабатывания trigger2 (или запуска)
+        self.sample_time = 0.0  # время последней проверки папки
+        self.cur_speed_mb_per_h = None  # скорость на последней проверке
+        if self.restored_state is not None:
+            state = self.restored_state
+            self.cur_num_of_triggers = state.cur_num_of_triggers
+            self.cur_unsuccessful_reboots = state.cur_unsuccessful_reboots
+            if 0 < state.trigger2_time <= self.trigger2_time:
+                self.trigger2_time = state.trigger2_time
+            # файл прошлых версий: уровня нет, есть число перезапусков службы
+            level = state.recovery_level or ('service' if state.num_of_service_restarts else '')
+            self.recovery_policy.restore(level, state.num_of_service_restarts)
+            self.log.info(f'State restored: triggers {state.cur_num_of_triggers}, '
+                          f'recovery level {level or "none"}, actions at the level {state.num_of_service_restarts}, '
+                          f'unsuccessful reboots {state.cur_unsuccessful_reboots}')
+
+        # расхождение часов УПК и ОСМ отслеживается постоянно, чтобы не искать его в логах при перезапуске
+        self.osm_clock_tracker = None
+        if settings.trigger2_enable and settings.ito_datetime_source == 2:
+            self.osm_clock_tracker = OsmClockTracker(settings.data_dir_path, upk_server_log_files_template)
+            self.osm_clock_tracker.start()
+
+        # инкрементальный подсчет размера папки с данными вместо полного обхода на каждой проверке
+        # поток файла определяется в том же проходе по папке, что и общий размер
+        self.dir_size_tracker = DirSizeTracker(settings.data_dir_path, settings.files_template,
+                                               create_stream_key(settings.streams, settings.stream_key_pattern))
+        self.dir_watcher = create_dir_watcher(self.dir_size_tracker, settings.dir_watch_mode)
+        self.rate_estimator = create_rate_estimator(settings.speed_estimator, settings.speed_window,
+                                                    settings.speed_ewma_alpha)
+        # оценки скорости потоков: заданные шаблонами - сразу, чтобы заметить поток без единого файла,
+        # заданные регулярным выражением - при появлении первого файла потока
+        self.stream_rate_estimators = {}
+        for stream, _ in settings.streams:
+            self.stream_rate_estimators[stream] = create_rate_estimator(settings.speed_estimator, settings.speed_window,
+                                                                        settings.speed_ewma_alpha)
+        self.low_streams = []  # потоки с низкой скоростью на последней проверке
+        # значения метрик этой пары, чтобы на каждой проверке не искать их по меткам
+        self.metric_data_rate = metric_data_rate.labels(settings.name)
+        self.metric_dir_size = metric_dir_size.labels(settings.name)
+        self.metric_dir_files = metric_dir_files.labels(settings.name)
+        self.metric_dir_scan = metric_dir_scan.labels(settings.name)
+        self.metric_unsuccessful_reboots = metric_unsuccessful_reboots.labels(settings.name)
+        self.metric_unsuccessful_reboots.set(self.cur_unsuccessful_reboots)
+        self.metric_time_to_first_data = metric_time_to_first_data.labels(settings.name)
+
+        # история скорости по проверкам папки
+        self.history = None
+        if settings.history_samples > 0:
+            try:
+                self.history = HistoryStore(self.state_file_path(history_filename),
+                                            settings.history_samples, log=self.log)
+            except (OSError, ValueError) as e:
+                self.log.error(f'Data rate history is not available: {e}')
+
+        # перенос старых файлов в архив, чтобы папка с данными не росла
+        self.archiver = None
+        if settings.archive_max_age_days > 0:
+            try:
+                self.archiver = DataArchiver(settings.data_dir_path, settings.archive_dir_path, settings.archive_templates,
+                                             settings.archive_max_age_days * 86400,
+                                             settings.archive_max_rate_mb_per_sec * 1024 * 1024, log=self.log)
+            except ValueError as e:
+                self.log.error(f'Data archiving is not available: {e}')
+
+        self.log.info(f'Data folder {settings.data_dir_path}, watch mode: {self.dir_watcher.name}')
+        self.log.info(f'Speed estimator: {self.rate_estimator.name}, window {settings.speed_window}')
+        if settings.streams:
+            self.log.info(f'Data streams: {", ".join(f"{name} ({template})" for name, template in settings.streams)}')
+        elif settings.stream_key_pattern:
+            self.log.info(f'Data streams by file name: {settings.stream_key_pattern}')
+
+    def state_file_path(self, file_name):
+        """
+        Путь к файлу в папке состояния пары; файл прежних версий переносится туда из папки с данными
+        """
+        path = os.path.join(self.settings.state_dir_path, file_name)
+        old_path = os.path.join(self.settings.data_dir_path, file_name)
+        if not os.path.exists(path) and os.path.isfile(old_path):
+            try:
+                shutil.move(old_path, path)
+                self.log.info(f'{file_name} is moved from the data folder to {self.settings.state_dir_path}')
+            except OSError as e:
+                self.log.error(f'{file_name} is not moved from the data folder - exception: {e.__doc__}')
+        return path
+
+    async def load_instrument_description(self):
+        """
+        Ожидание файла описания прибора и чтение IP-адреса ИТО из него
+        """
+        s = self.settings
+        self.log.info(f'Looking for instrument description file {s.instrument_description_filename}...')
+        last_error = None
+        while not self.ito_ip:
+            # если есть задание на диске, то загрузим его и начнем работать до получения нового задания
+            if Path(s.instrument_description_filename).is_file():
+                try:
+                    with open(s.instrument_description_filename, 'r') as f:
+                        instrument_description = json.load(f)
+                    ito_ip = instrument_description['IP_address']
+                except Exception as e:
+                    # файл может быть еще не дописан - ошибка в лог один раз, пока она не изменится
+                    error = f'{type(e).__name__}: {e}'
+                    if error != last_error:
+                        self.log.error(f'Invalid instrument description file {s.instrument_description_filename} - '
+                                       f'{error}, pause for {s.dir_check_interval_sec} sec..')
+                        last_error = error
+                else:
+                    self.log.info('Loaded instrument description ' + json.dumps(instrument_description))
+                    self.ito_ip = ito_ip
+                    break
+            else:
+                self.log.info(f'No file {s.instrument_description_filename}, pause for {s.dir_check_interval_sec} sec..')
+            await asyncio.sleep(s.dir_check_interval_sec)
+
+        # без библиотеки прибора (hyperion) контроль папки продолжается, при срабатывании триггера
+        # перезапускается только служба; библиотека загружается повторно с удвоением паузы
+        pause_sec = s.dir_check_interval_sec
+        while True:
+            try:
+                self.ito_session = self.ito_session_factory(self.ito_ip)
+                return
+            except ImportError as e:
+                if pause_sec == s.dir_check_interval_sec:
+                    self.log.error(f'ITO library is not available, ITO commands are disabled - exception: '
+                                   f'{e.__doc__} {e}')
+                await asyncio.sleep(pause_sec)
+                pause_sec = min(2 * pause_sec, ito_library_retry_max_pause_sec)
+
+    def ito_check_connection(self, max_age_sec=None):
+        """
+        Проверка связи с ИТО: пинг порта прибора, затем тестовой командой из API
+        Используется одно подключение ito_session, результат проверки кэшируется на короткое время
+        :param max_age_sec: допустимый возраст кэшированного результата, 0 - проверить заново
+        :return: True if ITO connected and answer commands
+                reason(int), error description(str)
+        reasons: 1 - no ping
+                 2 - no connection by ITO API
+                 3 - ITO doesn't answer to command #GetChannelDetectionSettingId
+        """
+        return self.ito_session.check_connection(max_age_sec)
+
+    async def run_step(self, name, coro, timeout_sec=None):
+        if timeout_sec is None:
+            timeout_sec = self.settings.action_step_timeout_sec
+        phase = phase_label(name)
+        started = time.perf_counter()
+        try:
+            with trace(f'{self.name}:{phase}'):
+                return await run_step(name, coro, timeout_sec, self.log,
+                                      on_error=metric_action_phase_errors.labels(self.name, phase).inc)
+        finally:
+            metric_action_phase.labels(self.name, phase).observe(time.perf_counter() - started)
+
+    async def ito_call(self, fn, *args):
+        """
+        Команда ИТО в отдельном потоке ito_executor - команды по одному подключению выполняются по очереди,
+        цикл asyncio при этом не блокируется
+        Если команда прервана по таймауту шага, а поток все еще ждет прибор, то поток и подключение
+        бросаются: следующие команды идут в новом потоке по новому подключению, а не ждут зависшую
+        """
+        executor = self.ito_executor
+        future = executor.submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.done() and executor is self.ito_executor:
+                self.log.warning('ITO command is not finished in time, new ITO connection and command thread are used')
+                executor.shutdown(wait=False)
+                self.ito_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'ito_{self.name}')
+                self.ito_session = self.ito_session_factory(self.ito_ip)
+            raise
+
+    async def stop_service(self):
+        s = self.settings
+        self.log.info(f'Stopping service {s.service_name}...')
+        returncode = await self.service_controller.stop(s.service_name)
+        self.log.info(f'Stop service {s.service_name} return code {returncode}')
+
+        if not self.service_controller.confirms_state:
+            # остановка не подтверждена - ждем заданное время
+            self.log.info(f"Pause for {s.win_service_restart_pause}sec")
+            await asyncio.sleep(s.win_service_restart_pause)
+
+    async def start_service(self):
+        s = self.settings
+        self.log.info(f'Starting service {s.service_name}...')
+        returncode = await self.service_controller.start(s.service_name)
+        self.log.info(f'Start service {s.service_name} return code {returncode}')
+
+    def get_netping_relay(self):
+        """
+        Подключение к розетке NetPing
+        :return: розетка (NetpingRelay) или None, если розетка не отвечает
+        """
+        self.log.info('Cheking Netping socket...')
+        relay = self.relay_factory(self.settings.netping_relay_address)
+        relay_ok = relay.check_connection()
+        if relay_ok == True:
+            self.log.info('Netping socket connected.')
+            return relay
+        self.log.error(f'Netping socket error: {relay_ok}')
+        return None
+
+    def reset_netping_socket(self, relay):
+        s = self.settings
+        self.log.info(f'Rebooting ITO by Netping socket...')
+        relay.reset_socket(s.netping_relay_ito_socket_num, 20)
+        relay.socket_on(s.netping_relay_ito_socket_num)
+        self.ito_session.invalidate()
+        self.log.info(f"Pause for {s.ITO_rebooting_duration_sec}sec")
+
+    def get_ito_time_shift(self):
+        """
+        Сдвиг между UTC-временем УПК и временем, которое нужно установить на ИТО
+        Время для установки = datetime.utcnow() - сдвиг, его вычисляют непосредственно перед установкой
+        :return: (сдвиг, timedelta; описание источника времени)
+        """
+        # 1 - UPK (local) UTC-time
+        time_shift, source = timedelta(0), 'UPK(UTC)'
+
+        # 2 - OSM UTC-time. Based on log-file where is Ping Frame (opcode=9) from OSM.
+        if self.settings.ito_datetime_source == 2:
+            # Метод коррекции времени на основе Ping-сообщений от ОСМ. В строчке существующего
+            # лог-файла UPK_server есть информация о времени УПК и ОСМ на момент получения сообщения
+            # Используя эти два времени, находим сдвиг и применяем его к текущему времени УПК
+            # это будет ожидаемое текущее время ОСМ. Его и нужно установить на ИТО.
+
+            # Last log file should contain line with Ping Frame (opcode=9) from OSM.
+            #  "protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:27,887]  server < Frame(fin=True, opcode=9, data=b'31.08.2021 14:55:54', rsv1=False, rsv2=False, rsv3=False)"
+            #
+            #  1. Get OSM time and UPK time from it to find time delay between those clocks
+            #  2. Apply the delay to current UPK time to get OSM time - this time should be used to ITO
+            # оценка, накопленная фоновым потоком, готова сразу; если ее нет - поиск по логам
+            osm_shift = self.osm_clock_tracker.get_shift() if self.osm_clock_tracker else None
+            if osm_shift:
+                shift_sec, num_of_samples = osm_shift
+                time_shift, source = timedelta(seconds=shift_sec), f'OSM, shift {shift_sec:.3f}sec by {num_of_samples} Ping frames'
+            else:
+                upk_osm_time = get_upk_osm_time_from_logs(self.settings.data_dir_path, self.upk_log_index, self.log)
+                if upk_osm_time:
+                    upk_time, osm_time = upk_osm_time
+                    time_shift, source = upk_time - osm_time, 'OSM'
+
+        return time_shift, source
+
+    def set_ito_time(self, time_shift, source):
+        self.log.info(f'Current ITO time {self.ito_session.get_utc_date_time().strftime("%d.%m.%Y %H:%M:%S")}')
+
+        # OSM (UTC) time prediction, this time will apply right now
+        datetime_to_be_set = datetime.utcnow() - time_shift
+        self.log.info(f'Setting ITO time based on {source} {datetime_to_be_set.strftime("%d.%m.%Y %H:%M:%S")}')
+        self.ito_session.set_utc_date_time(datetime_to_be_set)
+
+        self.log.info(f'Current ITO time {self.ito_session.get_utc_date_time().strftime("%d.%m.%Y %H:%M:%S")}')
+
+    def save_ito_spectrum(self, spectrum):
+        s = self.settings
+        self.log.info('Saving spectra...')
+        # ToDo для именования файла получать время из ИТО
+        spectrum_file_name = datetime.now().strftime(os.path.join(s.data_dir_path, '%Y%m%d%H%M%S_spectrum'))
+        spectrum_file_name = save_spectrum(spectrum_file_name, spectrum.wavelengths, spectrum.data, s.spectrum_file_format)
+        self.log.info(f'Spectra saved to {os.path.basename(spectrum_file_name)}')
+
+    async def ito_diagnostics(self):
+        """
+        Спектры и температура ИТО одним обращением к прибору, затем запись спектра на диск
+        Поступлению данных не мешает, поэтому идет одновременно с запуском службы
+        """
+        self.log.info('Getting spectra and temperature...')
+        results = await self.run_step('ITO diagnostics', self.ito_call(
+            self.ito_session.batch, ItoSession.spectra_command, ItoSession.board_temperature_command))
+        if results is None:
+            return
+        spectrum, ito_board_temp = results
+
+        if isinstance(ito_board_temp, Exception):
+            self.log.error(f'Some error during getting temperature - exception: {ito_board_temp.__doc__}')
+        else:
+            self.log.info(f'ITO board temperature {ito_board_temp}')
+
+        if isinstance(spectrum, Exception):
+            self.log.error(f'Some error during getting spectra - exception: {spectrum.__doc__}')
+        else:
+            await self.run_step('saving spectra', asyncio.to_thread(self.save_ito_spectrum, spectrum))
+
+    async def wait_diagnostics(self):
+        """
+        Ожидание диагностики ИТО, оставшейся от прошлого действия
+        """
+        task, self.diagnostics_task = self.diagnostics_task, None
+        if task is not None:
+            await task
+
+    async def action_when_any_trigger_released(self, ito_reboot=False, reboot_by_netping=True, wait_diagnostics=True):
+        """
+        Действия при срабатывании таймера, триггера
+        Перезапуск службы, перезапуск ИТО, установка часов ИТО
+        Шаги выполняются с ограничением времени; шаги, не зависящие друг от друга, идут одновременно.
+        До запуска службы выполняются только остановка, перезагрузка ИТО и установка его часов;
+        спектры и температура читаются и записываются, пока служба запускается
+
+        :param ito_reboot: boolean, ITO reboot permission
+               reboot_by_netping: boolean, True (use Netping relay to reboot ITO reboot) or False(use ITO command #reboot)
+               wait_diagnostics: boolean, False - не ждать диагностику ИТО, она остается в diagnostics_task
+        :return: False, если после перезагрузки нет связи с ИТО (служба не запускается)
+        """
+        s = self.settings
+
+        if self.ito_session is None:
+            # файл описания прибора еще не найден или нет библиотеки ИТО - перезапуск только службы
+            self.log.info('ITO is not available yet, restarting the service only')
+            await self.run_step('service stop', self.stop_service(), s.service_stop_step_timeout_sec)
+            await self.run_step('service start', self.start_service(), s.service_start_step_timeout_sec)
+            return
+
+        # сдвиг времени ОСМ ищется в логах, пока служба останавливается и ИТО перезагружается
+        time_shift_task = None
+        if s.ito_datetime_source > 0:
+            time_shift_task = asyncio.create_task(
+                self.run_step('ITO date/time calculation', asyncio.to_thread(self.get_ito_time_shift)))
+
+        # stop the service; Netping socket is checked meanwhile
+        steps = [self.run_step('service stop', self.stop_service(), s.service_stop_step_timeout_sec)]
+        if ito_reboot and reboot_by_netping:
+            self.log.info('Reboot by Netping...')
+            steps.append(self.run_step('Netping check', asyncio.to_thread(self.get_netping_relay)))
+        results = await asyncio.gather(*steps)
+
+        # ITO check connection, reboot
+        if ito_reboot:
+
+            # reboot by Netping
+            if reboot_by_netping:
+                relay = results[1]
+                if relay is not None:
+                    await self.run_step('Netping reset', asyncio.to_thread(self.reset_netping_socket, relay))
+                else:
+                    reboot_by_netping = False  # далее будет перезагрузка с помощью команды #reboot
+
+            if not reboot_by_netping:
+                self.log.info('Reboot by #reboot command...')
+                self.log.info('Check ITO connection...')
+                ito_ok = await self.run_step('ITO check', self.ito_call(self.ito_check_connection))
+                if ito_ok == True:
+                    self.log.info('ITO reboot...')
+                    await self.run_step('ITO reboot', self.ito_call(self.ito_session.reboot))
+                else:
+                    self.log.info(f'No connection: {ito_ok}')
+
+            # после перезагрузки нужно проверить связь с прибором
+            self.log.info('Check ITO connection...')
+            ito_ok = await self.run_step('ITO check', self.ito_call(self.ito_check_connection, 0))
+            if ito_ok == True:
+                self.log.info('Connection ok')
+                self.cur_unsuccessful_reboots = 0
+                self.metric_unsuccessful_reboots.set(0)
+            else:
+                self.log.info(f'No connection: {ito_ok}')
+                self.cur_unsuccessful_reboots += 1
+                self.metric_unsuccessful_reboots.set(self.cur_unsuccessful_reboots)
+                if time_shift_task:
+                    time_shift_task.cancel()
+                return False
+
+        # ITO setting date/time - до запуска службы, чтобы новые данные шли с верным временем
+        self.log.info('Check ITO connection...')
+        ito_ok = await self.run_step('ITO check', self.ito_call(self.ito_check_connection))
+        diagnostics_task = None
+        if ito_ok == True:
+            self.log.info('Connection ok')
+            if time_shift_task:
+                time_shift = await time_shift_task
+                if time_shift is not None:
+                    await self.run_step('ITO date/time setting', self.ito_call(self.set_ito_time, *time_shift))
+            diagnostics_task = asyncio.create_task(self.ito_diagnostics())
+        else:
+            self.log.info(f'No connection: {ito_ok}')
+            if time_shift_task:
+                time_shift_task.cancel()
+
+        # start the service; ITO diagnostics go on meanwhile
+        await self.run_step('service start', self.start_service(), s.service_start_step_timeout_sec)
+        self.diagnostics_task = diagnostics_task
+        if wait_diagnostics:
+            await self.wait_diagnostics()
+
+    async def readiness_probe(self):
+        """
+        Проверка готовности после запуска службы: папка с данными проверяется каждые readiness_poll_interval_sec,
+        пока не появятся новые данные, затем скорость проверяется в окне readiness_window_sec
+        :return: 'ok', 'no_data' - новых данных нет readiness_timeout_sec, 'low_rate' - скорость ниже порога
+        """
+        s = self.settings
+        started = time.monotonic()
+        await self.update_dir_size()
+        start_bytes = self.dir_size_tracker.bytes_written
+        first_data_time = None
+        while True:
+            await asyncio.sleep(s.readiness_poll_interval_sec)
+            await self.update_dir_size()
+            now = time.monotonic()
+            written = self.dir_size_tracker.bytes_written - start_bytes
+
+            if first_data_time is None:
+                if written > 0:
+                    first_data_time = now
+                    self.metric_time_to_first_data.observe(now - started)
+                    self.log.info(f'First data {now - started:.1f}sec after the service start')
+                elif now - started >= s.readiness_timeout_sec:
+                    self.log.error(f'No new data {s.readiness_timeout_sec}sec after the service start')
+                    return 'no_data'
+            elif now - first_data_time >= s.readiness_window_sec:
+                speed_mb_per_h = 3600 / (1024 * 1024) * written / (now - first_data_time)
+                if speed_mb_per_h < s.readiness_speed_threshold_mb_per_h:
+                    self.log.error(f'Speed after the service start {speed_mb_per_h:.3f} Mb/h is below '
+                                   f'{s.readiness_speed_threshold_mb_per_h} Mb/h')
+                    return 'low_rate'
+                self.log.info(f'Speed after the service start {speed_mb_per_h:.3f} Mb/h, readiness ok')
+                return 'ok'
+
+    async def action_with_readiness_probe(self, level, scheduled=False):
+        """
+        Действие уровня level (service, reboot, netping) и проверка готовности после него
+        Если данные не пошли, сразу выполняется действие следующего уровня, не дожидаясь
+        num_of_triggers_before_action проверок
+        :param scheduled: плановый перезапуск службы (trigger2) - вне лестницы действий upk_recovery,
+                          его результат только пишется в лог, дальше сбой обнаруживают проверки trigger1
+        """
+        s = self.settings
+        while level is not None:
+            await self.wait_diagnostics()
+            # проверка готовности идет одновременно с диагностикой ИТО
+            ok = await self.action_when_any_trigger_released(ito_reboot=level != 'service',
+                                                             reboot_by_netping=level == 'netping',
+                                                             wait_diagnostics=False)
+            if ok is not False:
+                if s.readiness_timeout_sec <= 0:
+                    # результат покажут проверки trigger1
+                    return
+                result = await self.readiness_probe()
+                metric_readiness_probes.labels(self.name, result).inc()
+                if scheduled:
+                    return
+                if result == 'ok':
+                    self.recovery_succeeded(time.monotonic())
+                    return
+                metric_triggers.labels(self.name, 'readiness').inc()
+
+            # данные не пошли или ИТО не отвечает после перезагрузки
+            self.recovery_failed(escalate=True)
+            level = self.recovery_policy.next_action(time.monotonic(), self.cur_unsuccessful_reboots)
+            if level is not None:
+                self.log.info(f'Recovery escalated, action: {level}')
+            else:
+                # после неудачной перезагрузки ИТО служба остановлена - пауза не должна оставлять ее такой
+                await self.start_service_on_hold_off()
+
+    async def start_service_on_hold_off(self):
+        """
+        Запуск службы, если она остановлена, на время паузы действий (upk_recovery)
+        """
+        self.log.info('Recovery actions are held off, starting the service if it is stopped')
+        await self.run_step('service start', self.start_service(), self.settings.service_start_step_timeout_sec)
+
+    async def run_recovery(self, level, scheduled=False):
+        """
+        Действие при срабатывании триггера, после него скорость поступления данных считается заново
+        :param scheduled: плановый перезапуск службы (trigger2), см. action_with_readiness_probe
+        """
+        started = time.monotonic()
+        try:
+            await self.action_with_readiness_probe(level, scheduled)
+            await self.wait_diagnostics()
+        except Exception as e:
+            self.log.error(f'Action exception: {e.__doc__}')
+        finally:
+            self.dir_watcher.mark_activity()
+            self.rate_estimator.reset()
+            for estimator in self.stream_rate_estimators.values():
+                estimator.reset()
+            duration = time.monotonic() - started
+            metric_action.labels(self.name).observe(duration)
+            self.log.info(f'Action duration {duration:.1f}sec')
+            self.save_state()
+
+    def recovery_failed(self, escalate=False):
+        level = self.recovery_policy.on_failed(escalate)
+        if level is not None:
+            metric_recovery_actions.labels(self.name, level, 'failure').inc()
+
+    def recovery_succeeded(self, now):
+        ret = self.recovery_policy.on_recovered(now)
+        if ret is not None:
+            level, ttr_sec = ret
+            self.log.info(f'Data flow recovered by {level} in {ttr_sec:.1f}sec')
+            metric_recovery_actions.labels(self.name, level, 'success').inc()
+            metric_time_to_recovery.labels(self.name, level).observe(ttr_sec)
+
+    def recovery_is_running(self):
+        return self.recovery_task is not None and not self.recovery_task.done()
+
+    def start_recovery(self, level='service', scheduled=False):
+        """
+        Запуск действия при срабатывании триггера отдельной задачей - контроль папки при этом продолжается
+        :param level: service, reboot или netping, см. upk_recovery
+        :param scheduled: плановый перезапуск службы (trigger2), не учитывается политикой восстановления
+        :return: False if previous action is still running
+        """
+        if self.recovery_is_running():
+            self.log.info('Previous action is still running, trigger is skipped')
+            return False
+        self.recovery_task = asyncio.create_task(self.run_recovery(level, scheduled))
+        return True
+
+    def scan_data_dir(self):
+        with self.metric_dir_scan.time(), trace(f'{self.name}:dir scan'):
+            self.dir_watcher.get_dir_size()
+        self.metric_dir_size.set(self.dir_size_tracker.total_size)
+        self.metric_dir_files.set(len(self.dir_size_tracker.files))
+
+    async def update_dir_size(self):
+        async with self.scan_lock:
+            fd = self.reader_fd
+            if self.dir_watcher.needs_scan():
+                # перечитывание папки (опрос или полная проверка inotify) - в общем пуле потоков, чтобы не задерживать
+                # остальные задачи; события папки на это время не читаются, чтобы не менять кэш одновременно с потоком
+                loop = asyncio.get_running_loop()
+                if fd is not None:
+                    loop.remove_reader(fd)
+                try:
+                    await asyncio.to_thread(self.scan_data_dir)
+                finally:
+                    if fd is not None and self.reader_fd == fd:
+                        loop.add_reader(fd, self.dir_watcher.process_events)
+            else:
+                # только накопленные события inotify
+                self.scan_data_dir()
+
+    def save_state(self):
+        state = SupervisorState()
+        state.cur_num_of_triggers = self.cur_num_of_triggers
+        state.recovery_level = self.recovery_policy.level or ''
+        state.num_of_service_restarts = self.recovery_policy.step_attempts
+        state.cur_unsuccessful_reboots = self.cur_unsuccessful_reboots
+        state.total_size = self.dir_size_tracker.total_size
+        state.bytes_written = self.dir_size_tracker.bytes_written
+        state.sample_time = self.sample_time
+        if self.sample_time:
+            state.last_data_time = time.time() - self.dir_watcher.seconds_since_data()
+        state.trigger2_time = self.trigger2_time
+        self.state_file.save(state)
+
+    def resume_from_state(self, state, now):
+        """
+        Продолжение оценки скорости и отсчета простоя после перезапуска программы по сохраненному состоянию
+        Вызывается после первой проверки папки
+        :param now: время первой проверки, time.monotonic()
+        """
+        s = self.settings
+        elapsed = time.time() - state.sample_time
+        if not state.sample_time or not 0 < elapsed <= s.dir_check_interval_sec * max(2, s.speed_window):
+            self.log.info('Saved data folder state is too old, data rate is measured anew')
+            return
+
+        # что записано, пока программа не работала; уменьшение размера (удаление файлов) считаем нулем
+        written = max(0, self.dir_size_tracker.total_size - state.total_size)
+        self.rate_estimator.update(now - elapsed, self.dir_size_tracker.bytes_written - written)
+
+        if written == 0 and state.last_data_time:
+            # новых данных не было - простой отсчитывается от последних данных прошлого запуска
+            idle_sec = max(0.0, time.time() - state.last_data_time)
+            self.dir_watcher.mark_activity(idle_sec)
+            if self.stall_job is not None:
+                self.scheduler.reschedule(self.stall_job, self.scheduler.clock() +
+                                          max(0.0, s.data_stall_timeout_sec - idle_sec))
+        self.log.info(f'Data folder state restored: {elapsed:.0f} sec since the last check, {written} bytes written')
+
+    async def check_data_dir(self):
+        """
+        Trigger1 - проверка скорости поступления данных
+        """
+        s = self.settings
+        await self.update_dir_size()
+
+        now = time.monotonic()
+        if self.restored_state is not None:
+            self.resume_from_state(self.restored_state, now)
+            self.restored_state = None
+        self.sample_time = time.time()
+        self.cur_speed_mb_per_h = None
+
+        # скорость по записанным байтам за окно проверок - удаление файлов ее не уменьшает
+        speed_byte_per_sec = self.rate_estimator.update(now, self.dir_size_tracker.bytes_written)
+        if speed_byte_per_sec is None:
+            # первая проверка - скорость считать не от чего
+            self.check_streams(now)
+            return
+
+        cur_speed_mb_per_h = 3600 / (1024 * 1024) * speed_byte_per_sec
+        self.cur_speed_mb_per_h = cur_speed_mb_per_h
+        self.log.info('Speed, [Mb/h]\t%.3f' % cur_speed_mb_per_h)
+        self.metric_data_rate.set(cur_speed_mb_per_h)
+        self.check_streams(now)
+
+        if self.recovery_is_running():
+            # служба перезапускается - низкая скорость ожидаема
+            return
+
+        if 0.0 <= cur_speed_mb_per_h < s.dir_size_speed_threshold_mb_per_h or self.low_streams:
+            if self.cur_num_of_triggers >= s.num_of_triggers_before_action:
+                self.cur_num_of_triggers = 0
+                metric_triggers.labels(self.name, 'trigger1').inc()
+                reason = ''
+                if self.low_streams:
+                    reason = f' by low speed of {", ".join(self.low_streams)}'
+                    for stream in self.low_streams:
+                        metric_stream_triggers.labels(self.name, stream).inc()
+
+                # прошлое действие не помогло - уровень выбирает политика восстановления
+                self.recovery_failed()
+                level = self.recovery_policy.next_action(now, self.cur_unsuccessful_reboots)
+                if level is None:
+                    self.log.info(f'Trigger1 released{reason}, recovery actions are held off')
+                    self.recovery_task = asyncio.create_task(self.start_service_on_hold_off())
+                else:
+                    self.log.info(f'Trigger1 released{reason}, action: {level}')
+                    self.start_recovery(level)
+            else:
+                self.cur_num_of_triggers += 1
+        else:
+            # данные поступают - сбой закончен
+            self.recovery_succeeded(now)
+
+    def check_streams(self, now):
+        """
+        Скорость каждого потока данных по записанным в его файлы байтам
+        Заполняет low_streams - потоки со скоростью ниже их порога
+        """
+        self.low_streams = []
+        if self.dir_size_tracker.stream_key is None:
+            return
+        s = self.settings
+        stream_bytes_written = self.dir_size_tracker.stream_bytes_written
+        for stream in stream_bytes_written:
+            if stream not in self.stream_rate_estimators:
+                self.stream_rate_estimators[stream] = create_rate_estimator(s.speed_estimator, s.speed_window,
+                                                                            s.speed_ewma_alpha)
+        speeds = []
+        for stream, estimator in self.stream_rate_estimators.items():
+            speed_byte_per_sec = estimator.update(now, stream_bytes_written.get(stream, 0))
+            if speed_byte_per_sec is None:
+                continue
+            speed_mb_per_h = 3600 / (1024 * 1024) * speed_byte_per_sec
+            speeds.append(f'{stream} {speed_mb_per_h:.3f}')
+            metric_stream_rate.labels(self.name, stream).set(speed_mb_per_h)
+            if 0.0 <= speed_mb_per_h < s.stream_speed_threshold_mb_per_h(stream):
+                self.low_streams.append(stream)
+        if speeds:
+            self.log.info('Stream speed, [Mb/h]\t' + '\t'.join(speeds))
+        if self.low_streams and not self.recovery_is_running():
+            self.log.info(f'Low speed of streams: {", ".join(self.low_streams)}')
+
+    async def trigger1_check(self):
+        """
+        Trigger1 - data folder surveillance, проверка по расписанию с шагом dir_check_interval_sec
+        """
+        try:
+            await self.check_data_dir()
+        except Exception as e:
+            self.log.error(f'Trigger1 exception: {e.__doc__}')
+        self.save_history()
+        self.save_state()
+
+    def save_history(self):
+        if self.history is None or not self.sample_time:
+            return
+        flags = flag_recovery if self.recovery_is_running() else 0
+        if self.recovery_policy.hold_until > time.monotonic():
+            flags |= flag_hold_off
+        try:
+            self.history.append(self.sample_time, self.dir_size_tracker.total_size, self.cur_speed_mb_per_h,
+                                self.cur_num_of_triggers, flags)
+        except Exception as e:
+            self.log.error(f'Data rate history writing error: {e.__doc__}')
+
+    async def archive_old_files(self):
+        """
+        Перенос старых файлов из папки с данными в архив, в общем пуле потоков
+        Удаление файлов не влияет на скорость trigger1 - она считается по записанным байтам
+        """
+        try:
+            files, size = await asyncio.to_thread(self.archiver.run_once)
+        except Exception as e:
+            self.log.error(f'Data archiving exception: {e.__doc__}')
+            return
+        if files:
+            self.log.info(f'{files} files ({size} bytes) moved to archive {self.settings.archive_dir_path}')
+            metric_archived_files.labels(self.name).inc(files)
+            metric_archived_bytes.labels(self.name).inc(size)
+
+    def data_stall_check(self):
+        """
+        Срок простоя папки с данными: если новых данных не было data_stall_timeout_sec,
+        триггер срабатывает сразу, не дожидаясь num_of_triggers_before_action проверок
+        """
+        s = self.settings
+        idle_sec = self.dir_watcher.seconds_since_data()
+        if idle_sec < s.data_stall_timeout_sec:
+            # данные поступали - следующий срок отсчитывается от их поступления
+            self.scheduler.reschedule(self.stall_job, self.scheduler.clock() + s.data_stall_timeout_sec - idle_sec)
+            return
+        self.dir_watcher.mark_activity()
+        self.scheduler.reschedule(self.stall_job, self.scheduler.clock() + s.data_stall_timeout_sec)
+        if self.recovery_is_running():
+            return
+        self.log.info(f'No new data for {s.data_stall_timeout_sec:.0f} sec')
+        metric_triggers.labels(self.name, 'stall').inc()
+        self.cur_num_of_triggers = s.num_of_triggers_before_action
+        # внеочередная проверка папки, дальше проверки идут с шагом dir_check_interval_sec от нее
+        self.scheduler.reschedule(self.trigger1_job, self.scheduler.clock())
+
+    def trigger2_release(self):
+        """
+        Trigger2 - release periodically
+        """
+        try:
+            self.log.info('Trigger2 released')
+            metric_triggers.labels(self.name, 'trigger2').inc()
+            self.trigger2_time = time.time()
+            # плановый перезапуск - не шаг лестницы действий, неудачу после него обнаружит trigger1
+            self.start_recovery('service', scheduled=True)
+
+            self.cur_num_of_triggers = 0
+            self.save_state()
+        except Exception as e:
+            self.log.error(f'Trigger2 exception: {e.__doc__}')
+
+    def schedule_triggers(self, scheduler):
+        """
+        Регистрация сроков триггеров в планировщике
+        :param scheduler: DeadlineScheduler
+        """
+        s = self.settings
+        self.scheduler = scheduler
+
+        fd = self.dir_watcher.fileno()
+        if fd is not None:
+            # события папки обрабатываются циклом asyncio по мере поступления
+            asyncio.get_running_loop().add_reader(fd, self.dir_watcher.process_events)
+            self.reader_fd = fd
+
+        # первая проверка сразу - от нее считается скорость на следующей
+        self.trigger1_job = scheduler.call_every(s.dir_check_interval_sec, self.trigger1_check,
+                                                 name=f'{self.name}:trigger1', first_delay_sec=0)
+        self.jobs.append(self.trigger1_job)
+        if s.data_stall_timeout_sec > 0:
+            self.stall_job = scheduler.call_later(s.data_stall_timeout_sec, self.data_stall_check,
+                                                  name=f'{self.name}:stall')
+            self.jobs.append(self.stall_job)
+        if s.trigger2_enable:
+            # интервал trigger2 отсчитывается от его срабатывания в прошлом запуске
+            first_delay_sec = s.win_service_restart_interval_sec - (time.time() - self.trigger2_time)
+            self.jobs.append(scheduler.call_every(
+                s.win_service_restart_interval_sec, self.trigger2_release, name=f'{self.name}:trigger2',
+                first_delay_sec=min(max(0.0, first_delay_sec), s.win_service_restart_interval_sec)))
+        if self.archiver is not None:
+            # первое архивирование - не сразу, чтобы не мешать началу контроля папки
+            self.jobs.append(scheduler.call_every(s.archive_check_interval_sec, self.archive_old_files,
+                                                  name=f'{self.name}:archive',
+                                                  first_delay_sec=min(60.0, s.archive_check_interval_sec)))
+
+    def unschedule_triggers(self):
+        """
+        Снятие заданий пары из планировщика - перед повторным run после ошибки
+        """
+        if self.reader_fd is not None:
+            asyncio.get_running_loop().remove_reader(self.reader_fd)
+            self.reader_fd = None
+        for job in self.jobs:
+            self.scheduler.cancel(job)
+        self.jobs = []
+        self.trigger1_job = self.stall_job = None
+
+    async def run(self, scheduler):
+        """
+        Регистрация триггеров и ожидание описания прибора; сами проверки выполняет планировщик
+        Контроль папки начинается сразу, не дожидаясь файла описания прибора
+        """
+        self.schedule_triggers(scheduler)
+        await self.load_instrument_description()
@@ -0,0 +1,176 @@
+"""
+Сессия связи с ИТО (Hyperion)
+
+Одно подключение к прибору используется для всех проверок и команд в течение работы программы.
+Подключение создается при первом обращении, а после ошибки - заново при следующем обращении.
+Результат проверки связи кэшируется на health_ttl_sec секунд, поэтому несколько проверок подряд
+во время перезапуска службы не открывают новые соединения.
+"""
+
+import logging
+import socket
+import time
+from struct import unpack
+
+
+class ItoSession:
+    """
+    Подключение к ИТО с ленивым переподключением и кэшем результата проверки связи
+    """
+
+    def __init__(self, address, port=None, connect_timeout_sec=1.0, health_ttl_sec=5.0, instrument_factory=None):
+        """
+        :param address: IP-адрес ИТО
+        :param port: порт команд, по умолчанию hyperion.COMMAND_PORT
+        :param connect_timeout_sec: таймаут проверки доступности порта команд
+        :param health_ttl_sec: сколько секунд результат проверки связи считается актуальным
+        :param instrument_factory: функция создания объекта прибора по адресу, по умолчанию hyperion.Hyperion
+        """
+        if port is None or instrument_factory is None:
+            # библиотека hyperion нужна только для настоящего прибора
+            import hyperion
+            port = port or hyperion.COMMAND_PORT
+            instrument_factory = instrument_factory or hyperion.Hyperion
+
+        self.address = address
+        self.port = port
+        self.connect_timeout_sec = connect_timeout_sec
+        self.health_ttl_sec = health_ttl_sec
+        self.instrument_factory = instrument_factory
+
+        self._instrument = None
+        self._health = None  # последний результат check_connection
+        self._health_time = None
+
+    def _port_is_active(self):
+        # быстрая проверка доступности порта команд с ограниченным таймаутом
+        try:
+            with socket.create_connection((self.address, self.port), timeout=self.connect_timeout_sec):
+                return True
+        except OSError:
+            return False
+
+    @property
+    def instrument(self):
+        """
+        Объект прибора, при необходимости создается заново
+        """
+        if self._instrument is None:
+            if not self._port_is_active():
+                raise ConnectionError(f'command port is not active {self.address}:{self.port}')
+            self._instrument = self.instrument_factory(self.address)
+        return self._instrument
+
+    def invalidate(self):
+        """
+        Сброс подключения и кэша проверки связи - например, после перезагрузки прибора
+        """
+        self._instrument = None
+        self._health = None
+        self._health_time = None
+
+    def _set_health(self, health):
+        self._health = health
+        self._health_time = time.monotonic()
+        return health
+
+    def check_connection(self, max_age_sec=None):
+        """
+        Проверка связи с ИТО: доступность порта команд, затем тестовая команда из API
+        :param max_age_sec: допустимый возраст кэшированного результата, по умолчанию health_ttl_sec
+        :return: True if ITO connected and answer commands
+                reason(int), error description(str)
+        reasons: 1 - no ping
+                 2 - no connection by ITO API
+                 3 - ITO doesn't answer to command #GetChannelDetectionSettingId
+        """
+        if max_age_sec is None:
+            max_age_sec = self.health_ttl_sec
+        if self._health_time is not None and time.monotonic() - self._health_time <= max_age_sec:
+            return self._health
+
+        if self._instrument is None:
+            if not self._port_is_active():
+                return self._set_health((1, f'command port is not active {self.address}:{self.port}'))
+            try:
+                self._instrument = self.instrument_factory(self.address)
+            except Exception as e:
+                return self._set_health((2, f'Some error during ITO init - exception: {e.__doc__}'))
+
+        try:
+            self._instrument.get_channel_detection_setting(1)
+        except Exception as e:
+            self._instrument = None
+            return self._set_health((3, f'Exception during get_channel_detection_setting(1): {e.__doc__}'))
+
+        return self._set_health(True)
+
+    def call(self, fn):
+        """
+        Выполнение действия с прибором; при ошибке подключение сбрасывается
+        :param fn: функция, принимающая объект прибора
+        :return: результат fn
+        """
+        try:
+            return fn(self.instrument)
+        except Exception:
+            self.invalidate()
+            raise
+
+    def batch(self, *fns):
+        """
+        Несколько команд подряд с одним объектом прибора за одно обращение к потоку команд
+        (одно соединение, если библиотека прибора держит его между командами, как FakeHyperionClient)
+        Ошибка команды не прерывает остальные; после ошибки связи (OSError) подключение сбрасывается,
+        а оставшиеся команды не выполняются
+        :param fns: функции, принимающие объект прибора
+        :return: список результатов, для команды с ошибкой - исключение
+        """
+        try:
+            instrument = self.instrument
+        except Exception as e:
+            return [e] * len(fns)
+
+        ret = []
+        for fn in fns:
+            try:
+                ret.append(fn(instrument))
+            except OSError as e:
+                self.invalidate()
+                ret += [e] * (len(fns) - len(ret))
+                break
+            except Exception as e:
+                ret.append(e)
+        return ret
+
+    @staticmethod
+    def spectra_command(h):
+        return h.spectra
+
+    @staticmethod
+    def board_temperature_command(h):
+        # Returns the temperature of the instrument on the PCB, 8 byte (double)
+        return unpack('d', h._execute_command("#GetBoardTemperature").content)[0]
+
+    def reboot(self):
+        self.call(lambda h: h.reboot())
+        self.invalidate()
+
+    def get_spectra(self):
+        return self.call(self.spectra_command)
+
+    def get_utc_date_time(self):
+        return self.call(lambda h: h.instrument_utc_date_time)
+
+    def set_utc_date_time(self, value):
+        def set_time(h):
+            h.instrument_utc_date_time = value
+        self.call(set_time)
+
+    def get_board_temperature(self):
+        return self.call(self.board_temperature_command)
+
+    def close(self):
+        if self._instrument is not None:
+            logging.debug(f'ITO session {self.address} closed')
+        self.invalidate()
@@ -0,0 +1,466 @@
+"""
+Поиск Ping-сообщений ОСМ (opcode=9) в лог-файлах UPK_server
+
+Лог-файлы читаются с конца блоками фиксированного размера, поэтому память не зависит от размера
+файла, а чтение заканчивается на первой (самой новой) подходящей строке.
+Индекс (PingIndex) запоминает для каждого файла его идентификатор, сколько байт уже просмотрено
+и последнюю найденную строку - при следующей синхронизации читаются только дописанные байты.
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from upk_rate import SampleRing
+
+ping_marker = b'opcode=9'
+
+# константы, отвечающие за получение текущего времени ОСМ из лог-файла UPK_server
+upk_server_log_files_template = "UPK_server_*.log"
+upk_log_valid_age_days = 60  # how many days log file can be used for time sync, older files ignored because they may contain wrong time
+upk_log_index_filename = 'UPK_supervisor_log_index.json'  # индекс уже просмотренных частей лог-файлов
+
+# protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:27,887]  server < Frame(fin=True, opcode=9, data=b'31.08.2021 14:55:54', ...)
+ping_line_re = re.compile(r"\[(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d),(\d{3})\][^\[]*?Frame\(.*?opcode=9.*?"
+                          r"data=b'(\d\d)\.(\d\d)\.(\d{4}) (\d\d):(\d\d):(\d\d)'")
+
+
+def parse_ping_line(line):
+    """
+    Быстрый разбор Ping-строки лога UPK_server - одно регулярное выражение вместо split и strptime
+    В отличие от get_upk_osm_time_from_log время УПК учитывается с миллисекундами
+    :param line: строка лога
+    :return: upk_time, osm_time (datetime)
+    """
+    m = ping_line_re.search(line)
+    if m is None:
+        raise ValueError(f'Not a Ping frame log line: {line[:120]}')
+    g = [int(x) for x in m.groups()]
+    upk_time = datetime(g[0], g[1], g[2], g[3], g[4], g[5], g[6] * 1000)
+    osm_time = datetime(g[9], g[8], g[7], g[10], g[11], g[12])
+    return upk_time, osm_time
+
+
+def get_upk_osm_time_from_log(in_str):
+    """
+    Функция разбирает строчку лога, содержащую сообщение от ОСМ и возвращает показания часов компьютеров - УПК и ОСМ
+    :param in_str: строчка из лог-файла
+    :return: расхождение часов компьютеров - УПК и ОСМ
+    """
+    # 1.Распарсить входную строку на две даты/время
+    # 2.Перевести время в datetime
+    # 3.Вычислить расхождение
+
+    osm_time = upk_time = None
+
+    if 'opcode=9' not in in_str:
+        raise ValueError('The string from log should contains "opcode=9"')
+
+    # 1.Распарсить входную строку на две даты/время
+    #  u'%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s'
+    #  protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:27,887]  server < Frame(fin=True, opcode=9, data=b'31.08.2021 14:55:54', rsv1=False, rsv2=False, rsv3=False)
+
+    try:
+        # в строке лога есть левая часть - от УПК и правая - от ОСМ
+        upk_str, osm_str = in_str.split('Frame', 1)
+
+        # анализ части от УПК. интересуют вторые квадратные скобки
+        upk_time_str = upk_str.split('[')[-1].split(',')[0]
+
+        # анализ части от ОСМ. там перечислены параметры - вытащим 'data'
+        osm_time_str = osm_str.split("data=b'")[-1].split("'")[0]
+    except:
+        raise ValueError(f'Wrong log string format - expected like protocol.py[LINE:1053]# DEBUG    [2021-08-31 14:51:27,887]  server < Frame(fin=True, opcode=9, data=b\'31.08.2021 14:55:54\', rsv1=False, rsv2=False, rsv3=False)"')
+
+    # 2.Перевести время в datetime
+    try:
+        osm_time = datetime.strptime(osm_time_str, "%d.%m.%Y %H:%M:%S")
+    except:
+        raise ValueError(f'Wrong data format for OSM time - expected "%d.%m.%Y %H:%M:%S", got "{osm_time_str}"')
+
+    try:
+        upk_time = datetime.strptime(upk_time_str, logging.Formatter.default_time_format)
+    except:
+        raise ValueError(f'Wrong data format for UPK time - expected "%Y-%m-%d %H:%M:%S", got "{upk_time_str}"')
+
+    return upk_time, osm_time
+
+
+def get_upk_osm_time_from_logs(log_dir, upk_log_index, log=logging):
+    """
+    Поиск самого нового Ping-сообщения ОСМ (opcode=9) в лог-файлах UPK_server
+    Файлы читаются с конца блоками, уже просмотренная часть файлов запоминается в индексе
+    :param log_dir: папка с лог-файлами UPK_server
+    :param upk_log_index: PingIndex
+    :param log: куда писать сообщения
+    :return: (upk_time, osm_time) из самой новой подходящей строки или None
+    """
+    log_file_names = glob.glob(os.path.join(log_dir, upk_server_log_files_template))
+    upk_log_index.forget_missing(log_file_names)
+
+    ret = None
+    try:
+        # iterate on log-files in time creation order (the newest is first)
+        for cur_log_file_name in sorted(log_file_names, key=os.path.getctime, reverse=True):
+            line = upk_log_index.find_last_line(cur_log_file_name, parser=get_upk_osm_time_from_log)
+            if line is None:
+                continue
+
+            # parse UPK and OSM time from log line
+            upk_time, osm_time = get_upk_osm_time_from_log(line)
+
+            # check is time information fresh enough?
+            if abs((datetime.now() - upk_time).days) < upk_log_valid_age_days:
+                ret = upk_time, osm_time
+            else:
+                log.info(f"OSM time in log-file is not fresh enough, {os.path.basename(cur_log_file_name)}")
+
+            # в более старых файлах время еще старее
+            break
+    except Exception as e:
+        log.info(e)
+    finally:
+        upk_log_index.save()
+
+    return ret
+
+
+def iter_lines_backward(f, start=0, end=None, block_size=65536, marker=None):
+    """
+    Чтение строк бинарного файла от конца к началу
+    :param f: файл, открытый в режиме 'rb'
+    :param start: смещение, до которого идет чтение (строки, начинающиеся раньше, не возвращаются);
+                  должно быть началом строки, иначе первой вернется ее хвост
+    :param end: смещение, с которого идет чтение, по умолчанию конец файла
+    :param block_size: размер блока чтения
+    :param marker: если задан, возвращаются только строки, содержащие marker;
+                   блоки без marker не разбиваются на строки
+    :return: генератор пар (смещение начала строки, строка без перевода строки)
+    """
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+
+    pos = end
+    tail = b''  # начало строки, которая продолжается в уже прочитанном блоке
+    while pos > start:
+        read_size = min(block_size, pos - start)
+        pos -= read_size
+        f.seek(pos)
+        block = f.read(read_size) + tail
+
+        # первая (возможно неполная) строка блока переходит в следующую итерацию
+        first_nl = block.find(b'\n')
+        if first_nl < 0 and pos > start:
+            tail = block
+            continue
+
+        if pos > start:
+            tail = block[:first_nl + 1]
+            body_start = first_nl + 1
+        else:
+            tail = b''
+            body_start = 0
+
+        if marker is not None and block.find(marker, body_start) < 0:
+            continue
+
+        line_end = len(block)
+        while line_end > body_start:
+            line_start = block.rfind(b'\n', body_start, line_end - 1) + 1
+            if line_start <= 0:
+                line_start = body_start
+            line = block[line_start:line_end].rstrip(b'\r\n')
+            if marker is None or marker in line:
+                yield pos + line_start, line
+            line_end = line_start
+
+
+def file_identity(st):
+    """
+    Идентификатор файла: номер файла в ФС и время создания
+    Если файл удален и создан заново с тем же именем, идентификатор изменится
+    """
+    # st_ctime - время создания только на Windows, на Linux это время изменения метаданных
+    created = getattr(st, 'st_birthtime', st.st_ctime if os.name == 'nt' else 0)
+    return [st.st_dev, st.st_ino, created]
+
+
+class PingIndex:
+    """
+    Сохраняемый на диск индекс последних Ping-строк в лог-файлах
+    {имя файла: {'id': идентификатор, 'scanned': просмотрено байт (до конца последней целой строки),
+                 'offset': смещение строки, 'line': строка}}
+    """
+
+    def __init__(self, index_file_name=None):
+        self.index_file_name = index_file_name
+        self.files = {}
+        self.changed = False
+
+        if index_file_name and os.path.isfile(index_file_name):
+            try:
+                with open(index_file_name, 'r') as f:
+                    self.files = json.load(f)
+            except Exception as e:
+                logging.info(f'Log index {index_file_name} is ignored: {e}')
+                self.files = {}
+
+    def find_last_line(self, file_name, parser=None):
+        """
+        Самая новая Ping-строка файла
+        :param file_name: имя лог-файла
+        :param parser: функция разбора строки; строки, на которых она выдает исключение, пропускаются
+        :return: строка (str) или None
+        """
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            return None
+
+        key = os.path.abspath(file_name)
+        identity = file_identity(st)
+        entry = self.files.get(key)
+
+        scan_from = 0
+        if entry and entry.get('id') == identity and entry.get('scanned', 0) <= st.st_size:
+            if entry['scanned'] == st.st_size:
+                return entry.get('line')
+            # файл дописан - смотрим только новые байты
+            scan_from = entry['scanned']
+        else:
+            entry = None
+
+        found = None
+        found_offset = None
+        with open(file_name, 'rb') as f:
+            if entry and entry.get('line') is not None and not self._line_is_at(f, entry['offset'], entry['line']):
+                # номер файла использован повторно - файл другой, читаем целиком
+                entry = None
+                scan_from = 0
+
+            for offset, raw_line in iter_lines_backward(f, start=scan_from, end=st.st_size, marker=ping_marker):
+                line = raw_line.decode('utf-8', errors='replace')
+                if parser is not None:
+                    try:
+                        parser(line)
+                    except ValueError:
+                        continue
+                found, found_offset = line, offset
+                break
+            # последняя строка может быть еще не дописана - при следующей проверке она читается заново
+            scanned = self._complete_lines_end(f, scan_from, st.st_size)
+
+        if found is None and entry:
+            # в новых байтах Ping-строк нет - остается найденная ранее
+            found, found_offset = entry.get('line'), entry.get('offset')
+
+        self.files[key] = {'id': identity, 'scanned': scanned, 'offset': found_offset, 'line': found}
+        self.changed = True
+        return found
+
+    @staticmethod
+    def _complete_lines_end(f, start, end, block_size=65536):
+        """
+        :return: смещение после последнего перевода строки между start и end или start, если его нет
+        """
+        pos = end
+        while pos > start:
+            read_size = min(block_size, pos - start)
+            pos -= read_size
+            f.seek(pos)
+            i = f.read(read_size).rfind(b'\n')
+            if i >= 0:
+                return pos + i + 1
+        return start
+
+    @staticmethod
+    def _line_is_at(f, offset, line):
+        raw_line = line.encode('utf-8')
+        f.seek(offset)
+        return f.read(len(raw_line)) == raw_line
+
+    def forget_missing(self, existing_file_names):
+        """
+        Удаление из индекса файлов, которых больше нет
+        """
+        existing = {os.path.abspath(name) for name in existing_file_names}
+        for key in [key for key in self.files if key not in existing]:
+            del self.files[key]
+            self.changed = True
+
+    def save(self):
+        if not self.index_file_name or not self.changed:
+            return
+        tmp_file_name = self.index_file_name + '.tmp'
+        try:
+            with open(tmp_file_name, 'w') as f:
+                json.dump(self.files, f)
+            os.replace(tmp_file_name, self.index_file_name)
+            self.changed = False
+        except Exception as e:
+            logging.info(f'Log index {self.index_file_name} saving error: {e}')
+
+
+class OsmClockTracker(threading.Thread):
+    """
+    Фоновое слежение за расхождением часов УПК и ОСМ
+    Поток читает дописываемые строки самого нового лог-файла UPK_server, разбирает только Ping-строки
+    и хранит последние расхождения (время УПК - время ОСМ). Оценка - среднее по отсчетам без выбросов
+    плюс уход часов (наклон по методу наименьших квадратов), поэтому при срабатывании триггера
+    время ОСМ известно сразу, без поиска по логам.
+    """
+
+    def __init__(self, log_dir, template='UPK_server_*.log', window=64, poll_interval_sec=1.0,
+                 file_check_interval_sec=10.0, max_sample_age_sec=24 * 3600):
+        super().__init__(name='OsmClockTracker', daemon=True)
+        self.log_template = os.path.join(log_dir, template)
+        self.poll_interval_sec = poll_interval_sec
+        self.file_check_interval_sec = file_check_interval_sec
+        self.max_sample_age_sec = max_sample_age_sec
+
+        self.samples = SampleRing(window)  # (время УПК, timestamp; расхождение УПК - ОСМ, с)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.log_file_name = None
+        self.log_file = None
+        self.partial_line = b''
+        self.seeded = False
+
+    def stop(self):
+        self.stop_event.set()
+
+    def add_line(self, line):
+        """
+        Учет строки лога
+        :return: True if line is Ping frame
+        """
+        try:
+            upk_time, osm_time = parse_ping_line(line)
+        except ValueError:
+            return False
+        with self.lock:
+            self.samples.append(upk_time.timestamp(), (upk_time - osm_time).total_seconds())
+        return True
+
+    def get_shift(self, now=None):
+        """
+        Оценка расхождения часов УПК и ОСМ на текущий момент
+        :param now: текущее время УПК (datetime), по умолчанию datetime.now()
+        :return: (расхождение УПК - ОСМ, с; количество отсчетов в оценке) или None, если свежих отсчетов нет
+        """
+        now_ts = (now or datetime.now()).timestamp()
+        with self.lock:
+            samples = [(self.samples.times[i % self.samples.capacity], self.samples.values[i % self.samples.capacity])
+                       for i in range(self.samples.start, self.samples.start + self.samples.count)]
+
+        samples = [(t, v) for t, v in samples if now_ts - t <= self.max_sample_age_sec]
+        if not samples:
+            return None
+
+        # отбрасываем выбросы - дальше трех медианных отклонений (но не ближе секунды, время ОСМ - целые секунды)
+        values = sorted(v for t, v in samples)
+        median = values[len(values) // 2]
+        mad = sorted(abs(v - median) for v in values)[len(values) // 2]
+        limit = max(3 * mad, 1.0)
+        inliers = [(t, v) for t, v in samples if abs(v - median) <= limit]
+
+        n = len(inliers)
+        mean_t = sum(t for t, v in inliers) / n
+        mean_v = sum(v for t, v in inliers) / n
+
+        # уход часов учитываем, только если отсчеты покрывают заметный интервал
+        drift = 0.0
+        span = inliers[-1][0] - inliers[0][0]
+        if n >= 3 and span >= 600:
+            stt = sum((t - mean_t) ** 2 for t, v in inliers)
+            drift = sum((t - mean_t) * (v - mean_v) for t, v in inliers) / stt
+            # больше 1 мс/с - это не уход часов, а их перевод
+            if abs(drift) > 1e-3:
+                drift = 0.0
+
+        return mean_v + drift * (now_ts - mean_t), n
+
+    def _newest_log_file(self):
+        log_file_names = glob.glob(self.log_template)
+        if not log_file_names:
+            return None
+        return max(log_file_names, key=os.path.getctime)
+
+    def _open(self, file_name):
+        if self.log_file:
+            self.log_file.close()
+        self.log_file_name = file_name
+        self.log_file = open(file_name, 'rb')
+        self.partial_line = b''
+
+        if not self.seeded:
+            self.seeded = True
+            # начальная оценка - по последним Ping-строкам файла, дальше читаем только новые строки
+            lines = []
+            for offset, raw_line in iter_lines_backward(self.log_file, marker=ping_marker):
+                lines.append(raw_line.decode('utf-8', errors='replace'))
+                if len(lines) >= self.samples.capacity:
+                    break
+            for line in reversed(lines):
+                self.add_line(line)
+            self.log_file.seek(0, os.SEEK_END)
+        logging.info(f'OSM clock tracker follows {os.path.basename(file_name)}')
+
+    def _read_new_lines(self):
+        pos = self.log_file.tell()
+        if os.fstat(self.log_file.fileno()).st_size < pos:
+            # файл обрезан - читаем заново
+            self.log_file.seek(0)
+            self.partial_line = b''
+
+        data = self.log_file.read()
+        if not data:
+            return
+        data = self.partial_line + data
+        last_nl = data.rfind(b'\n')
+        if last_nl < 0:
+            self.partial_line = data
+            return
+        self.partial_line = data[last_nl + 1:]
+
+        if ping_marker not in data:
+            return
+        for raw_line in data[:last_nl].split(b'\n'):
+            if ping_marker in raw_line:
+                self.add_line(raw_line.decode('utf-8', errors='replace'))
+
+    def run(self):
+        last_file_check = None
+        while not self.stop_event.is_set():
+            try:
+                # интервал - по монотонным часам: перевод часов УПК не откладывает поиск нового файла
+                now = time.monotonic()
+                if last_file_check is None or now - last_file_check >= self.file_check_interval_sec:
+                    last_file_check = now
+                    newest = self._newest_log_file()
+                    if newest and newest != self.log_file_name:
+                        # при старте - самый новый файл с начальной оценкой, затем новые файлы читаются с начала
+                        if self.log_file:
+                            self._read_new_lines()
+                        self._open(newest)
+
+                if self.log_file:
+                    self._read_new_lines()
+            except Exception as e:
+                logging.error(f'OSM clock tracker error: {e}')
+                if self.log_file:
+                    self.log_file.close()
+                self.log_file = None
+                self.log_file_name = None
+
+            self.stop_event.wait(self.poll_interval_sec)
+
+        if self.log_file:
+            self.log_file.close()
@@ -0,0 +1,133 @@
+"""
+Лог UPK_supervisor: запись в отдельном потоке, ротация по размеру и возрасту, сжатие старых файлов
+
+Сообщения из любых потоков и задач попадают в очередь (QueueHandler) и сразу возвращают управление,
+а в файл их пишет поток QueueListener - задержки диска не влияют на сроки проверок.
+Текущий файл UPK_supervisor.log переименовывается в UPK_supervisor_<время>.log, когда превышает
+max_bytes или становится старше max_age_sec, а также при каждом запуске программы. Переименованные
+файлы сжимаются gzip; самые старые удаляются, пока все файлы лога занимают больше max_total_bytes.
+"""
+
+import glob
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+
+log_format = u'%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s'
+
+
+class RotatingCompressedFileHandler(logging.FileHandler):
+    """
+    Файловый обработчик с ротацией по размеру и возрасту файла, сжатием и ограничением общего объема
+    """
+
+    def __init__(self, file_name, max_bytes=10 * 1024 * 1024, max_age_sec=24 * 3600, max_total_bytes=500 * 1024 * 1024,
+                 compress=True):
+        """
+        :param file_name: текущий файл лога
+        :param max_bytes: размер файла для ротации, 0 - без ограничения
+        :param max_age_sec: возраст файла для ротации, 0 - без ограничения
+        :param max_total_bytes: общий объем файлов лога, 0 - без ограничения
+        :param compress: сжимать файлы после ротации
+        """
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.max_total_bytes = max_total_bytes
+        self.compress = compress
+        self.root, self.ext = os.path.splitext(os.path.abspath(file_name))
+
+        # лог прошлого запуска - в отдельный файл
+        if os.path.isfile(file_name) and os.path.getsize(file_name) > 0:
+            self._rotate_file(file_name)
+
+        super().__init__(file_name, encoding='utf-8')
+        self.opened_at = time.time()
+        self.remove_old_files()
+
+    def should_rotate(self):
+        if self.stream is None:
+            return False
+        if self.max_bytes and self.stream.tell() >= self.max_bytes:
+            return True
+        return bool(self.max_age_sec) and time.time() - self.opened_at >= self.max_age_sec
+
+    def emit(self, record):
+        try:
+            if self.should_rotate():
+                self.rotate()
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+    def rotated_files(self):
+        """
+        :return: файлы после ротации, от старых к новым
+        """
+        return sorted(glob.glob(glob.escape(self.root) + '_*' + self.ext + '*'), key=self._rotated_file_key)
+
+    def _rotated_file_key(self, file_name):
+        # <root>_<время>[_<n>]<ext>[.gz]: файлы одной секунды - по номеру n, а не по строке (_10 после _9)
+        suffix = os.path.basename(file_name)[len(os.path.basename(self.root)) + 1:]
+        stamp, _, n = suffix[:len(suffix) - len(self.ext) - (3 if suffix.endswith('.gz') else 0)].partition('_')
+        return stamp, int(n) if n.isdigit() else 0
+
+    def _rotate_file(self, file_name):
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        rotated_file_name = f'{self.root}_{stamp}{self.ext}'
+        same_second = glob.glob(glob.escape(f'{self.root}_{stamp}') + '*')
+        if same_second:
+            # номер больше, чем у всех файлов этой секунды, даже если младшие уже удалены по общему объему
+            n = max(self._rotated_file_key(f)[1] for f in same_second) + 1
+            rotated_file_name = f'{self.root}_{stamp}_{n}{self.ext}'
+        os.replace(file_name, rotated_file_name)
+        if self.compress:
+            with open(rotated_file_name, 'rb') as f_in, gzip.open(rotated_file_name + '.gz', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(rotated_file_name)
+
+    def rotate(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self._rotate_file(self.baseFilename)
+        self.stream = self._open()
+        self.opened_at = time.time()
+        self.remove_old_files()
+
+    def remove_old_files(self):
+        if not self.max_total_bytes:
+            return
+        files = [(f, os.path.getsize(f)) for f in self.rotated_files()]
+        total = sum(size for _, size in files) + (os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0)
+        for file_name, size in files:
+            if total <= self.max_total_bytes:
+                break
+            try:
+                os.remove(file_name)
+                total -= size
+            except OSError:
+                pass
+
+
+def setup_logging(log_dir, file_name='UPK_supervisor.log', level=logging.DEBUG, **handler_options):
+    """
+    Запись лога в файл log_dir/file_name через очередь и отдельный поток
+    :param handler_options: параметры RotatingCompressedFileHandler
+    :return: QueueListener, его нужно остановить (stop) при завершении программы, чтобы дописать очередь
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = RotatingCompressedFileHandler(os.path.join(log_dir, file_name), **handler_options)
+    file_handler.setFormatter(logging.Formatter(log_format))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
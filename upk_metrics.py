@@ -0,0 +1,287 @@
+"""
+Метрики UPK_supervisor: счетчики, значения и гистограммы
+
+Метрики регистрируются в общем реестре registry и доступны:
+    - по HTTP в текстовом формате Prometheus: http://<metrics_host>:<metrics_port>/metrics
+    - в JSON-файле, который перезаписывается с заданным интервалом (write_snapshot)
+
+Значения с метками (например, instrument="upk1") хранятся в отдельных дочерних объектах; их получают
+один раз через labels(...) и дальше только обновляют - на каждой проверке нет поиска по словарям.
+"""
+
+import abc
+import json
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# границы гистограмм по умолчанию, секунды
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _CounterValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний - больше всех границ
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """
+        Контекстный менеджер: длительность блока в секундах
+        """
+        return _Timer(self)
+
+    def cumulative(self):
+        """
+        :return: [(граница, количество значений не больше нее), ...], последняя граница +Inf
+        """
+        with self._lock:
+            counts = list(self.counts)
+        ret, total = [], 0
+        for le, n in zip(list(self.buckets) + [math.inf], counts):
+            total += n
+            ret.append((le, total))
+        return ret
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metric(abc.ABC):
+    """
+    Метрика с именем, описанием и набором меток
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_value(self):
+        pass
+
+    def labels(self, *values):
+        """
+        :return: значение метрики для заданных меток, создается при первом обращении
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def items(self):
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.labelnames, values)), child) for values, child in children]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} is already registered with another type or labels')
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=default_buckets):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render_prometheus(self):
+        """
+        :return: метрики в текстовом формате Prometheus
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for labels, child in metric.items():
+                if metric.type == 'histogram':
+                    for le, n in child.cumulative():
+                        lines.append(f'{metric.name}_bucket{_format_labels({**labels, "le": _format_value(le)})} {n}')
+                    lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(child.sum)}')
+                    lines.append(f'{metric.name}_count{_format_labels(labels)} {child.count}')
+                else:
+                    lines.append(f'{metric.name}{_format_labels(labels)} {_format_value(child.value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        :return: словарь со всеми метриками для записи в JSON
+        """
+        ret = {}
+        for metric in list(self.metrics.values()):
+            samples = []
+            for labels, child in metric.items():
+                if metric.type == 'histogram':
+                    samples.append({'labels': labels, 'count': child.count, 'sum': child.sum,
+                                    'buckets': {_format_value(le): n for le, n in child.cumulative()}})
+                else:
+                    samples.append({'labels': labels, 'value': child.value})
+            ret[metric.name] = {'type': metric.type, 'help': metric.documentation, 'samples': samples}
+        return ret
+
+    def write_snapshot(self, file_name):
+        """
+        Запись метрик в JSON-файл; файл заменяется целиком, поэтому читатель не увидит его недописанным
+        """
+        tmp_file_name = file_name + '.tmp'
+        with open(tmp_file_name, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'metrics': self.snapshot()}, f, indent=1)
+        os.replace(tmp_file_name, file_name)
+
+
+registry = MetricsRegistry()
+
+
+class MetricsHttpServer:
+    """
+    HTTP-сервер метрик в отдельном потоке: GET /metrics - формат Prometheus, GET /metrics.json - JSON
+    """
+
+    def __init__(self, metrics_registry=registry, host='127.0.0.1', port=0):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics_registry.render_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics_registry.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f'Metrics request {self.address_string()} {format % args}')
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.address, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsHttpServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,278 @@
+"""
+Режим профилирования UPK_supervisor
+
+Включается ключом --profile или параметром profile = 1 ini-файла на ограниченное время (profile_duration_sec):
+    sample   - поток-сэмплер раз в profile_sample_interval_ms снимает стеки всех потоков (цикл asyncio,
+               пул потоков с обходом папок и чтением логов, потоки ИТО); дамп - свернутые стеки
+               'поток;функция;...;функция количество', их понимают flamegraph.pl и speedscope
+    cprofile - cProfile потока цикла asyncio; дамп - файл pstats (python -m pstats, snakeviz)
+Кроме того, для каждого выполнения задания планировщика (проверки папки и т.п.), шага действия при
+срабатывании триггера и обхода папки (trace) записываются длительность и пик памяти по tracemalloc.
+Пик считается от начала самого внешнего из одновременно выполняемых участков, поэтому для
+пересекающихся участков он может быть завышен.
+
+Дампы пишутся каждые profile_dump_interval_sec в папку profile рядом с логами, хранятся
+profile_max_dumps последних; profile_summary.txt обновляется вместе с ними.
+
+Выключенный режим ничего не стоит: trace возвращает общий пустой контекстный менеджер,
+tracemalloc и cProfile не запускаются.
+"""
+
+import contextlib
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+profile_modes = ('sample', 'cprofile')
+profile_summary_filename = 'profile_summary.txt'
+
+# листовые функции потоков, ожидающих работы - не учитываются в сводке горячих функций
+idle_leaves = {('threading.py', 'wait'), ('selectors.py', 'select'), ('thread.py', '_worker'), ('queue.py', 'get'),
+               ('socketserver.py', 'serve_forever'), ('handlers.py', 'dequeue'), ('unix_events.py', '_do_waitpid')}
+
+active = None  # работающий Profiler
+_no_trace = contextlib.nullcontext()
+
+
+def trace(name):
+    """
+    Участок для профилирования: длительность и пик памяти
+    :return: контекстный менеджер; без профилирования - общий пустой
+    """
+    profiler = active
+    if profiler is None:
+        return _no_trace
+    return profiler.span(name)
+
+
+class SpanStats:
+    __slots__ = ('count', 'total_sec', 'max_sec', 'max_peak_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+        self.max_peak_bytes = 0
+
+
+class StackSampler(threading.Thread):
+    """
+    Сэмплер стеков всех потоков
+    """
+
+    def __init__(self, interval_sec):
+        super().__init__(name='profile_sampler', daemon=True)
+        self.interval_sec = interval_sec
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.stacks = Counter()  # свернутый стек -> количество отсчетов
+        self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stop_event.wait(self.interval_sec):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def take(self):
+        """
+        :return: отсчеты с прошлого вызова
+        """
+        with self.lock:
+            stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class Profiler:
+    """
+    Профилирование на ограниченное время с периодическими дампами
+    """
+
+    def __init__(self, profile_dir, mode='sample', duration_sec=600, dump_interval_sec=60, sample_interval_sec=0.01,
+                 max_dumps=10, log=logging):
+        if mode not in profile_modes:
+            raise ValueError(f'profile_mode should be one of {", ".join(profile_modes)}')
+        self.profile_dir = profile_dir
+        self.mode = mode
+        self.duration_sec = duration_sec
+        self.dump_interval_sec = dump_interval_sec
+        self.sample_interval_sec = sample_interval_sec
+        self.max_dumps = max_dumps
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.spans = {}  # имя участка -> SpanStats
+        self.open_spans = 0
+        self.started = None
+        self.sampler = None
+        self.profile = None
+        self.total_stacks = Counter()  # отсчеты sample за все время
+        self.total_stats = None  # pstats.Stats cprofile за все время
+        self.dump_job = None
+        self.stop_job = None
+        self.dumps = 0
+
+    def start(self, scheduler):
+        """
+        Начало профилирования; вызывается из цикла asyncio - cProfile следит за потоком, который его включил
+        :param scheduler: DeadlineScheduler для дампов и окончания профилирования
+        """
+        global active
+        os.makedirs(self.profile_dir, exist_ok=True)
+        tracemalloc.start()
+        if self.mode == 'sample':
+            self.sampler = StackSampler(self.sample_interval_sec)
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started = time.monotonic()
+        active = self
+        self.dump_job = scheduler.call_every(self.dump_interval_sec, self.dump, name='profile dump')
+        self.stop_job = scheduler.call_later(self.duration_sec, lambda: self.stop(scheduler), name='profile stop')
+        self.log.info(f'Profiling ({self.mode}) for {self.duration_sec:.0f} sec, dumps in {self.profile_dir}')
+
+    def stop(self, scheduler=None):
+        global active
+        if active is not self:
+            return
+        active = None
+        if scheduler is not None:
+            scheduler.cancel(self.dump_job)
+            scheduler.cancel(self.stop_job)
+        self.dump()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.profile is not None:
+            self.profile.disable()
+        tracemalloc.stop()
+        self.log.info(f'Profiling is finished, summary in {os.path.join(self.profile_dir, profile_summary_filename)}')
+
+    @contextlib.contextmanager
+    def span(self, name):
+        with self.lock:
+            if not self.open_spans:
+                tracemalloc.reset_peak()
+            self.open_spans += 1
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            peak_bytes = max(0, tracemalloc.get_traced_memory()[1] - start_bytes)
+            with self.lock:
+                self.open_spans -= 1
+                stats = self.spans.get(name)
+                if stats is None:
+                    stats = self.spans[name] = SpanStats()
+                stats.count += 1
+                stats.total_sec += duration
+                stats.max_sec = max(stats.max_sec, duration)
+                stats.max_peak_bytes = max(stats.max_peak_bytes, peak_bytes)
+
+    def dump(self):
+        """
+        Дамп за прошедший интервал, удаление старых дампов, обновление сводки
+        """
+        try:
+            self.dumps += 1
+            suffix = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{self.dumps:04d}'
+            if self.sampler is not None:
+                stacks = self.sampler.take()
+                self.total_stacks.update(stacks)
+                with open(os.path.join(self.profile_dir, f'profile_{suffix}.folded'), 'w') as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f'{stack} {count}\n')
+            if self.profile is not None:
+                # новый cProfile на следующий интервал - дамп содержит только прошедший
+                self.profile.disable()
+                self.profile.dump_stats(os.path.join(self.profile_dir, f'profile_{suffix}.prof'))
+                stats = pstats.Stats(self.profile)
+                if self.total_stats is None:
+                    self.total_stats = stats
+                else:
+                    self.total_stats.add(stats)
+                self.profile = cProfile.Profile()
+                if active is self:
+                    self.profile.enable()
+            self.remove_old_dumps()
+            self.write_summary()
+        except Exception as e:
+            self.log.error(f'Profile dump error: {e.__doc__}')
+
+    def remove_old_dumps(self):
+        dumps = sorted(glob.glob(os.path.join(glob.escape(self.profile_dir), 'profile_*.*')))
+        dumps = [name for name in dumps if not name.endswith(profile_summary_filename)]
+        for name in dumps[:max(0, len(dumps) - self.max_dumps)]:
+            os.remove(name)
+
+    def write_summary(self, top=30):
+        lines = [f'Profile mode: {self.mode}, {time.monotonic() - self.started:.0f} sec',
+                 f'Traced memory now {tracemalloc.get_traced_memory()[0] / 1024:.0f} KB', '',
+                 'span\tcount\ttotal, [sec]\tmean, [ms]\tmax, [ms]\tmax peak memory, [KB]']
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1].total_sec)
+            for name, s in spans:
+                lines.append(f'{name}\t{s.count}\t{s.total_sec:.3f}\t{1000 * s.total_sec / s.count:.1f}\t'
+                             f'{1000 * s.max_sec:.1f}\t{s.max_peak_bytes / 1024:.0f}')
+        lines.append('')
+
+        if self.sampler is not None:
+            lines += self.stacks_summary(top)
+        if self.total_stats is not None:
+            lines.append(f'Top {top} functions by cumulative time (event loop thread):')
+            with open(os.path.join(self.profile_dir, profile_summary_filename), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+                self.total_stats.stream = f
+                self.total_stats.sort_stats('cumulative').print_stats(top)
+            return
+        with open(os.path.join(self.profile_dir, profile_summary_filename), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def stacks_summary(self, top):
+        """
+        Горячие функции по отсчетам сэмплера без ожидающих потоков
+        """
+        own, total = Counter(), Counter()
+        busy = 0
+        for stack, count in self.total_stacks.items():
+            frames = stack.split(';')[1:]
+            leaf = frames[-1] if frames else ''
+            func, _, where = leaf.partition(' (')
+            if (where.split(':')[0], func) in idle_leaves:
+                continue
+            busy += count
+            own[leaf] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = self.sampler.samples or 1
+        lines = [f'Samples: {self.sampler.samples}, busy thread samples: {busy}', '',
+                 f'Top {top} functions by own samples (% of sampling time):']
+        lines += [f'{100 * count / samples:6.1f}%\t{frame}' for frame, count in own.most_common(top)]
+        lines += ['', f'Top {top} functions by samples with callees (% of sampling time):']
+        lines += [f'{100 * count / samples:6.1f}%\t{frame}' for frame, count in total.most_common(top)]
+        return lines + ['']
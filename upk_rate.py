@@ -0,0 +1,248 @@
+"""
+Оценка скорости поступления данных в папку
+
+Скорость считается не по разнице двух последних размеров папки, а по последним N отсчетам
+(время, сколько всего байт записано). Отсчеты хранятся в кольцевом буфере на array('d'),
+добавление отсчета и получение оценки - O(1).
+Используется счетчик записанных байт (DirSizeTracker.bytes_written), а не размер папки,
+поэтому удаление или ротация файлов не дают отрицательной скорости и не скрывают запись.
+
+Оценки:
+    last  - по двум последним отсчетам (как было раньше)
+    mean  - средняя скорость за окно из N отсчетов
+    ewma  - экспоненциальное сглаживание скоростей между соседними отсчетами
+    slope - наклон прямой, построенной методом наименьших квадратов по отсчетам окна
+"""
+
+from array import array
+
+
+class SampleRing:
+    """
+    Кольцевой буфер отсчетов (время, значение) фиксированного размера
+    """
+
+    def __init__(self, capacity):
+        if capacity < 2:
+            raise ValueError('Sample ring capacity should be at least 2')
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0  # индекс самого старого отсчета
+        self.count = 0
+
+    def append(self, t, value):
+        """
+        Добавление отсчета
+        :return: вытесненный отсчет (время, значение) или None, если буфер не был заполнен
+        """
+        capacity = self.capacity
+        if self.count < capacity:
+            i = (self.start + self.count) % capacity
+            self.times[i] = t
+            self.values[i] = value
+            self.count += 1
+            return None
+
+        i = self.start
+        dropped = (self.times[i], self.values[i])
+        self.times[i] = t
+        self.values[i] = value
+        self.start = (i + 1) % capacity
+        return dropped
+
+    def first(self):
+        i = self.start
+        return self.times[i], self.values[i]
+
+    def last(self):
+        i = (self.start + self.count - 1) % self.capacity
+        return self.times[i], self.values[i]
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+
+class RateEstimator:
+    """
+    Базовый класс оценки скорости
+    update(t, total) - новый отсчет: время, с и накопленное количество байт
+    rate() - скорость, байт/с, или None, если отсчетов еще недостаточно
+    """
+
+    name = 'last'
+
+    def __init__(self, window=2):
+        self.samples = SampleRing(max(2, window))
+
+    def update(self, t, total):
+        if len(self.samples) and t <= self.samples.last()[0]:
+            # время не идет вперед - отсчет не учитываем
+            return self.rate()
+        self._add(t, total, self.samples.append(t, total))
+        return self.rate()
+
+    def _add(self, t, total, dropped):
+        pass
+
+    def rate(self):
+        samples = self.samples
+        if len(samples) < 2:
+            return None
+        i_last = (samples.start + samples.count - 1) % samples.capacity
+        i_prev = (i_last - 1) % samples.capacity
+        return (samples.values[i_last] - samples.values[i_prev]) / (samples.times[i_last] - samples.times[i_prev])
+
+    def reset(self):
+        self.samples.clear()
+
+
+class WindowMeanRateEstimator(RateEstimator):
+    """
+    Средняя скорость за окно: (последний - первый) / (время последнего - время первого)
+    """
+
+    name = 'mean'
+
+    def rate(self):
+        samples = self.samples
+        if len(samples) < 2:
+            return None
+        t0, v0 = samples.first()
+        t1, v1 = samples.last()
+        return (v1 - v0) / (t1 - t0)
+
+
+class EwmaRateEstimator(RateEstimator):
+    """
+    Экспоненциальное сглаживание скоростей между соседними отсчетами
+    """
+
+    name = 'ewma'
+
+    def __init__(self, window=2, alpha=0.3):
+        super().__init__(window)
+        if not 0 < alpha <= 1:
+            raise ValueError('EWMA alpha should be in (0, 1]')
+        self.alpha = alpha
+        self.ewma = None
+
+    def update(self, t, total):
+        samples = self.samples
+        if len(samples):
+            t_prev, v_prev = samples.last()
+            if t <= t_prev:
+                return self.ewma
+            cur_rate = (total - v_prev) / (t - t_prev)
+            self.ewma = cur_rate if self.ewma is None else self.alpha * cur_rate + (1 - self.alpha) * self.ewma
+        samples.append(t, total)
+        return self.ewma
+
+    def rate(self):
+        return self.ewma
+
+    def reset(self):
+        super().reset()
+        self.ewma = None
+
+
+class SlopeRateEstimator(RateEstimator):
+    """
+    Наклон прямой по методу наименьших квадратов для отсчетов окна
+    Суммы обновляются при добавлении и вытеснении отсчета; время и значения берутся относительно
+    опорного отсчета. Каждые window отсчетов опорным становится самый старый отсчет окна, и суммы
+    пересчитываются заново - иначе время от опорного отсчета растет, и на больших числах теряется точность
+    (O(1) в среднем на отсчет)
+    """
+
+    name = 'slope'
+
+    def __init__(self, window=2):
+        super().__init__(window)
+        self.origin = None
+        self.n = 0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        self.updates_since_rebase = 0
+
+    def _add(self, t, total, dropped):
+        if self.origin is None:
+            self.origin = (t, total)
+        if dropped is not None:
+            self.updates_since_rebase += 1
+            if self.updates_since_rebase >= self.samples.capacity:
+                self._rebase()
+                return
+        t0, v0 = self.origin
+
+        t -= t0
+        v = total - v0
+        self.n += 1
+        self.sum_t += t
+        self.sum_v += v
+        self.sum_tt += t * t
+        self.sum_tv += t * v
+
+        if dropped is not None:
+            dt = dropped[0] - t0
+            dv = dropped[1] - v0
+            self.n -= 1
+            self.sum_t -= dt
+            self.sum_v -= dv
+            self.sum_tt -= dt * dt
+            self.sum_tv -= dt * dv
+
+    def _rebase(self):
+        """
+        Пересчет сумм по отсчетам окна относительно самого старого из них
+        """
+        samples = self.samples
+        t0, v0 = self.origin = samples.first()
+        self.n = samples.count
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        for k in range(samples.count):
+            i = (samples.start + k) % samples.capacity
+            t = samples.times[i] - t0
+            v = samples.values[i] - v0
+            self.sum_t += t
+            self.sum_v += v
+            self.sum_tt += t * t
+            self.sum_tv += t * v
+        self.updates_since_rebase = 0
+
+    def rate(self):
+        if self.n < 2:
+            return None
+        denominator = self.n * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return None
+        return (self.n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+    def reset(self):
+        super().reset()
+        self.origin = None
+        self.n = 0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        self.updates_since_rebase = 0
+
+
+rate_estimators = {cls.name: cls for cls in (RateEstimator, WindowMeanRateEstimator, EwmaRateEstimator,
+                                              SlopeRateEstimator)}
+
+
+def create_rate_estimator(name='mean', window=5, ewma_alpha=0.3):
+    """
+    Создание оценки скорости по имени из ini-файла
+    :param name: last, mean, ewma, slope
+    :param window: количество отсчетов в окне
+    :param ewma_alpha: коэффициент сглаживания для ewma
+    """
+    name = (name or 'mean').strip().lower()
+    if name not in rate_estimators:
+        raise ValueError(f'Unknown speed estimator "{name}", expected one of {", ".join(rate_estimators)}')
+    if name == 'ewma':
+        return EwmaRateEstimator(window, ewma_alpha)
+    return rate_estimators[name](window)
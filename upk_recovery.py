@@ -0,0 +1,202 @@
+"""
+Выбор действия для восстановления поступления данных
+
+Уровни действий, от дешевого к дорогому:
+    service - перезапуск службы
+    reboot  - перезагрузка ИТО командой #reboot и перезапуск службы
+    netping - перезагрузка ИТО розеткой NetPing и перезапуск службы
+Каждый уровень повторяется заданное число раз, затем выбирается следующий. Если не помог ни один
+уровень (или ИТО не отвечает после max_unsuccessful_reboots перезагрузок подряд), действия
+приостанавливаются (hold-off); пауза удваивается после каждой неудачи до backoff_max_sec,
+после паузы повторяется самый дорогой уровень. Восстановление данных сбрасывает паузу.
+
+Для каждого уровня запоминается время от начала действия до восстановления данных и доля
+успешных действий; порядок уровней в новом сбое - по ожидаемому времени восстановления
+(среднее время / доля успехов), поэтому первым пробуется самое дешевое из помогающих действий.
+Время передается в методы параметром now - политику можно проверять без часов и оборудования.
+"""
+
+import logging
+
+recovery_levels = ('service', 'reboot', 'netping')
+
+ttr_alpha = 0.3  # коэффициент сглаживания времени восстановления
+
+
+def default_prior_ttr_sec(service_restart_sec, ito_rebooting_duration_sec):
+    """
+    Время восстановления уровней, пока его не измерили: перезапуск службы и одна проверка,
+    плюс загрузка ИТО и 20 с без питания для розетки
+    :param service_restart_sec: пауза перезапуска службы и интервал проверки папки
+    """
+    return {'service': service_restart_sec,
+            'reboot': service_restart_sec + ito_rebooting_duration_sec,
+            'netping': service_restart_sec + ito_rebooting_duration_sec + 20}
+
+
+class ActionStats:
+    """
+    Результаты действий одного уровня
+    """
+
+    __slots__ = ('attempts', 'successes', 'mean_ttr_sec')
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.mean_ttr_sec = None  # сглаженное время восстановления, с
+
+    def add(self, ttr_sec=None):
+        """
+        :param ttr_sec: время восстановления или None, если действие не помогло
+        """
+        self.attempts += 1
+        if ttr_sec is None:
+            return
+        self.successes += 1
+        if self.mean_ttr_sec is None:
+            self.mean_ttr_sec = ttr_sec
+        else:
+            self.mean_ttr_sec += ttr_alpha * (ttr_sec - self.mean_ttr_sec)
+
+    def success_rate(self):
+        # оценка Лапласа: без результатов - 0.5, одна неудача не исключает уровень навсегда
+        return (self.successes + 1) / (self.attempts + 2)
+
+
+class RecoveryPolicy:
+    """
+    Лестница действий при сбоях одной пары УПК/ИТО
+    next_action(now) - уровень для очередного действия или None (пауза),
+    on_recovered(now) / on_failed() - результат последнего действия
+    """
+
+    def __init__(self, levels=recovery_levels, attempts=None, prior_ttr_sec=None, max_unsuccessful_reboots=3,
+                 backoff_sec=600, backoff_max_sec=6 * 3600, log=logging):
+        """
+        :param levels: уровни в порядке по умолчанию
+        :param attempts: {уровень: число попыток до перехода на следующий}, по умолчанию 1
+        :param prior_ttr_sec: {уровень: ожидаемое время восстановления, пока нет измерений}
+        :param max_unsuccessful_reboots: перезагрузок ИТО подряд без связи с ним до паузы
+        :param backoff_sec: первая пауза после неудачи всех уровней
+        :param backoff_max_sec: наибольшая пауза
+        """
+        for level in levels:
+            if level not in recovery_levels:
+                raise ValueError(f'recovery_levels should be some of {", ".join(recovery_levels)}')
+        if not levels:
+            raise ValueError('recovery_levels is empty')
+        self.levels = tuple(levels)
+        self.attempts = {level: max(1, (attempts or {}).get(level, 1)) for level in self.levels}
+        self.prior_ttr_sec = {level: (prior_ttr_sec or {}).get(level, 60.0) for level in self.levels}
+        self.max_unsuccessful_reboots = max_unsuccessful_reboots
+        self.backoff_min_sec = backoff_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.log = log
+        self.stats = {level: ActionStats() for level in self.levels}
+
+        self.ladder = None  # порядок уровней в текущем сбое, None - сбоя нет
+        self.step = 0  # номер уровня в ladder
+        self.step_attempts = 0  # выполнено действий на этом уровне
+        self.pending = None  # (уровень, время начала) последнего действия без результата
+        self.hold_until = 0.0
+        self.backoff_sec = backoff_sec
+        self.retry_after_hold = False
+
+    def expected_ttr_sec(self, level):
+        stats = self.stats[level]
+        ttr = stats.mean_ttr_sec if stats.mean_ttr_sec is not None else self.prior_ttr_sec[level]
+        return ttr / stats.success_rate()
+
+    def order(self):
+        """
+        :return: уровни по возрастанию ожидаемого времени восстановления
+        """
+        return sorted(self.levels, key=lambda level: (self.expected_ttr_sec(level), self.levels.index(level)))
+
+    @property
+    def level(self):
+        """
+        Текущий уровень сбоя или None
+        """
+        return None if self.ladder is None else self.ladder[min(self.step, len(self.ladder) - 1)]
+
+    def restore(self, level, step_attempts):
+        """
+        Продолжение сбоя после перезапуска программы
+        """
+        if level not in self.levels:
+            return
+        self.ladder = self.order()
+        self.step = self.ladder.index(level)
+        self.step_attempts = step_attempts
+
+    def next_action(self, now, unsuccessful_reboots=0):
+        """
+        Уровень для очередного действия; прошлое действие без результата считается неудачным
+        :param unsuccessful_reboots: перезагрузок ИТО подряд, после которых нет связи с ним
+        :return: уровень или None, если действия приостановлены
+        """
+        self.on_failed()
+        if self.ladder is None:
+            self.ladder = self.order()
+            self.step, self.step_attempts = 0, 0
+            self.log.info('Recovery order: ' + ', '.join(
+                f'{level} ({self.expected_ttr_sec(level):.0f}sec expected)' for level in self.ladder))
+        if now < self.hold_until:
+            return None
+
+        reboots_allowed = self.retry_after_hold or unsuccessful_reboots < self.max_unsuccessful_reboots
+        while self.step < len(self.ladder) and (self.step_attempts >= self.attempts[self.ladder[self.step]] or
+                                                (self.ladder[self.step] != 'service' and not reboots_allowed)):
+            self.step += 1
+            self.step_attempts = 0
+
+        if self.step >= len(self.ladder):
+            # ничего не помогло - пауза, затем самый дорогой уровень еще раз
+            self.hold_until = now + self.backoff_sec
+            self.log.info(f'Recovery actions are held off for {self.backoff_sec:.0f}sec')
+            self.backoff_sec = min(2 * self.backoff_sec, self.backoff_max_sec)
+            self.step, self.step_attempts = len(self.ladder) - 1, 0
+            self.retry_after_hold = True
+            return None
+
+        self.retry_after_hold = False
+        level = self.ladder[self.step]
+        self.pending = (level, now)
+        return level
+
+    def on_failed(self, escalate=False):
+        """
+        Последнее действие не помогло
+        :param escalate: перейти на следующий уровень, не дожидаясь остальных попыток этого
+        :return: уровень неудачного действия или None
+        """
+        if self.pending is None:
+            return None
+        level = self.pending[0]
+        self.pending = None
+        self.stats[level].add()
+        self.step_attempts += 1
+        if escalate:
+            self.step_attempts = max(self.step_attempts, self.attempts[level])
+        return level
+
+    def on_recovered(self, now):
+        """
+        Данные поступают - сбой закончен, пауза сбрасывается
+        :return: (уровень, время восстановления) для последнего действия или None
+        """
+        if self.ladder is None:
+            return None
+        ret = None
+        if self.pending is not None:
+            level, started = self.pending
+            ret = level, now - started
+            self.stats[level].add(ret[1])
+        self.ladder, self.pending = None, None
+        self.step, self.step_attempts = 0, 0
+        self.hold_until = 0.0
+        self.backoff_sec = self.backoff_min_sec
+        self.retry_after_hold = False
+        return ret
@@ -0,0 +1,306 @@
+"""
+Проверка настроек trigger1/trigger2 на истории скорости поступления данных
+
+    python upk_replay.py <логи или папки с логами UPK_supervisor, файл UPK_supervisor_history.bin> [--instrument a]
+                         [--ini UPK_supervisor.ini] [--threshold 1,2,4] [--triggers 5,10] [--restarts 0,2,3]
+                         [--trigger2-interval-sec 0,86400] [--stall-speed 0.001]
+
+Отсчеты скорости берутся из строк 'Speed, [Mb/h]' логов UPK_supervisor (в том числе сжатых .log.gz)
+или из кольца raw файла истории (upk_history). Для каждого сочетания параметров решения trigger1
+и trigger2 вычисляются на массивах numpy сразу по всем отсчетам, поэтому сетка параметров
+за несколько месяцев считается за секунды. Результат для каждого сочетания:
+    restarts     - действий при срабатывании trigger1 и trigger2
+    ITO reboots  - из них с перезагрузкой ИТО; уровень каждого действия выбирает RecoveryPolicy (upk_recovery),
+                   как при работе программы: num_of_service_restarts_before_ito_reboot перезапусков службы,
+                   перезагрузка командой, розеткой, затем пауза (действия при срабатывании в паузе не считаются)
+    missed, h    - время простоя (скорость не больше --stall-speed) до первого действия в нем
+    undetected   - простои, в которых не было ни одного действия
+История содержит скорость при тех действиях, которые были на самом деле, поэтому результат - оценка:
+действия, которых не было, не меняют следующие отсчеты; проверка готовности после действия, число
+перезагрузок ИТО без связи с ним и data_stall_timeout_sec не учитываются.
+"""
+
+import argparse
+import configparser
+import glob
+import gzip
+import itertools
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from upk_recovery import RecoveryPolicy, default_prior_ttr_sec, recovery_levels
+
+speed_marker = 'Speed, [Mb/h]\t'
+log_files_templates = ('UPK_supervisor*.log', 'UPK_supervisor*.log.gz')
+
+# upk_instrument.py[LINE:600]# INFO     [2021-10-19 12:00:00,123]  [a] Speed, [Mb/h]	1.234
+log_line_re = re.compile(r'\[(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d),(\d{3})\]  (?:\[([^\]]*)\] )?(.*)')
+
+# события в логе: название -> начало сообщения
+log_events = {
+    'trigger1': 'Trigger1 released',
+    'trigger2': 'Trigger2 released',
+    'ito_reboot': 'ITO reboot...',
+    'netping_reboot': 'Rebooting ITO by Netping socket...',
+}
+
+
+def log_files(paths):
+    """
+    Лог-файлы из списка файлов и папок
+    """
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            for template in log_files_templates:
+                ret += glob.glob(os.path.join(glob.escape(path), template))
+        else:
+            ret.append(path)
+    return sorted(set(ret))
+
+
+def read_log_samples(paths, instrument=None):
+    """
+    Отсчеты скорости и события из логов UPK_supervisor
+    :param instrument: имя пары УПК/ИТО, None - строки без имени пары (одна пара в ini-файле)
+    :return: times, speeds (numpy-массивы, по возрастанию времени), {событие: количество}
+    """
+    times, speeds = [], []
+    events = dict.fromkeys(log_events, 0)
+    for file_name in log_files(paths):
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(file_name, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                # большинство строк лога не нужны - отбрасываются без регулярного выражения
+                if speed_marker not in line and 'released' not in line and 'Rebooting ITO' not in line and \
+                        'ITO reboot' not in line:
+                    continue
+                m = log_line_re.search(line)
+                if m is None or m.group(8) != instrument:
+                    continue
+                message = m.group(9)
+                if message.startswith(speed_marker):
+                    g = m.groups()
+                    try:
+                        t = datetime(int(g[0]), int(g[1]), int(g[2]), int(g[3]), int(g[4]), int(g[5]),
+                                     int(g[6]) * 1000).timestamp()
+                        speeds.append(float(message[len(speed_marker):]))
+                    except ValueError:
+                        continue
+                    times.append(t)
+                else:
+                    for event, marker in log_events.items():
+                        if message.startswith(marker):
+                            events[event] += 1
+
+    times, speeds = np.array(times), np.array(speeds)
+    order = np.argsort(times, kind='stable')
+    return times[order], speeds[order], events
+
+
+def read_history_samples(file_name):
+    """
+    Отсчеты скорости из кольца raw файла истории
+    :return: times, speeds
+    """
+    from upk_history import HistoryStore
+    store = HistoryStore(file_name, readonly=True)
+    try:
+        _, points = store.query(tier='raw')
+    finally:
+        store.close()
+    times = np.array([p.time for p in points])
+    speeds = np.array([p.mean for p in points])
+    valid = ~np.isnan(speeds)
+    return times[valid], speeds[valid]
+
+
+def runs(mask):
+    """
+    :return: начала и концы (не включая) участков подряд идущих True
+    """
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return changes[::2], changes[1::2]
+
+
+def recovery_actions(times, low, releases, num_of_restarts_before_reboot, levels, prior_ttr_sec, backoff_sec,
+                     backoff_max_sec):
+    """
+    Уровни действий на срабатываниях trigger1 по RecoveryPolicy - срабатываний немного, поэтому обычным циклом
+    Скорость не ниже порога между срабатываниями заканчивает сбой (on_recovered), как в проверке trigger1
+    :return: срабатывания, на которых было действие (не пауза), количество действий с перезагрузкой ИТО
+    """
+    if num_of_restarts_before_reboot <= 0:
+        levels = ('service',)
+    policy = RecoveryPolicy(levels, attempts={'service': num_of_restarts_before_reboot},
+                            prior_ttr_sec=prior_ttr_sec or default_prior_ttr_sec(10 + 60, 40),
+                            backoff_sec=backoff_sec, backoff_max_sec=backoff_max_sec,
+                            log=logging.getLogger('upk_replay'))
+    good = np.flatnonzero(~low)
+    first_good = np.searchsorted(good, releases)  # первая хорошая скорость после срабатывания
+    done = []
+    ito_reboots = 0
+    prev_good = None
+    for i, release in enumerate(releases):
+        if prev_good is not None and prev_good < len(good) and good[prev_good] < release:
+            policy.on_recovered(times[good[prev_good]])
+        prev_good = first_good[i]
+        level = policy.next_action(times[release])
+        if level is None:
+            continue
+        done.append(release)
+        if level != 'service':
+            ito_reboots += 1
+    return np.array(done, dtype=np.int64), ito_reboots
+
+
+def replay(times, speeds, threshold, num_of_triggers, num_of_restarts_before_reboot, trigger2_interval_sec=0.0,
+           stall_speed=0.001, levels=recovery_levels, prior_ttr_sec=None, backoff_sec=600, backoff_max_sec=6 * 3600):
+    """
+    Решения trigger1/trigger2 на отсчетах скорости
+    :param threshold: dir_size_speed_threshold_mb_per_h
+    :param num_of_triggers: num_of_triggers_before_action
+    :param num_of_restarts_before_reboot: num_of_service_restarts_before_ito_reboot
+    :param trigger2_interval_sec: win_service_restart_interval_sec, 0 - trigger2 не используется
+    :param stall_speed: скорость, при которой данные считаются остановившимися
+    :param levels: recovery_levels (без netping, если нет розетки)
+    :param prior_ttr_sec: ожидаемое время восстановления уровней, по умолчанию - для рекомендуемых настроек
+    :param backoff_sec: recovery_backoff_sec
+    :param backoff_max_sec: recovery_backoff_max_sec
+    :return: словарь с результатами
+    """
+    n = len(times)
+    # отрицательная скорость (удаление файлов) - не низкая, как в проверке trigger1
+    low = (speeds >= 0) & (speeds < threshold)
+
+    # trigger2 сбрасывает счетчик trigger1 - счет идет внутри интервалов trigger2
+    trigger2_count = 0
+    if trigger2_interval_sec > 0 and n:
+        segments = ((times - times[0]) // trigger2_interval_sec).astype(np.int64)
+        trigger2_count = int(segments[-1])
+    else:
+        segments = np.zeros(n, dtype=np.int64)
+    low_count = np.cumsum(low)
+    seg_starts = np.concatenate(([0], np.flatnonzero(np.diff(segments)) + 1)) if n else np.array([], dtype=np.int64)
+    before = np.concatenate(([0], low_count))[seg_starts]
+    low_in_segment = low_count - np.repeat(before, np.diff(np.concatenate((seg_starts, [n]))))
+
+    # счетчик не сбрасывается хорошей скоростью: срабатывание - на каждой (num_of_triggers + 1)-й низкой скорости
+    releases = np.flatnonzero(low & (low_in_segment % (num_of_triggers + 1) == 0) & (low_in_segment > 0))
+    releases, ito_reboots = recovery_actions(times, low, releases, num_of_restarts_before_reboot, levels,
+                                             prior_ttr_sec, backoff_sec, backoff_max_sec)
+
+    # простои и время до первого действия в них
+    stall_starts, stall_ends = runs(speeds <= stall_speed)
+    end_times = times[np.minimum(stall_ends, n - 1)] if n else times
+    detect_times = end_times.copy()
+    detected = np.zeros(len(stall_starts), dtype=bool)
+    if len(releases):
+        first_release = np.searchsorted(releases, stall_starts)
+        candidates = releases[np.minimum(first_release, len(releases) - 1)]
+        detected = (first_release < len(releases)) & (candidates < stall_ends)
+        detect_times[detected] = times[candidates[detected]]
+    missed_sec = float(np.sum(detect_times - times[stall_starts])) if len(stall_starts) else 0.0
+
+    return {
+        'threshold': threshold,
+        'triggers': num_of_triggers,
+        'restarts_before_reboot': num_of_restarts_before_reboot,
+        'trigger2_interval_sec': trigger2_interval_sec,
+        'restarts': len(releases) + trigger2_count,
+        'ito_reboots': ito_reboots,
+        'missed_h': missed_sec / 3600,
+        'stalls': len(stall_starts),
+        'undetected': int(np.count_nonzero(~detected)),
+    }
+
+
+def sweep(times, speeds, thresholds, triggers, restarts, trigger2_intervals, stall_speed=0.001, **recovery):
+    """
+    replay для всех сочетаний параметров
+    :param recovery: параметры RecoveryPolicy, см. replay
+    """
+    return [replay(times, speeds, *params, stall_speed=stall_speed, **recovery)
+            for params in itertools.product(thresholds, triggers, restarts, trigger2_intervals)]
+
+
+def parse_list(conv):
+    return lambda value: [conv(v) for v in value.split(',') if v.strip()]
+
+
+def ini_defaults(ini_file_name, instrument=None):
+    """
+    Текущие настройки пары из ini-файла
+    :return: сетка параметров, параметры RecoveryPolicy
+    """
+    from upk_instrument import InstrumentSettings, instrument_section_prefix
+    config = configparser.ConfigParser()
+    config.read(ini_file_name)
+    s = InstrumentSettings(config, instrument_section_prefix + instrument if instrument else None)
+    # уровни без учета num_of_service_restarts_before_ito_reboot - он перебирается в сетке
+    levels = [level.strip().lower() for level in s.get('recovery_levels', 'trigger1', ', '.join(recovery_levels)).split(',')
+              if level.strip() and (level.strip().lower() != 'netping' or s.netping_relay_address)]
+    grid = {'threshold': [s.dir_size_speed_threshold_mb_per_h], 'triggers': [s.num_of_triggers_before_action],
+            'restarts': [s.num_of_service_restarts_before_ito_reboot],
+            'trigger2_interval_sec': [s.win_service_restart_interval_sec]}
+    recovery = {'levels': levels,
+                'prior_ttr_sec': default_prior_ttr_sec(s.win_service_restart_pause + s.dir_check_interval_sec,
+                                                       s.ITO_rebooting_duration_sec),
+                'backoff_sec': s.recovery_backoff_sec, 'backoff_max_sec': s.recovery_backoff_max_sec}
+    return grid, recovery
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay trigger settings over UPK_supervisor data rate history')
+    parser.add_argument('paths', nargs='+', help='UPK_supervisor logs or folders with them, or UPK_supervisor_history.bin')
+    parser.add_argument('--instrument', help='UPK/ITO pair name, for logs of several pairs')
+    parser.add_argument('--ini', help='ini-file with current settings, used for parameters not set below')
+    parser.add_argument('--threshold', type=parse_list(float), help='dir_size_speed_threshold_mb_per_h values')
+    parser.add_argument('--triggers', type=parse_list(int), help='num_of_triggers_before_action values')
+    parser.add_argument('--restarts', type=parse_list(int), help='num_of_service_restarts_before_ito_reboot values')
+    parser.add_argument('--trigger2-interval-sec', type=parse_list(float), help='win_service_restart_interval_sec values')
+    parser.add_argument('--stall-speed', type=float, default=0.001, help='speed of stalled data flow, Mb/h')
+    args = parser.parse_args()
+
+    grid = {'threshold': [2.0], 'triggers': [5], 'restarts': [2], 'trigger2_interval_sec': [0.0]}
+    recovery = {}
+    if args.ini:
+        ini_grid, recovery = ini_defaults(args.ini, args.instrument)
+        grid.update(ini_grid)
+    for key in grid:
+        if getattr(args, key) is not None:
+            grid[key] = getattr(args, key)
+
+    started = time.perf_counter()
+    events = None
+    if len(args.paths) == 1 and args.paths[0].endswith('.bin'):
+        times, speeds = read_history_samples(args.paths[0])
+    else:
+        times, speeds, events = read_log_samples(args.paths, args.instrument)
+    if not len(times):
+        print('No data rate samples found')
+        sys.exit(1)
+    loaded = time.perf_counter()
+    results = sweep(times, speeds, grid['threshold'], grid['triggers'], grid['restarts'], grid['trigger2_interval_sec'],
+                    args.stall_speed, **recovery)
+    finished = time.perf_counter()
+
+    print(f'{len(times)} samples from {datetime.fromtimestamp(times[0]):%Y-%m-%d %H:%M} '
+          f'to {datetime.fromtimestamp(times[-1]):%Y-%m-%d %H:%M}')
+    if events is not None:
+        print(f'actual: trigger1 {events["trigger1"]}, trigger2 {events["trigger2"]}, '
+              f'ITO reboots {events["ito_reboot"] + events["netping_reboot"]}')
+    print('threshold\ttriggers\trestarts before reboot\ttrigger2 interval\trestarts\tITO reboots\tmissed, h\t'
+          'undetected stalls')
+    for r in results:
+        print(f'{r["threshold"]:g}\t{r["triggers"]}\t{r["restarts_before_reboot"]}\t{r["trigger2_interval_sec"]:g}\t'
+              f'{r["restarts"]}\t{r["ito_reboots"]}\t{r["missed_h"]:.2f}\t{r["undetected"]}/{r["stalls"]}')
+    print(f'loaded in {loaded - started:.2f} sec, {len(results)} settings replayed in {finished - loaded:.2f} sec',
+          file=sys.stderr)
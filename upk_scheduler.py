@@ -0,0 +1,187 @@
+"""
+Планировщик срабатывания триггеров по срокам
+
+Триггеры регистрируют свои ближайшие сроки в очереди с приоритетом (heapq), а цикл планировщика
+спит ровно до самого раннего срока - без пробуждений каждую секунду. Сроки считаются по
+монотонным часам, поэтому перевод часов компьютера или ИТО (в том числе самой программой)
+не сдвигает интервалы между проверками.
+
+Пример:
+    scheduler = DeadlineScheduler()
+    scheduler.call_every(60, check_data_dir, name='trigger1')
+    await scheduler.run()
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from upk_profile import trace
+
+
+class Job:
+    """
+    Задание планировщика
+    callback - функция или корутинная функция без аргументов
+    interval_sec - период повторения, None для однократного задания
+    """
+
+    __slots__ = ('name', 'callback', 'interval_sec', 'deadline', 'generation', 'task', 'cancelled')
+
+    def __init__(self, name, callback, interval_sec=None):
+        self.name = name
+        self.callback = callback
+        self.interval_sec = interval_sec
+        self.deadline = None
+        self.generation = 0  # номер последней постановки в очередь - более ранние записи очереди устарели
+        self.task = None  # выполняемая корутина задания
+        self.cancelled = False
+
+    def is_running(self):
+        return self.task is not None and not self.task.done()
+
+    def __repr__(self):
+        return f'Job({self.name!r}, deadline={self.deadline}, interval_sec={self.interval_sec})'
+
+
+class DeadlineScheduler:
+    """
+    Очередь сроков заданий на монотонных часах
+    Периодическое задание выполняется с постоянным шагом от предыдущего срока; если выполнение
+    опоздало больше чем на период, расписание сдвигается от текущего момента. Новый запуск
+    корутинного задания пропускается, пока не закончен предыдущий.
+    """
+
+    def __init__(self, clock=time.monotonic, log=logging):
+        """
+        :param clock: функция текущего времени, секунды
+        """
+        self.clock = clock
+        self.log = log
+        self._queue = []  # (срок, порядковый номер, поколение задания, задание); устаревшие записи пропускаются
+        self._counter = itertools.count()
+        self._wakeup = None
+        self.wakeups = 0  # количество пробуждений цикла планировщика
+
+    def call_at(self, deadline, callback, name=''):
+        """
+        Однократное задание на срок deadline по часам clock
+        :return: Job
+        """
+        job = Job(name, callback)
+        self.reschedule(job, deadline)
+        return job
+
+    def call_later(self, delay_sec, callback, name=''):
+        return self.call_at(self.clock() + delay_sec, callback, name)
+
+    def call_every(self, interval_sec, callback, name='', first_delay_sec=None):
+        """
+        Периодическое задание
+        :param first_delay_sec: задержка первого выполнения, по умолчанию interval_sec
+        :return: Job
+        """
+        if interval_sec <= 0:
+            raise ValueError(f'interval_sec should be positive, got {interval_sec}')
+        job = Job(name, callback, interval_sec)
+        self.reschedule(job, self.clock() + (interval_sec if first_delay_sec is None else first_delay_sec))
+        return job
+
+    def reschedule(self, job, deadline):
+        """
+        Перенос срока задания (в том числе уже выполненного однократного)
+        """
+        job.deadline = deadline
+        job.cancelled = False
+        job.generation += 1
+        earliest = self.next_deadline()
+        heapq.heappush(self._queue, (deadline, next(self._counter), job.generation, job))
+        if self._wakeup is not None and (earliest is None or deadline < earliest):
+            # новый срок раньше того, до которого спит цикл
+            self._wakeup.set()
+
+    def cancel(self, job):
+        job.cancelled = True
+        job.deadline = None
+        job.generation += 1
+
+    def _drop_stale(self):
+        while self._queue:
+            _, _, generation, job = self._queue[0]
+            if job.generation == generation:
+                return
+            heapq.heappop(self._queue)
+
+    def next_deadline(self):
+        """
+        :return: ближайший срок или None, если заданий нет
+        """
+        self._drop_stale()
+        return self._queue[0][0] if self._queue else None
+
+    def run_pending(self):
+        """
+        Запуск всех заданий, срок которых наступил
+        :return: количество запущенных заданий
+        """
+        started = 0
+        now = self.clock()
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return started
+            _, _, _, job = heapq.heappop(self._queue)
+
+            if job.interval_sec is None:
+                job.deadline = None
+            else:
+                next_deadline = deadline + job.interval_sec
+                if next_deadline <= now:
+                    # выполнение опоздало больше чем на период - расписание сдвигается
+                    next_deadline = now + job.interval_sec
+                self.reschedule(job, next_deadline)
+
+            if job.is_running():
+                self.log.info(f'Job {job.name} is still running, skipped')
+                continue
+            self._start(job)
+            started += 1
+
+    def _start(self, job):
+        try:
+            result = job.callback()
+        except Exception as e:
+            self.log.error(f'Job {job.name} exception: {e.__doc__}')
+            return
+        if asyncio.iscoroutine(result):
+            job.task = asyncio.ensure_future(self._run_job(job, result))
+
+    async def _run_job(self, job, coro):
+        try:
+            with trace(job.name):
+                await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.error(f'Job {job.name} exception: {e.__doc__}')
+
+    async def run(self):
+        """
+        Цикл планировщика: сон до ближайшего срока, запуск наступивших заданий
+        """
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self._wakeup.clear()
+                self.run_pending()
+                deadline = self.next_deadline()
+                timeout = None if deadline is None else max(0.0, deadline - self.clock())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeups += 1
+        finally:
+            self._wakeup = None
@@ -0,0 +1,314 @@
+"""
+Управление службой УПК
+
+Контроллер службы - объект с корутинами stop(service_name) и start(service_name), возвращающими код
+завершения (0 - успех). InstrumentSupervisor получает контроллер при создании, поэтому вместо
+службы Windows можно подставить другую реализацию, например upk_sim.LocalServiceController.
+
+ServiceController подает команду и ждет, пока служба действительно остановится или запустится:
+состояние опрашивается с интервалом, который растет от poll_min_sec до poll_max_sec. Если служба
+не остановилась за stop_timeout_sec, ее процесс завершается принудительно (kill).
+Реализации:
+    scm     - службы Windows через API диспетчера служб (pywin32), без запуска процессов
+    systemd - службы Linux через systemctl, для проверки на Linux
+    sc      - прежний способ: sc.exe stop/start без ожидания состояния
+"""
+
+import abc
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import time
+
+# коды ошибок Windows, которые возвращают stop и start
+ERROR_SERVICE_REQUEST_TIMEOUT = 1053
+ERROR_SERVICE_ALREADY_RUNNING = 1056
+ERROR_SERVICE_NOT_ACTIVE = 1062
+
+service_control_modes = ('auto', 'scm', 'systemd', 'sc')
+
+
+async def run_sc(command, service_name):
+    """
+    Запуск 'sc <command> <service_name>', при отмене (таймауте) процесс завершается
+    :return: return code
+    """
+    proc = await asyncio.create_subprocess_exec('sc', command, service_name)
+    try:
+        return await proc.wait()
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+
+
+class ScServiceController:
+    """
+    Служба Windows, команды через sc.exe; завершение остановки не проверяется,
+    поэтому после остановки нужна пауза win_service_restart_pause
+    """
+
+    name = 'sc'
+    confirms_state = False
+
+    async def stop(self, service_name):
+        return await run_sc('stop', service_name)
+
+    async def start(self, service_name):
+        return await run_sc('start', service_name)
+
+
+class ServiceController(abc.ABC):
+    """
+    Остановка и запуск службы с ожиданием ее состояния
+    Наследники реализуют query_state, send_stop, send_start и kill.
+    Состояния: stopped, start_pending, stop_pending, running, continue_pending, pause_pending, paused, unknown
+    """
+
+    name = ''
+    confirms_state = True
+    poll_min_sec = 0.05
+    poll_max_sec = 1.0
+
+    def __init__(self, stop_timeout_sec=60, start_timeout_sec=60, kill_timeout_sec=10, log=logging):
+        """
+        :param stop_timeout_sec: ожидание остановки, после него процесс службы завершается принудительно
+        :param start_timeout_sec: ожидание запуска
+        :param kill_timeout_sec: ожидание остановки после принудительного завершения
+        """
+        self.stop_timeout_sec = stop_timeout_sec
+        self.start_timeout_sec = start_timeout_sec
+        self.kill_timeout_sec = kill_timeout_sec
+        self.log = log
+
+    @abc.abstractmethod
+    async def query_state(self, service_name):
+        pass
+
+    @abc.abstractmethod
+    async def send_stop(self, service_name):
+        """
+        :return: 0 или код ошибки
+        """
+
+    @abc.abstractmethod
+    async def send_start(self, service_name):
+        pass
+
+    @abc.abstractmethod
+    async def kill(self, service_name):
+        pass
+
+    async def wait_for_state(self, service_name, states, timeout_sec):
+        """
+        Опрос состояния службы, пока оно не станет одним из states
+        :return: последнее состояние
+        """
+        deadline = time.monotonic() + timeout_sec
+        poll_sec = self.poll_min_sec
+        while True:
+            state = await self.query_state(service_name)
+            if state in states:
+                return state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return state
+            await asyncio.sleep(min(poll_sec, remaining))
+            poll_sec = min(poll_sec * 1.5, self.poll_max_sec)
+
+    async def stop(self, service_name):
+        started = time.monotonic()
+        state = await self.query_state(service_name)
+        if state == 'stopped':
+            self.log.info(f'Service {service_name} is already stopped')
+            return 0
+        if state != 'stop_pending':
+            ret = await self.send_stop(service_name)
+            if ret and ret != ERROR_SERVICE_NOT_ACTIVE:
+                self.log.error(f'Service {service_name} stop command error {ret}')
+
+        state = await self.wait_for_state(service_name, ('stopped',), self.stop_timeout_sec)
+        if state != 'stopped':
+            self.log.error(f'Service {service_name} is not stopped in {self.stop_timeout_sec}sec ({state}), killing...')
+            await self.kill(service_name)
+            state = await self.wait_for_state(service_name, ('stopped',), self.kill_timeout_sec)
+            if state != 'stopped':
+                return ERROR_SERVICE_REQUEST_TIMEOUT
+
+        self.log.info(f'Service {service_name} stopped in {time.monotonic() - started:.1f}sec')
+        return 0
+
+    async def start(self, service_name):
+        started = time.monotonic()
+        state = await self.query_state(service_name)
+        if state == 'running':
+            self.log.info(f'Service {service_name} is already running')
+            return 0
+        if state == 'stop_pending':
+            await self.wait_for_state(service_name, ('stopped',), self.stop_timeout_sec)
+        if state != 'start_pending':
+            ret = await self.send_start(service_name)
+            if ret and ret != ERROR_SERVICE_ALREADY_RUNNING:
+                return ret
+
+        state = await self.wait_for_state(service_name, ('running', 'stopped'), self.start_timeout_sec)
+        if state == 'stopped':
+            self.log.error(f'Service {service_name} stopped during start')
+            return ERROR_SERVICE_REQUEST_TIMEOUT
+        if state != 'running':
+            self.log.error(f'Service {service_name} is not started in {self.start_timeout_sec}sec ({state})')
+            return ERROR_SERVICE_REQUEST_TIMEOUT
+
+        self.log.info(f'Service {service_name} started in {time.monotonic() - started:.1f}sec')
+        return 0
+
+
+class Win32ServiceController(ServiceController):
+    """
+    Службы Windows через API диспетчера служб (pywin32); дескрипторы служб открываются один раз
+    """
+
+    name = 'scm'
+
+    _states = {1: 'stopped', 2: 'start_pending', 3: 'stop_pending', 4: 'running',
+               5: 'continue_pending', 6: 'pause_pending', 7: 'paused'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import win32service  # ImportError сразу, если pywin32 не установлен
+        self._scm = None
+        self._handles = {}
+
+    def _handle(self, service_name):
+        import win32service
+        handle = self._handles.get(service_name)
+        if handle is None:
+            if self._scm is None:
+                self._scm = win32service.OpenSCManager(None, None, win32service.SC_MANAGER_CONNECT)
+            handle = win32service.OpenService(self._scm, service_name,
+                                              win32service.SERVICE_QUERY_STATUS | win32service.SERVICE_START |
+                                              win32service.SERVICE_STOP)
+            self._handles[service_name] = handle
+        return handle
+
+    def _status(self, service_name):
+        import win32service
+        return win32service.QueryServiceStatusEx(self._handle(service_name))
+
+    def _call(self, fn, service_name):
+        # ошибки API - код ошибки Windows, дескриптор после ошибки открывается заново
+        try:
+            fn(self._handle(service_name))
+        except Exception as e:
+            self._close_handle(service_name)
+            return getattr(e, 'winerror', None) or -1
+        return 0
+
+    def _close_handle(self, service_name):
+        import win32service
+        handle = self._handles.pop(service_name, None)
+        if handle is not None:
+            try:
+                win32service.CloseServiceHandle(handle)
+            except Exception:
+                pass
+
+    async def query_state(self, service_name):
+        try:
+            status = await asyncio.to_thread(self._status, service_name)
+        except Exception as e:
+            self._close_handle(service_name)
+            self.log.error(f'Service {service_name} status error: {e}')
+            return 'unknown'
+        return self._states.get(status['CurrentState'], 'unknown')
+
+    async def send_stop(self, service_name):
+        import win32service
+        return await asyncio.to_thread(
+            self._call, lambda h: win32service.ControlService(h, win32service.SERVICE_CONTROL_STOP), service_name)
+
+    async def send_start(self, service_name):
+        import win32service
+        return await asyncio.to_thread(self._call, lambda h: win32service.StartService(h, None), service_name)
+
+    def _kill(self, service_name):
+        import win32api
+        import win32con
+        pid = self._status(service_name)['ProcessId']
+        if not pid:
+            return
+        process = win32api.OpenProcess(win32con.PROCESS_TERMINATE, False, pid)
+        try:
+            win32api.TerminateProcess(process, 1)
+        finally:
+            win32api.CloseHandle(process)
+
+    async def kill(self, service_name):
+        try:
+            await asyncio.to_thread(self._kill, service_name)
+        except Exception as e:
+            self.log.error(f'Service {service_name} kill error: {e}')
+
+
+class SystemdServiceController(ServiceController):
+    """
+    Службы Linux через systemctl
+    """
+
+    name = 'systemd'
+
+    _states = {'active': 'running', 'reloading': 'running', 'inactive': 'stopped', 'failed': 'stopped',
+               'activating': 'start_pending', 'deactivating': 'stop_pending'}
+
+    @staticmethod
+    async def _systemctl(*args):
+        proc = await asyncio.create_subprocess_exec('systemctl', *args, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            out, _ = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        return proc.returncode, out.decode(errors='replace').strip()
+
+    async def query_state(self, service_name):
+        _, out = await self._systemctl('show', '-p', 'ActiveState', '--value', service_name)
+        return self._states.get(out, 'unknown')
+
+    async def send_stop(self, service_name):
+        return (await self._systemctl('stop', '--no-block', service_name))[0]
+
+    async def send_start(self, service_name):
+        return (await self._systemctl('start', '--no-block', service_name))[0]
+
+    async def kill(self, service_name):
+        await self._systemctl('kill', '-s', 'SIGKILL', service_name)
+
+
+def create_service_controller(mode='auto', stop_timeout_sec=60, start_timeout_sec=60, kill_timeout_sec=10,
+                              log=logging):
+    """
+    :param mode: auto, scm, systemd, sc; auto - scm на Windows (sc, если нет pywin32), systemd на Linux
+    :raise ValueError: неизвестный mode или в режиме auto на этой системе нет способа управления службами
+    """
+    if mode not in service_control_modes:
+        raise ValueError(f'service_control should be one of {", ".join(service_control_modes)}')
+    if mode == 'sc':
+        return ScServiceController()
+
+    timeouts = dict(stop_timeout_sec=stop_timeout_sec, start_timeout_sec=start_timeout_sec,
+                    kill_timeout_sec=kill_timeout_sec, log=log)
+    if mode == 'scm' or (mode == 'auto' and os.name == 'nt'):
+        try:
+            return Win32ServiceController(**timeouts)
+        except ImportError:
+            if mode == 'scm':
+                raise
+            log.info('pywin32 service API is not available, using sc.exe')
+            return ScServiceController()
+    if mode == 'systemd' or shutil.which('systemctl'):
+        return SystemdServiceController(**timeouts)
+    # sc.exe есть только на Windows
+    raise ValueError(f'service_control = auto: no service manager on {sys.platform} (neither Windows nor systemctl), '
+                     f'set service_control explicitly')
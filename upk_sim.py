@@ -0,0 +1,637 @@
+"""
+Имитация оборудования для проверки UPK_supervisor без УПК и ИТО
+
+FakeHyperionServer - TCP-сервер, отвечающий на команды по протоколу порта команд Hyperion:
+    запрос:  заголовок '<BBHI' (опции, 0, длина команды, длина аргумента), команда, аргумент (ASCII)
+    ответ:   заголовок '<BBHI' (статус, тип, длина сообщения, длина содержимого), сообщение, содержимое
+Статус 0 - успех, иначе в сообщении описание ошибки.
+
+FakeNetpingServer - HTTP-сервер с командами розеток NetPing (relay.cgi), NetpingHttpClient - клиент к нему
+LocalServiceController - служба УПК внутри процесса вместо службы Windows
+SyntheticDataWriter - запись файлов в папку с данными с заданной скоростью, остановками и ротацией
+SimulatedInstrument - пара УПК/ИТО целиком на имитаторах: InstrumentSupervisor, подключенный ко всем
+    имитаторам, и служба, которая останавливает и запускает запись данных
+
+Пример:
+    with SimulatedInstrument('/tmp/sim', rate_bytes_per_sec=20000) as sim:
+        asyncio.run(sim.supervisor.action_when_any_trigger_released(ito_reboot=True))
+"""
+
+import asyncio
+import configparser
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from array import array
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from struct import pack, unpack
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from upk_service import ServiceController, ERROR_SERVICE_ALREADY_RUNNING, ERROR_SERVICE_NOT_ACTIVE
+
+HYPERION_REQUEST_HEADER = '<BBHI'
+HYPERION_RESPONSE_HEADER = '<BBHI'
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+
+class FakeHyperionServer:
+    """
+    Имитатор порта команд ИТО
+    Ответы на команды задаются словарем handlers: команда -> функция(аргумент) -> (сообщение, содержимое)
+    Атрибуты для имитации неисправностей:
+        response_delay_sec - задержка каждого ответа (медленный прибор)
+        down - сервер не принимает подключения (прибор выключен)
+        fail_commands - команды, на которые возвращается ошибка
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.response_delay_sec = 0.0
+        self.fail_commands = set()
+        self.commands = []  # журнал полученных команд
+        self.connections = 0  # сколько раз к серверу подключались
+        self.board_temperature = 35.5
+        self.reboot_duration_sec = 0.0
+        self.spectrum_points = 20000  # размер спектра: точек на канал
+        self.spectrum_channels = 4
+        self._down_until = 0.0
+
+        self.handlers = {
+            '#GetChannelDetectionSettingId': lambda arg: ('', pack('<I', 0)),
+            '#GetBoardTemperature': lambda arg: ('', pack('<d', self.board_temperature)),
+            '#GetSerialNumber': lambda arg: ('', b'FAKE0001'),
+            '#GetSpectrum': self._spectrum,
+            '#Reboot': self._reboot,
+            '#reboot': self._reboot,
+        }
+
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                if server.down:
+                    return
+                server.connections += 1
+                sock = self.request
+                header_size = len(pack(HYPERION_REQUEST_HEADER, 0, 0, 0, 0))
+                while True:
+                    try:
+                        options, _, command_length, argument_length = unpack(HYPERION_REQUEST_HEADER,
+                                                                             _recv_exactly(sock, header_size))
+                        command = _recv_exactly(sock, command_length).decode('ascii')
+                        argument = _recv_exactly(sock, argument_length).decode('ascii') if argument_length else ''
+                    except (ConnectionError, OSError):
+                        return
+                    try:
+                        sock.sendall(server.respond(command, argument))
+                    except OSError:
+                        return
+                    if server.down:
+                        # после перезагрузки прибор разрывает соединения
+                        return
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.address, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    @property
+    def down(self):
+        return time.monotonic() < self._down_until
+
+    def set_down(self, duration_sec):
+        self._down_until = time.monotonic() + duration_sec
+
+    def _reboot(self, argument):
+        self.set_down(self.reboot_duration_sec)
+        return 'Rebooting', b''
+
+    def _spectrum(self, argument):
+        # упрощенный формат: число точек, число каналов, длины волн, спектры каналов (double)
+        n, m = self.spectrum_points, self.spectrum_channels
+        wavelengths = array('d', (1500.0 + 100.0 * i / n for i in range(n)))
+        values = array('d', (-40.0 + (i % 97) * 0.1 for i in range(n))) * m
+        return '', pack('<II', n, m) + wavelengths.tobytes() + values.tobytes()
+
+    def respond(self, command, argument=''):
+        """
+        :return: ответ на команду в формате порта команд
+        """
+        self.commands.append(command)
+        if self.response_delay_sec:
+            time.sleep(self.response_delay_sec)
+
+        handler = self.handlers.get(command)
+        if handler is None or command in self.fail_commands:
+            message = f'Unknown command {command}' if handler is None else f'Command {command} failed'
+            content = b''
+            status = 1
+        else:
+            message, content = handler(argument)
+            status = 0
+        message = message.encode('ascii')
+        return pack(HYPERION_RESPONSE_HEADER, status, 0, len(message), len(content)) + message + content
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeHyperionServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class FakeHyperionClient:
+    """
+    Минимальный клиент порта команд Hyperion с постоянным соединением
+    Повторяет используемые программой методы hyperion.Hyperion, чтобы ItoSession можно было
+    проверить с FakeHyperionServer без библиотеки hyperion:
+        ItoSession('127.0.0.1', port=server.port, instrument_factory=lambda a: FakeHyperionClient(a, server.port))
+    """
+
+    class Response:
+        def __init__(self, message, content):
+            self.message = message
+            self.content = content
+
+    class Spectra:
+        def __init__(self, wavelengths, data):
+            self.wavelengths = wavelengths
+            self.data = data
+
+    def __init__(self, address, port, timeout_sec=2.0):
+        self._socket = socket.create_connection((address, port), timeout=timeout_sec)
+
+    def _execute_command(self, command, argument=''):
+        command_bytes = command.encode('ascii')
+        argument_bytes = argument.encode('ascii')
+        self._socket.sendall(pack(HYPERION_REQUEST_HEADER, 0, 0, len(command_bytes), len(argument_bytes)) +
+                             command_bytes + argument_bytes)
+        header_size = len(pack(HYPERION_RESPONSE_HEADER, 0, 0, 0, 0))
+        status, _, message_length, content_length = unpack(HYPERION_RESPONSE_HEADER,
+                                                           _recv_exactly(self._socket, header_size))
+        message = _recv_exactly(self._socket, message_length).decode('ascii') if message_length else ''
+        content = _recv_exactly(self._socket, content_length) if content_length else b''
+        if status:
+            raise RuntimeError(message)
+        return self.Response(message, content)
+
+    def get_channel_detection_setting(self, channel):
+        return unpack('<I', self._execute_command('#GetChannelDetectionSettingId', str(channel)).content)[0]
+
+    def reboot(self):
+        self._execute_command('#Reboot')
+
+    @property
+    def spectra(self):
+        content = self._execute_command('#GetSpectrum').content
+        n, m = unpack('<II', content[:8])
+        values = array('d')
+        values.frombytes(content[8:])
+        return self.Spectra(values[:n], [values[n * (i + 1):n * (i + 2)] for i in range(m)])
+
+    @property
+    def instrument_utc_date_time(self):
+        return datetime.utcnow()
+
+    @instrument_utc_date_time.setter
+    def instrument_utc_date_time(self, value):
+        pass
+
+
+class FakeNetpingServer:
+    """
+    Имитатор управляемой розетки NetPing, HTTP-команды relay.cgi:
+        relay.cgi?rN        - состояние розетки N: relay_result('ok', <состояние>, 0)
+        relay.cgi?rN=0 / 1  - выключить / включить
+        relay.cgi?rN=f,T    - выключить на T секунд, затем включить
+    on_power_off(num) и on_power_on(num) вызываются при выключении и включении розетки,
+    например чтобы FakeHyperionServer не отвечал, пока питание выключено и прибор загружается
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, num_of_sockets=2):
+        self.response_delay_sec = 0.0
+        self.requests = []  # журнал полученных запросов
+        self.on_power_off = None
+        self.on_power_on = None
+        self._off_until = {n: 0.0 for n in range(1, num_of_sockets + 1)}
+        self._power_on_timers = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.respond(self.path)
+                body = body.encode('ascii')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self.address, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def socket_is_on(self, num):
+        return time.monotonic() >= self._off_until[num]
+
+    def _power_off(self, num, duration_sec=None):
+        self._cancel_power_on(num)
+        self._off_until[num] = float('inf')
+        if self.on_power_off:
+            self.on_power_off(num)
+        if duration_sec is not None:
+            timer = threading.Timer(duration_sec, self._power_on, (num,))
+            timer.daemon = True
+            self._power_on_timers[num] = timer
+            timer.start()
+
+    def _power_on(self, num):
+        self._cancel_power_on(num)
+        if self.socket_is_on(num):
+            return
+        self._off_until[num] = 0.0
+        if self.on_power_on:
+            self.on_power_on(num)
+
+    def _cancel_power_on(self, num):
+        timer = self._power_on_timers.pop(num, None)
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+
+    def respond(self, path):
+        """
+        :return: (HTTP status, ответ)
+        """
+        self.requests.append(path)
+        if self.response_delay_sec:
+            time.sleep(self.response_delay_sec)
+
+        url = urlsplit(path)
+        if url.path != '/relay.cgi' or not url.query.startswith('r'):
+            return 404, 'unknown command'
+        relay, _, command = url.query[1:].partition('=')
+        try:
+            num = int(relay)
+            if num not in self._off_until:
+                raise ValueError
+            if command == '1':
+                self._power_on(num)
+            elif command == '0':
+                self._power_off(num)
+            elif command.startswith('f,'):
+                self._power_off(num, float(command[2:]))
+            elif command:
+                raise ValueError
+        except ValueError:
+            return 200, "relay_result('error')"
+        return 200, f"relay_result('ok', {int(self.socket_is_on(num))}, 0)"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeNetpingServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        for num in list(self._power_on_timers):
+            self._cancel_power_on(num)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class NetpingHttpClient:
+    """
+    Клиент розетки по HTTP-командам relay.cgi с методами netpingrelay.NetpingRelay, которые использует программа
+    :param address: 'host' или 'host:port'
+    """
+
+    def __init__(self, address, timeout_sec=2.0):
+        self.address = address
+        self.timeout_sec = timeout_sec
+
+    def _command(self, query):
+        with urlopen(f'http://{self.address}/relay.cgi?{query}', timeout=self.timeout_sec) as response:
+            answer = response.read().decode('ascii')
+        if not answer.startswith("relay_result('ok'"):
+            raise RuntimeError(answer)
+        return answer
+
+    def check_connection(self):
+        """
+        :return: True или описание ошибки
+        """
+        try:
+            self._command('r1')
+        except Exception as e:
+            return str(e)
+        return True
+
+    def reset_socket(self, num, duration_sec):
+        self._command(f'r{num}=f,{duration_sec}')
+
+    def socket_on(self, num):
+        self._command(f'r{num}=1')
+
+    def socket_off(self, num):
+        self._command(f'r{num}=0')
+
+
+class LocalServiceController(ServiceController):
+    """
+    Служба УПК внутри процесса - замена службы Windows с теми же переходами состояний
+    stop_delay_sec / start_delay_sec - сколько служба останавливается / запускается,
+    hang_on_stop - служба не останавливается сама, только после kill,
+    fail_on_start - служба останавливается сразу после запуска.
+    on_stop(service_name) / on_start(service_name) вызываются, когда служба остановилась / запустилась
+    """
+
+    name = 'local'
+
+    def __init__(self, stop_delay_sec=0.0, start_delay_sec=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.stop_delay_sec = stop_delay_sec
+        self.start_delay_sec = start_delay_sec
+        self.hang_on_stop = False
+        self.fail_on_start = False
+        self.history = []  # (time.monotonic(), команда, имя службы)
+        self.on_stop = None
+        self.on_start = None
+        self._services = {}  # имя службы -> (состояние, время завершения перехода)
+
+    def current_state(self, service_name):
+        state, done_time = self._services.get(service_name, ('running', 0.0))
+        if state.endswith('_pending') and time.monotonic() >= done_time:
+            if state == 'stop_pending' or self.fail_on_start:
+                self._set_state(service_name, 'stopped')
+            else:
+                self._set_state(service_name, 'running')
+            state = self._services[service_name][0]
+        return state
+
+    def _set_state(self, service_name, state, done_time=0.0):
+        self._services[service_name] = (state, done_time)
+        if state == 'stopped' and self.on_stop:
+            self.on_stop(service_name)
+        elif state == 'running' and self.on_start:
+            self.on_start(service_name)
+
+    async def query_state(self, service_name):
+        return self.current_state(service_name)
+
+    async def send_stop(self, service_name):
+        self.history.append((time.monotonic(), 'stop', service_name))
+        if self.current_state(service_name) != 'running':
+            return ERROR_SERVICE_NOT_ACTIVE
+        done_time = float('inf') if self.hang_on_stop else time.monotonic() + self.stop_delay_sec
+        self._services[service_name] = ('stop_pending', done_time)
+        return 0
+
+    async def send_start(self, service_name):
+        self.history.append((time.monotonic(), 'start', service_name))
+        if self.current_state(service_name) != 'stopped':
+            return ERROR_SERVICE_ALREADY_RUNNING
+        self._services[service_name] = ('start_pending', time.monotonic() + self.start_delay_sec)
+        return 0
+
+    async def kill(self, service_name):
+        self.history.append((time.monotonic(), 'kill', service_name))
+        self._set_state(service_name, 'stopped')
+
+
+class SyntheticDataWriter(threading.Thread):
+    """
+    Запись данных в папку с заданной скоростью, как это делает служба УПК
+    Данные дописываются в текущий файл каждые interval_sec; при достижении file_size_bytes начинается
+    новый файл, при max_files файлов самый старый удаляется (ротация)
+    """
+
+    def __init__(self, dir_path, rate_bytes_per_sec, file_size_bytes=1024 * 1024, interval_sec=0.1,
+                 max_files=None, file_name_template='data_{:06d}.txt'):
+        super().__init__(name='SyntheticDataWriter', daemon=True)
+        self.dir_path = dir_path
+        self.rate_bytes_per_sec = rate_bytes_per_sec
+        self.file_size_bytes = file_size_bytes
+        self.interval_sec = interval_sec
+        self.max_files = max_files
+        self.file_name_template = file_name_template
+
+        self.bytes_written = 0
+        self.file_names = []  # файлы, которые еще не удалены ротацией
+        self.files_created = 0
+        self._paused = threading.Event()
+        self._stall_until = 0.0
+        self._stop_event = threading.Event()
+        os.makedirs(dir_path, exist_ok=True)
+
+    def prefill(self, num_of_files, file_size_bytes):
+        """
+        Создание num_of_files файлов заданного размера - папка с накопленными данными
+        """
+        chunk = b'0' * file_size_bytes
+        for _ in range(num_of_files):
+            self._new_file()
+            with open(self.file_names[-1], 'wb') as f:
+                f.write(chunk)
+        return self
+
+    def _new_file(self):
+        # номер - по всем созданным файлам: после ротации имена не повторяются
+        self.file_names.append(os.path.join(self.dir_path, self.file_name_template.format(self.files_created)))
+        self.files_created += 1
+        if self.max_files and len(self.file_names) > self.max_files:
+            file_name = self.file_names.pop(0)
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+    def write(self, size):
+        """
+        Дописать size байт в текущий файл
+        """
+        if not self.file_names:
+            self._new_file()
+        while size > 0:
+            current = self.file_names[-1]
+            current_size = os.path.getsize(current) if os.path.exists(current) else 0
+            if current_size >= self.file_size_bytes:
+                self._new_file()
+                continue
+            chunk = min(size, self.file_size_bytes - current_size)
+            with open(current, 'ab') as f:
+                f.write(b'1' * chunk)
+            self.bytes_written += chunk
+            size -= chunk
+
+    def pause(self):
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+
+    def stall(self, duration_sec):
+        """
+        Остановка записи на duration_sec - имитация зависания службы
+        """
+        self._stall_until = time.monotonic() + duration_sec
+
+    def run(self):
+        debt = 0.0
+        last = time.monotonic()
+        while not self._stop_event.wait(self.interval_sec):
+            now = time.monotonic()
+            if self._paused.is_set() or now < self._stall_until:
+                debt = 0.0
+            else:
+                debt += self.rate_bytes_per_sec * (now - last)
+                if debt >= 1:
+                    self.write(int(debt))
+                    debt -= int(debt)
+            last = now
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def sim_config(data_dir_path, **options):
+    """
+    Настройки пары УПК/ИТО для имитации: короткие паузы, ИТО и розетка на localhost
+    :param options: параметры, заменяющие значения по умолчанию (без разделения по секциям)
+    :return: configparser.ConfigParser в формате UPK_supervisor.ini
+    """
+    sections = {
+        'main': {'ini_file_version': '', 'instrument_description_filename': 'instrument_description.json',
+                 'ITO_rebooting_duration_sec': '0', 'win_service_restart_pause': '0.1',
+                 'spectrum_file_format': 'npy', 'action_step_timeout_sec': '10',
+                 'state_dir_path': data_dir_path.rstrip('\\/') + '_state'},
+        'netping': {'netping_relay_address': '', 'netping_relay_ito_socket_num': '1'},
+        'trigger1': {'service_name': 'UPK_sim', 'data_dir_path': data_dir_path, 'files_template': '*.txt',
+                     'dir_size_speed_threshold_mb_per_h': '1', 'dir_check_interval_sec': '1',
+                     'num_of_triggers_before_action': '2', 'num_of_service_restarts_before_ito_reboot': '0',
+                     'max_unsuccessful_reboots': '3', 'dir_watch_mode': 'auto', 'data_stall_timeout_sec': '0',
+                     'speed_estimator': 'mean', 'speed_window': '5', 'speed_ewma_alpha': '0.3',
+                     'service_control': 'auto', 'service_stop_timeout_sec': '10', 'service_start_timeout_sec': '10',
+                     'service_kill_timeout_sec': '2', 'readiness_timeout_sec': '0', 'readiness_window_sec': '2',
+                     'readiness_poll_interval_sec': '0.1', 'recovery_levels': 'service, reboot, netping',
+                     'recovery_backoff_sec': '600', 'recovery_backoff_max_sec': '21600', 'streams': '',
+                     'stream_key_pattern': '', 'stream_speed_threshold_mb_per_h': ''},
+        'trigger2': {'win_service_restart_interval_sec': '0', 'ito_datetime_source': '0'},
+    }
+    for key, value in options.items():
+        section = next((name for name, values in sections.items() if key in values), 'main')
+        sections[section][key] = str(value)
+
+    config = configparser.ConfigParser()
+    config.optionxform = str  # имена параметров с заглавными буквами, как в ini-файле
+    config.read_dict(sections)
+    return config
+
+
+class SimulatedInstrument:
+    """
+    Пара УПК/ИТО на имитаторах: FakeHyperionServer, FakeNetpingServer, LocalServiceController
+    и SyntheticDataWriter, который пишет данные, пока служба запущена
+    :param data_dir_path: папка с данными
+    :param rate_bytes_per_sec: скорость записи данных работающей службой
+    :param netping: использовать розетку для перезагрузки ИТО
+    :param options: параметры ini-файла, см. sim_config
+    """
+
+    def __init__(self, data_dir_path, rate_bytes_per_sec=10000, netping=True, service_delay_sec=0.0, **options):
+        # InstrumentSupervisor импортируется здесь - имитаторы ИТО и розетки не требуют numpy
+        from upk_instrument import InstrumentSettings, InstrumentSupervisor
+        from upk_ito import ItoSession
+
+        self.ito_server = FakeHyperionServer()
+        self.netping_server = FakeNetpingServer()
+        # без питания ИТО не отвечает, после включения - загружается reboot_duration_sec
+        self.netping_server.on_power_off = lambda num: self.ito_server.set_down(float('inf'))
+        self.netping_server.on_power_on = lambda num: self.ito_server.set_down(self.ito_server.reboot_duration_sec)
+
+        self.writer = SyntheticDataWriter(data_dir_path, rate_bytes_per_sec)
+
+        if netping:
+            options.setdefault('netping_relay_address', f'{self.netping_server.address}:{self.netping_server.port}')
+        self.settings = InstrumentSettings(sim_config(data_dir_path, **options))
+        with open(self.settings.instrument_description_filename, 'w') as f:
+            json.dump({'IP_address': self.ito_server.address}, f)
+
+        s = self.settings
+        self.service_controller = LocalServiceController(service_delay_sec, service_delay_sec,
+                                                         stop_timeout_sec=s.service_stop_timeout_sec,
+                                                         start_timeout_sec=s.service_start_timeout_sec,
+                                                         kill_timeout_sec=s.service_kill_timeout_sec)
+        self.service_controller.on_stop = lambda name: self.writer.pause()
+        self.service_controller.on_start = lambda name: self.writer.resume()
+
+        port = self.ito_server.port
+        self.supervisor = InstrumentSupervisor(
+            self.settings,
+            service_controller=self.service_controller,
+            ito_session_factory=lambda address: ItoSession(address, port=port,
+                                                           instrument_factory=lambda a: FakeHyperionClient(a, port)),
+            relay_factory=NetpingHttpClient)
+
+    def start(self):
+        self.ito_server.start()
+        self.netping_server.start()
+        self.writer.start()
+        return self
+
+    def stop(self):
+        self.writer.stop()
+        self.netping_server.stop()
+        self.ito_server.stop()
+        self.supervisor.ito_executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
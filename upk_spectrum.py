@@ -0,0 +1,93 @@
+"""
+Сохранение и чтение спектров ИТО
+
+Спектр хранится одним непрерывным массивом: первый столбец - длины волн, далее по столбцу
+на каждый канал (та же раскладка, что в текстовом файле *_spectrum.txt).
+Форматы:
+    txt - текст с табуляциями, как раньше
+    npy - массив NumPy, читается с отображением в память без загрузки целиком
+    npz - массив NumPy со сжатием
+
+Запуск из командной строки переводит npy/npz-файлы в текст:
+    python upk_spectrum.py 20211019120000_spectrum.npy [...]
+"""
+
+import os
+import sys
+
+# numpy импортируется в функциях при первом сохранении спектра - запуск программы не ждет его загрузки
+
+spectrum_file_formats = ('txt', 'npy', 'npz')
+
+
+def spectrum_to_array(wavelengths, data):
+    """
+    :param wavelengths: длины волн, N значений
+    :param data: спектры каналов, M массивов по N значений
+    :return: массив N x (1 + M)
+    """
+    import numpy as np
+    return np.column_stack((np.asarray(wavelengths), *np.atleast_2d(np.asarray(data))))
+
+
+def save_spectrum(file_name_without_ext, wavelengths, data, file_format='npy'):
+    """
+    Сохранение спектра
+    :param file_name_without_ext: имя файла без расширения
+    :param file_format: txt, npy, npz
+    :return: имя сохраненного файла
+    """
+    if file_format not in spectrum_file_formats:
+        raise ValueError(f'Unknown spectrum file format "{file_format}", expected one of {", ".join(spectrum_file_formats)}')
+    import numpy as np
+
+    spectrum = spectrum_to_array(wavelengths, data)
+    file_name = f'{file_name_without_ext}.{file_format}'
+
+    if file_format == 'npy':
+        np.save(file_name, spectrum)
+    elif file_format == 'npz':
+        np.savez_compressed(file_name, spectrum=spectrum)
+    else:
+        save_spectrum_text(file_name, spectrum)
+
+    return file_name
+
+
+def save_spectrum_text(file_name, spectrum):
+    # str() каждого значения - как в прежнем формате *_spectrum.txt
+    import numpy as np
+    np.savetxt(file_name, spectrum, fmt='%s', delimiter='\t')
+
+
+def load_spectrum(file_name, mmap=True):
+    """
+    Чтение спектра
+    :param file_name: файл npy, npz или txt
+    :param mmap: для npy - отображение файла в память вместо чтения
+    :return: массив N x (1 + M): длины волн и спектры каналов по столбцам
+    """
+    import numpy as np
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext == '.npy':
+        return np.load(file_name, mmap_mode='r' if mmap else None)
+    if ext == '.npz':
+        with np.load(file_name) as f:
+            return f['spectrum']
+    return np.loadtxt(file_name, delimiter='\t', ndmin=2)
+
+
+def export_spectrum_text(file_name, txt_file_name=None):
+    """
+    Перевод спектра npy/npz в текстовый формат *_spectrum.txt
+    :return: имя текстового файла
+    """
+    if txt_file_name is None:
+        txt_file_name = os.path.splitext(file_name)[0] + '.txt'
+    save_spectrum_text(txt_file_name, load_spectrum(file_name))
+    return txt_file_name
+
+
+if __name__ == "__main__":
+    for cur_file_name in sys.argv[1:]:
+        print(export_spectrum_text(cur_file_name))
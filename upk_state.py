@@ -0,0 +1,155 @@
+"""
+Состояние триггеров между запусками UPK_supervisor
+
+Счетчики триггеров и перезагрузок, размер папки на последней проверке, время последних данных
+и последнего срабатывания trigger2 хранятся в двоичном файле фиксированного размера.
+В файле два слота под одну запись; новая запись пишется в слот, не содержащий последнюю
+удачную запись, поэтому сбой во время записи портит только ее - при чтении выбирается
+целая запись (контрольная сумма CRC32) с наибольшим номером. Запись - один write и fsync без
+переименования файлов, ее можно делать на каждой проверке. fsync нужен, чтобы при пропадании
+питания запись не осталась только в кэше ОС - иначе после перезагрузки компьютера
+прочитается более старое состояние.
+"""
+
+import logging
+import os
+import struct
+import zlib
+
+from upk_recovery import recovery_levels
+
+state_magic = b'UPKS'
+state_version = 2
+# версия 1 - то же без recovery_level (на его месте было выравнивание, всегда 0); такие записи читаются
+state_versions_supported = (1, 2)
+
+# magic, version, flags, seq, cur_num_of_triggers, num_of_service_restarts, cur_unsuccessful_reboots, recovery_level,
+# total_size, bytes_written, sample_time, last_data_time, trigger2_time; далее CRC32
+# recovery_level - номер уровня в recovery_levels + 1, 0 - сбоя нет
+state_record = struct.Struct('<4sHHQIIIIQQddd')
+state_crc = struct.Struct('<I')
+state_slot_size = state_record.size + state_crc.size
+
+
+class SupervisorState:
+    """
+    Состояние одной пары УПК/ИТО; время - по часам компьютера (time.time()), 0 - неизвестно
+    """
+
+    __slots__ = ('seq', 'cur_num_of_triggers', 'num_of_service_restarts', 'cur_unsuccessful_reboots', 'recovery_level',
+                 'total_size', 'bytes_written', 'sample_time', 'last_data_time', 'trigger2_time')
+
+    def __init__(self):
+        self.seq = 0
+        self.cur_num_of_triggers = 0
+        self.num_of_service_restarts = 0  # действий на текущем уровне восстановления
+        self.cur_unsuccessful_reboots = 0
+        self.recovery_level = ''  # уровень восстановления (upk_recovery), '' - сбоя нет
+        self.total_size = 0  # размер файлов данных на последней проверке, байт
+        self.bytes_written = 0
+        self.sample_time = 0.0  # время последней проверки папки
+        self.last_data_time = 0.0  # время последнего появления новых данных
+        self.trigger2_time = 0.0  # время последнего срабатывания trigger2
+
+    def pack(self):
+        record = state_record.pack(state_magic, state_version, 0, self.seq, self.cur_num_of_triggers,
+                                   self.num_of_service_restarts, self.cur_unsuccessful_reboots,
+                                   recovery_levels.index(self.recovery_level) + 1 if self.recovery_level else 0,
+                                   self.total_size, self.bytes_written,
+                                   self.sample_time, self.last_data_time, self.trigger2_time)
+        return record + state_crc.pack(zlib.crc32(record))
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        :return: SupervisorState или None, если запись повреждена или неизвестной версии
+        """
+        if len(data) < state_slot_size:
+            return None
+        record = data[:state_record.size]
+        if state_crc.unpack_from(data, state_record.size)[0] != zlib.crc32(record):
+            return None
+        (magic, version, _, seq, cur_num_of_triggers, num_of_service_restarts, cur_unsuccessful_reboots, recovery_level,
+         total_size, bytes_written, sample_time, last_data_time, trigger2_time) = state_record.unpack(record)
+        if magic != state_magic or version not in state_versions_supported:
+            return None
+        if version == 1:
+            recovery_level = 0
+        elif recovery_level > len(recovery_levels):
+            return None
+
+        state = cls()
+        state.seq = seq
+        state.cur_num_of_triggers = cur_num_of_triggers
+        state.num_of_service_restarts = num_of_service_restarts
+        state.cur_unsuccessful_reboots = cur_unsuccessful_reboots
+        if recovery_level:
+            state.recovery_level = recovery_levels[recovery_level - 1]
+        state.total_size = total_size
+        state.bytes_written = bytes_written
+        state.sample_time = sample_time
+        state.last_data_time = last_data_time
+        state.trigger2_time = trigger2_time
+        return state
+
+    def __repr__(self):
+        return 'SupervisorState(' + ', '.join(f'{k}={getattr(self, k)}' for k in self.__slots__) + ')'
+
+
+class StateFile:
+    """
+    Файл состояния из двух слотов
+    """
+
+    def __init__(self, file_name, log=logging):
+        self.file_name = file_name
+        self.log = log
+        self._f = None
+        self._seq = 0
+
+    def load(self):
+        """
+        :return: последняя целая запись SupervisorState или None
+        """
+        try:
+            with open(self.file_name, 'rb') as f:
+                data = f.read(2 * state_slot_size)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self.log.error(f'State file {self.file_name} reading error: {e.__doc__}')
+            return None
+
+        states = [s for s in (SupervisorState.unpack(data[i * state_slot_size:(i + 1) * state_slot_size])
+                              for i in range(2)) if s is not None]
+        if not states:
+            self.log.info(f'State file {self.file_name} is damaged, ignored')
+            return None
+        state = max(states, key=lambda s: s.seq)
+        self._seq = state.seq
+        return state
+
+    def save(self, state):
+        """
+        Запись состояния в слот, не занятый последней записью
+        """
+        self._seq += 1
+        state.seq = self._seq
+        try:
+            if self._f is None:
+                mode = 'r+b' if os.path.isfile(self.file_name) else 'w+b'
+                self._f = open(self.file_name, mode, buffering=0)
+            self._f.seek((state.seq % 2) * state_slot_size)
+            self._f.write(state.pack())
+            os.fsync(self._f.fileno())
+        except OSError as e:
+            self.log.error(f'State file {self.file_name} writing error: {e.__doc__}')
+            self.close()
+
+    def close(self):
+        if self._f is not None:
+            try:
+                self._f.close()
+            except OSError:
+                pass
+            self._f = None